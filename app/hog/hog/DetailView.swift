@@ -228,19 +228,27 @@ class ValueManager: LoadingClass, ObservableObject{
         if self.lookBackTime == 0 {
             topQuery = """
                 SELECT name
-                FROM top_processes
-                GROUP BY name
-                ORDER BY SUM(energy_impact) DESC
-                LIMIT 1; -- to get only the top name
+                FROM process_names
+                WHERE id = (
+                    SELECT name_id
+                    FROM process_history
+                    GROUP BY name_id
+                    ORDER BY SUM(energy_impact) DESC
+                    LIMIT 1 -- to get only the top name
+                );
                 """
         }else{
             topQuery = """
                 SELECT name
-                FROM top_processes
-                WHERE time >= ((CAST(strftime('%s', 'now') AS INTEGER) * 1000) - \(self.lookBackTime))
-                GROUP BY name
-                ORDER BY SUM(energy_impact) DESC
-                LIMIT 1; -- to get only the top name
+                FROM process_names
+                WHERE id = (
+                    SELECT name_id
+                    FROM process_history
+                    WHERE time >= ((CAST(strftime('%s', 'now') AS INTEGER) * 1000) - \(self.lookBackTime))
+                    GROUP BY name_id
+                    ORDER BY SUM(energy_impact) DESC
+                    LIMIT 1 -- to get only the top name
+                );
                 """
         }
 
@@ -350,25 +358,39 @@ class TopProcessData: LoadingClass, Identifiable, ObservableObject, RandomAccess
         if self.lookBackTime == 0 {
             queryString = """
                 SELECT
-                    name,
-                    SUM(energy_impact) AS total_energy_impact,
-                    AVG(cputime_per) AS average_cputime_per
-                FROM
-                    top_processes
-                GROUP BY
-                    name
+                    n.name,
+                    p.total_energy_impact,
+                    p.average_cputime_per
+                FROM (
+                    SELECT
+                        name_id,
+                        SUM(energy_impact) AS total_energy_impact,
+                        AVG(cputime_per) AS average_cputime_per
+                    FROM
+                        process_history
+                    GROUP BY
+                        name_id
+                    ORDER BY
+                        total_energy_impact DESC
+                    LIMIT 50
+                ) p
+                JOIN process_names n ON n.id = p.name_id
                 ORDER BY
-                    total_energy_impact DESC
-                LIMIT 50;
+                    p.total_energy_impact DESC;
                 """
         } else {
             queryString = """
-                SELECT name, SUM(energy_impact), AVG(cputime_per)
-                FROM top_processes
-                WHERE time >= ((CAST(strftime('%s', 'now') AS INTEGER) * 1000) - \(self.lookBackTime))
-                GROUP BY name
-                ORDER BY SUM(energy_impact) DESC
-                LIMIT 50;
+                SELECT n.name, p.total_energy_impact, p.average_cputime_per
+                FROM (
+                    SELECT name_id, SUM(energy_impact) AS total_energy_impact, AVG(cputime_per) AS average_cputime_per
+                    FROM process_history
+                    WHERE time >= ((CAST(strftime('%s', 'now') AS INTEGER) * 1000) - \(self.lookBackTime))
+                    GROUP BY name_id
+                    ORDER BY total_energy_impact DESC
+                    LIMIT 50
+                ) p
+                JOIN process_names n ON n.id = p.name_id
+                ORDER BY p.total_energy_impact DESC;
             """
         }
         if sqlite3_prepare_v2(db, queryString, -1, &queryStatement, nil) == SQLITE_OK {
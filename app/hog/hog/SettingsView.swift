@@ -146,7 +146,11 @@ class SettingsManager: ObservableObject {
             sqlite3_finalize(queryStatement)
         }
 
-        let uploadCountQuery = "SELECT COUNT(*) FROM measurements WHERE uploaded = 0;"
+        let uploadCountQuery = """
+            SELECT
+                (SELECT COUNT(*) FROM measurements WHERE uploaded = 0) +
+                (SELECT COUNT(*) FROM power_measurements WHERE id > (SELECT last_id FROM upload_status));
+            """
         var new_upload_backlog: Int = 0
 
         if sqlite3_prepare_v2(db, uploadCountQuery, -1, &queryStatement, nil) == SQLITE_OK {
@@ -0,0 +1,85 @@
+"""
+Flags processes whose energy impact suddenly jumps, like a runaway Spotlight indexer or a stuck VM, as the samples
+come in.
+
+For every process name we keep an exponentially weighted mean and variance of its energy impact per second, so the
+sampling interval doesn't matter. A process is flagged if it is more than `threshold` standard deviations above its
+mean. Only the processes in a sample are looked at so a sample costs O(processes in it) and nothing is read from the
+DB. The flagged value is still added to the mean, so a process that stays high becomes the new normal after a few
+samples and we don't flag it forever.
+
+The state is bounded to max_processes names. When a new name comes in the one that was seen the longest time ago is
+forgotten. A name needs `warmup` samples before it can be flagged so a process isn't an anomaly just because it is new.
+"""
+
+import math
+import collections
+
+ALPHA = 0.1
+WARMUP = 10
+# In energy impact per second. Without this a process that always had the same value would be flagged for any change.
+MIN_STD = 1.0
+
+
+class EwmaDetector:
+
+    def __init__(self, threshold=4.0, max_processes=1000, alpha=ALPHA, warmup=WARMUP):
+        if not 0 < alpha <= 1:
+            raise ValueError(f"alpha must be in (0, 1], not {alpha}")
+        self.threshold = threshold
+        self.max_processes = max(1, max_processes)
+        self.alpha = alpha
+        self.warmup = warmup
+        # name -> [mean, variance, samples]
+        self.state = collections.OrderedDict()
+        self.counters = {
+            'observed': 0,
+            'anomalies': 0,
+            'evicted': 0,
+        }
+
+    def observe(self, name, value):
+        # Returns the mean before this value and the z-score if the value is an anomaly
+        self.counters['observed'] += 1
+        state = self.state.get(name)
+        if state is None:
+            if len(self.state) >= self.max_processes:
+                self.state.popitem(last=False)
+                self.counters['evicted'] += 1
+            self.state[name] = [value, 0.0, 1]
+            return value, None
+
+        self.state.move_to_end(name)
+        mean, variance, samples = state
+        score = (value - mean) / max(math.sqrt(variance), MIN_STD)
+
+        # Incremental EWMA of the mean and variance (Finch, "Incremental calculation of weighted mean and variance")
+        diff = value - mean
+        increment = self.alpha * diff
+        state[0] = mean + increment
+        state[1] = (1 - self.alpha) * (variance + diff * increment)
+        state[2] = samples + 1
+
+        if samples >= self.warmup and score > self.threshold:
+            self.counters['anomalies'] += 1
+            return mean, score
+        return mean, None
+
+    def detect(self, time_ms, top_processes, elapsed_ns):
+        # Returns an event for every process in the sample that is an anomaly
+        if not elapsed_ns:
+            return []
+        elapsed_s = elapsed_ns / 1_000_000_000
+
+        events = []
+        for p in top_processes:
+            mean, score = self.observe(p['name'], (p['energy_impact'] or 0) / elapsed_s)
+            if score is not None:
+                events.append({
+                    'time': time_ms,
+                    'name': p['name'],
+                    'energy_impact': p['energy_impact'],
+                    'expected': round(mean * elapsed_s),
+                    'score': score,
+                })
+        return events
@@ -0,0 +1,80 @@
+"""
+Splits the energy of a sample in mJ over all coalitions so we can tell how many joules an app used and not only its
+energy impact.
+
+Every coalition gets a share in proportion to its energy_impact_per_s. If no coalition has any energy impact we split
+by cputime_ms_per_s instead. The shares are whole mJ and always add up to exactly the energy of the sample: every
+coalition gets the integer part of its share and the mJ that are left are handed out to the coalitions with the
+biggest remainders (largest remainder method). The weights are turned into integers first so this is exact integer
+math in both implementations and NumPy and the fallback give the same result. Whether we split by energy impact is
+decided on these integers, an energy impact that rounds to 0 for every coalition splits by cpu time.
+
+The columns are array.array so without NumPy the per coalition work is a few list comprehensions over C arrays.
+"""
+
+import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# The per second values have a few decimals. Scaling them up keeps the precision when they become integers.
+WEIGHT_SCALE = 1_000
+
+
+def weight_columns(coalitions):
+    energy_impact = array.array('d', (c.get('energy_impact_per_s') or 0 for c in coalitions))
+    cputime = array.array('d', (c.get('cputime_ms_per_s') or 0 for c in coalitions))
+    return energy_impact, cputime
+
+
+def scale(weights, use_numpy=True):
+    # Returns the weights as the integers split works with
+    if use_numpy and np is not None:
+        return np.rint(np.maximum(np.frombuffer(weights, dtype=np.float64), 0) * WEIGHT_SCALE).astype(np.int64)
+    return [round(max(v, 0) * WEIGHT_SCALE) for v in weights]
+
+
+def split(total, weights, use_numpy=True):
+    # Returns the integer shares of total in proportion to weights. They add up to total if any weight is > 0 once
+    # scaled.
+    return split_scaled(total, scale(weights, use_numpy))
+
+
+def split_scaled(total, w):
+    if np is not None and isinstance(w, np.ndarray):
+        weight_sum = int(w.sum())
+        if total <= 0 or weight_sum == 0:
+            return [0] * len(w)
+        shares = total * w
+        base = shares // weight_sum
+        left = total - int(base.sum())
+        # Stable so equal remainders go to the first coalitions in both implementations
+        base[np.argsort(-(shares % weight_sum), kind='stable')[:left]] += 1
+        return base.tolist()
+
+    weight_sum = sum(w)
+    if total <= 0 or weight_sum == 0:
+        return [0] * len(w)
+    shares = [total * v for v in w]
+    base = [s // weight_sum for s in shares]
+    left = total - sum(base)
+    for i in sorted(range(len(w)), key=lambda i: -(shares[i] % weight_sum))[:left]:
+        base[i] += 1
+    return base
+
+
+def attribute(coalitions, total, use_numpy=True):
+    # Returns the mJ of every coalition in the order of coalitions
+    energy_impact, cputime = weight_columns(coalitions)
+    return attribute_columns(energy_impact, cputime, total, use_numpy)
+
+
+def attribute_columns(energy_impact, cputime, total, use_numpy=True):
+    # The same for columns we already have, like those of libs/sample.py. An energy impact can be > 0 and still round
+    # to 0 once scaled, so we only split by it if the scaled weights are not all 0.
+    weights = scale(energy_impact, use_numpy)
+    if any(weights):
+        return split_scaled(total, weights)
+    return split(total, cputime, use_numpy)
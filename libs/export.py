@@ -0,0 +1,112 @@
+"""
+Streams a table of the local DB out as NDJSON or CSV so it can be looked at with other tools.
+
+The rows are read with fetchmany in chunks of chunk_rows and every chunk is written out before the next one is read,
+so the memory use doesn't depend on the size of the DB. The data column of measurements holds the upload record as
+zlib compressed and base64 encoded JSON. It is decoded on the fly and written as an object in NDJSON and as JSON text
+in CSV. If it can't be decoded the value is written as it is. BLOBs like the quantile sketches are written as base64.
+
+Turning the rows into text, and the decoding, is most of the work. With jobs > 1 the chunks are encoded in a process
+pool. At most 2 * jobs chunks are in flight and they are written in the order they were read, so the output is the
+same as with one job.
+"""
+
+import io
+import csv
+import json
+import zlib
+import base64
+import binascii
+import collections
+import concurrent.futures
+
+FORMATS = ['ndjson', 'csv']
+CHUNK_ROWS = 10_000
+
+# Columns that hold an encoded upload record
+ENCODED_COLUMNS = {
+    'measurements': 'data',
+}
+
+
+def decode_payload(value):
+    try:
+        return json.loads(zlib.decompress(base64.b64decode(value)))
+    except (binascii.Error, zlib.error, ValueError, TypeError):
+        return value
+
+
+def table_columns(cursor, table):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?", (table,))
+    if not cursor.fetchone():
+        raise ValueError(f"There is no table {table}")
+    cursor.execute(f'PRAGMA table_info("{table}")')
+    return [row[1] for row in cursor.fetchall()]
+
+
+def encode_chunk(rows, columns, fmt, decode_index=None):
+    # Returns the rows as NDJSON or CSV text. This runs in the process pool so it only gets what it needs.
+    out = io.StringIO()
+    if fmt == 'ndjson':
+        for row in rows:
+            record = {column: base64.b64encode(value).decode() if isinstance(value, bytes) else value
+                      for column, value in zip(columns, row)}
+            if decode_index is not None and row[decode_index] is not None:
+                record[columns[decode_index]] = decode_payload(row[decode_index])
+            out.write(json.dumps(record))
+            out.write('\n')
+        return out.getvalue()
+
+    writer = csv.writer(out, lineterminator='\n')
+    for row in rows:
+        values = [base64.b64encode(value).decode() if isinstance(value, bytes) else value for value in row]
+        if decode_index is not None and row[decode_index] is not None:
+            decoded = decode_payload(row[decode_index])
+            values[decode_index] = decoded if isinstance(decoded, str) else json.dumps(decoded)
+        writer.writerow(values)
+    return out.getvalue()
+
+
+def export(cursor, out, table, start_ms=None, end_ms=None, fmt='ndjson', jobs=1, decode=True, chunk_rows=CHUNK_ROWS):
+    # Writes the rows of table with start_ms <= time < end_ms to out and returns how many there were
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt}, use one of {', '.join(FORMATS)}")
+    columns = table_columns(cursor, table)
+
+    query = f'SELECT * FROM "{table}"'
+    params = ()
+    if start_ms is not None or end_ms is not None:
+        if 'time' not in columns:
+            raise ValueError(f"{table} has no time column so it can't be exported for a time range")
+        query += ' WHERE time >= ? AND time < ?'
+        params = (start_ms or 0, 2**62 if end_ms is None else end_ms)
+
+    decode_index = None
+    if decode and ENCODED_COLUMNS.get(table) in columns:
+        decode_index = columns.index(ENCODED_COLUMNS[table])
+
+    if fmt == 'csv':
+        csv.writer(out, lineterminator='\n').writerow(columns)
+
+    cursor.execute(query, params)
+    chunks = iter(lambda: cursor.fetchmany(chunk_rows), [])
+
+    written = 0
+    if jobs <= 1:
+        for rows in chunks:
+            out.write(encode_chunk(rows, columns, fmt, decode_index))
+            written += len(rows)
+        return written
+
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        pending = collections.deque()
+        for rows in chunks:
+            pending.append((len(rows), pool.submit(encode_chunk, rows, columns, fmt, decode_index)))
+            if len(pending) >= 2 * jobs:
+                n_rows, future = pending.popleft()
+                out.write(future.result())
+                written += n_rows
+        for n_rows, future in pending:
+            out.write(future.result())
+            written += n_rows
+    return written
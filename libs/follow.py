@@ -0,0 +1,151 @@
+"""
+Follows a file that another process keeps appending powermetrics output to, like `tail -F`.
+
+Lines are only handed out once they are complete, together with the inode and the offset right after them. If the
+caller stores the offset of the last line it ingested it can continue from there after a restart without reading the
+file again. Only the current line is ever held in memory.
+
+The file can be rotated. When we are at the end of the file and there is a new file under the path we switch to it
+and start at its beginning. If the file was truncated in place we start at the beginning again as well. on_switch is
+called then, so the caller can drop the part of a sample it holds from the old file.
+
+On Linux we wait for changes with inotify on the directory, which also tells us when a new file is created. Everywhere
+else, or if inotify can't be used, we poll.
+"""
+
+import os
+import select
+import ctypes
+import ctypes.util
+import logging
+
+POLL_INTERVAL = 0.5
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _libc.inotify_init1.argtypes = [ctypes.c_int]
+    _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+except (OSError, AttributeError):
+    _libc = None
+
+
+class Watcher:
+    # Waits until something in the directory changed or POLL_INTERVAL is over, whatever comes first
+
+    def __init__(self, directory):
+        self.fd = None
+        if _libc is None:
+            return
+        fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            logging.warning('inotify is not available (%s), polling instead', os.strerror(ctypes.get_errno()))
+            return
+        if _libc.inotify_add_watch(fd, os.fsencode(directory),
+                                   IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+            logging.warning("Can't watch %s (%s), polling instead", directory, os.strerror(ctypes.get_errno()))
+            os.close(fd)
+            return
+        self.fd = fd
+
+    def wait(self, stop_event):
+        if self.fd is None:
+            stop_event.wait(POLL_INTERVAL)
+            return
+
+        # We don't care what happened, only that something did. The timeout is there so we see the stop signal.
+        if select.select([self.fd], [], [], POLL_INTERVAL)[0]:
+            try:
+                while os.read(self.fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class Follower:
+
+    def __init__(self, path, inode=None, offset=0, on_switch=None):
+        self.path = path
+        self.on_switch = on_switch
+        self.file = None
+        self.inode = inode
+        self.offset = offset
+        self.watcher = Watcher(os.path.dirname(os.path.abspath(path)))
+
+    def _open(self):
+        try:
+            self.file = open(self.path, 'rb') # pylint: disable=consider-using-with
+        except FileNotFoundError:
+            return False
+
+        stat = os.fstat(self.file.fileno())
+        if stat.st_ino == self.inode and self.offset <= stat.st_size:
+            self.file.seek(self.offset)
+            logging.info('Continuing %s at byte %d', self.path, self.offset)
+        else:
+            if self.inode is not None:
+                logging.warning('%s was rotated or truncated since byte %d, starting at 0', self.path, self.offset)
+            self.inode = stat.st_ino
+            self.offset = 0
+        return True
+
+    def _switched(self):
+        # Called at the end of the file. Returns True if there is a new file or the file was truncated.
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            # Moved away and the new one isn't there yet
+            return False
+
+        if stat.st_ino == self.inode and stat.st_size >= self.offset:
+            return False
+
+        logging.info('%s was rotated or truncated, starting at the beginning', self.path)
+        self.file.close()
+        self.file = None
+        self.inode = None
+        self.offset = 0
+        return True
+
+    def lines(self, stop_event):
+        # Yields every complete line with the inode and the offset after it
+        partial = b''
+        while not stop_event.is_set():
+            if self.file is None and not self._open():
+                self.watcher.wait(stop_event)
+                continue
+
+            line = self.file.readline()
+            if line:
+                self.offset += len(line)
+                if line.endswith(b'\n'):
+                    yield partial + line, self.inode, self.offset
+                    partial = b''
+                else:
+                    partial += line
+                continue
+
+            if self._switched():
+                # Whatever was left of the line in the old file will never be finished
+                partial = b''
+                if self.on_switch:
+                    self.on_switch()
+                continue
+
+            self.watcher.wait(stop_event)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+        self.watcher.close()
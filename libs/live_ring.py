@@ -0,0 +1,209 @@
+"""
+A memory mapped ring buffer with the most recent samples so the app can show live values without querying the DB.
+
+The daemon is the only writer. Any number of processes can map the file read only and take snapshots without locks.
+Every part that changes uses a seqlock. The writer makes the version odd, writes and makes it even again. A reader
+copies the data and only trusts the copy if the version was even and the same before and after. Python gives us no
+memory barriers so every part also carries a crc32 of its data, which catches a reordered write on CPUs that don't
+keep the store order (arm64).
+
+Layout, all little endian:
+
+    header   magic '4s', version 'I', capacity 'I', top_processes 'I',
+             seq 'Q', count 'Q', crc 'I', totals TOTALS
+    slot     seq 'Q', number 'Q', crc 'I', RECORD, top_processes * PROCESS
+
+count is the number of samples written since the daemon started. Sample n lives in slot n % capacity and is still
+there if the slot number is n. The totals add up all samples since the start.
+"""
+
+import os
+import time
+import mmap
+import math
+import zlib
+import struct
+
+MAGIC = b'HOGR'
+VERSION = 1
+
+HEADER = struct.Struct('<4sIII')
+SEQ = struct.Struct('<QQI')
+TOTALS = struct.Struct('<qqqqqdq')
+RECORD = struct.Struct('<qqqqqqdqd16s')
+PROCESS = struct.Struct('<48sqd')
+
+TOTAL_KEYS = ['combined_energy', 'cpu_energy', 'gpu_energy', 'ane_energy', 'energy_impact', 'co2eq', 'elapsed_ns']
+RECORD_KEYS = ['time', 'combined_energy', 'cpu_energy', 'gpu_energy', 'ane_energy', 'energy_impact', 'co2eq',
+               'elapsed_ns', 'grid_intensity', 'thermal_pressure']
+
+# How often a reader tries again if the writer was in the middle of a write. After a few quick tries we back off as
+# the writer might have been scheduled out in the middle of a write.
+MAX_RETRIES = 100
+QUICK_RETRIES = 10
+RETRY_SLEEP = 0.001
+
+
+class TornRead(Exception):
+    pass
+
+
+def layout(capacity, top_processes):
+    header_size = HEADER.size + SEQ.size + TOTALS.size
+    slot_size = SEQ.size + RECORD.size + PROCESS.size * top_processes
+    return header_size, slot_size, header_size + slot_size * capacity
+
+
+def _float(value):
+    return math.nan if value is None else float(value)
+
+def _optional(value):
+    return None if math.isnan(value) else value
+
+def _text(value, size):
+    return value.encode('utf-8')[:size]
+
+def _untext(value):
+    return value.rstrip(b'\0').decode('utf-8', errors='replace')
+
+
+class RingWriter:
+
+    def __init__(self, path, capacity=60, top_processes=10):
+        self.path = path
+        self.capacity = capacity
+        self.top_processes = top_processes
+        self.header_size, self.slot_size, size = layout(capacity, top_processes)
+
+        # Shrinking a file that readers have mapped would crash them so every start writes a new file and moves it in
+        # place. Readers notice the new inode and map it again.
+        tmp_path = f"{path}.tmp"
+        fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        self.count = 0
+        self.totals = dict.fromkeys(TOTAL_KEYS, 0)
+        self._header_seq = 0
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, capacity, top_processes)
+        self._write_header()
+        os.replace(tmp_path, path)
+
+    def _write_header(self):
+        totals = TOTALS.pack(*(self.totals[k] for k in TOTAL_KEYS))
+        offset = HEADER.size
+        SEQ.pack_into(self._map, offset, self._header_seq + 1, self.count, 0)
+        self._map[offset + SEQ.size:offset + SEQ.size + TOTALS.size] = totals
+        self._header_seq += 2
+        SEQ.pack_into(self._map, offset, self._header_seq, self.count, zlib.crc32(totals, self.count))
+
+    def publish(self, record: dict, top_processes: list):
+        number = self.count
+        offset = self.header_size + (number % self.capacity) * self.slot_size
+        slot_seq = SEQ.unpack_from(self._map, offset)[0]
+
+        data = bytearray(RECORD.pack(
+            record['time'], record['combined_energy'], record['cpu_energy'], record['gpu_energy'],
+            record['ane_energy'], record['energy_impact'], _float(record['co2eq']), record['elapsed_ns'],
+            _float(record['grid_intensity']), _text(record['thermal_pressure'], 16)))
+        for i in range(self.top_processes):
+            if i < len(top_processes):
+                p = top_processes[i]
+                data += PROCESS.pack(_text(p['name'], 48), p['energy_impact'] or 0, p['cputime_ms'])
+            else:
+                data += bytes(PROCESS.size)
+
+        SEQ.pack_into(self._map, offset, slot_seq + 1, number, 0)
+        self._map[offset + SEQ.size:offset + self.slot_size] = data
+        SEQ.pack_into(self._map, offset, slot_seq + 2, number, zlib.crc32(data, number))
+
+        self.count += 1
+        for key in TOTAL_KEYS:
+            if record[key]:
+                self.totals[key] += record[key]
+        self._write_header()
+
+    def close(self):
+        self._map.close()
+
+
+class RingReader:
+
+    def __init__(self, path):
+        self.path = path
+        self._map = None
+        self._open()
+
+    def _open(self):
+        with open(self.path, 'rb') as f:
+            self._inode = os.fstat(f.fileno()).st_ino
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.capacity, self.top_processes = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path} is not a live sample ring")
+        self.header_size, self.slot_size, size = layout(self.capacity, self.top_processes)
+        if size > len(self._map):
+            raise ValueError(f"{self.path} is too small for its layout")
+
+    def _check_layout(self):
+        # The daemon writes a new ring every time it starts
+        if os.stat(self.path).st_ino != self._inode:
+            self._map.close()
+            self._open()
+
+    def _read(self, offset, size, number=None):
+        # Returns the stored number and the data or None if the slot doesn't hold sample number any more
+        for attempt in range(MAX_RETRIES):
+            if attempt >= QUICK_RETRIES:
+                time.sleep(RETRY_SLEEP)
+            seq, stored, crc = SEQ.unpack_from(self._map, offset)
+            data = self._map[offset + SEQ.size:offset + SEQ.size + size]
+            if seq % 2 == 0 and SEQ.unpack_from(self._map, offset) == (seq, stored, crc) and \
+                    zlib.crc32(data, stored) == crc:
+                if number is not None and stored != number:
+                    return None
+                return stored, data
+        raise TornRead(f"Could not get a consistent read at offset {offset}")
+
+    def totals(self):
+        self._check_layout()
+        count, data = self._read(HEADER.size, TOTALS.size)
+        return count, dict(zip(TOTAL_KEYS, TOTALS.unpack(data)))
+
+    def samples(self, last=None):
+        # Returns the most recent samples, oldest first. Samples that are overwritten while we read are skipped.
+        count, _ = self.totals()
+        last = self.capacity if last is None else min(last, self.capacity)
+
+        samples = []
+        for number in range(max(0, count - last), count):
+            offset = self.header_size + (number % self.capacity) * self.slot_size
+            read = self._read(offset, self.slot_size - SEQ.size, number)
+            if read is None:
+                continue
+            samples.append(self._decode(read[1]))
+        return samples
+
+    def _decode(self, data):
+        sample = dict(zip(RECORD_KEYS, RECORD.unpack_from(data, 0)))
+        sample['co2eq'] = _optional(sample['co2eq'])
+        sample['grid_intensity'] = _optional(sample['grid_intensity'])
+        sample['thermal_pressure'] = _untext(sample['thermal_pressure'])
+
+        sample['top_processes'] = []
+        for i in range(self.top_processes):
+            name, energy_impact, cputime_ms = PROCESS.unpack_from(data, RECORD.size + i * PROCESS.size)
+            name = _untext(name)
+            if not name:
+                break
+            sample['top_processes'].append({'name': name, 'energy_impact': energy_impact, 'cputime_ms': cputime_ms})
+        return sample
+
+    def since(self, time_ms):
+        return [s for s in self.samples() if s['time'] >= time_ms]
+
+    def close(self):
+        self._map.close()
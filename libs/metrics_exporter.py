@@ -0,0 +1,144 @@
+"""
+Serves the hog's counters in the OpenMetrics text format so Prometheus can scrape them without touching the DB.
+
+Everything is served from memory. The totals come from the stats dict power_logger.py keeps up to date anyway and the
+per process energy impact is counted here as the samples come in.
+
+Prometheus stores every label value as its own series so we can't have a label for every process name we ever see.
+Only the top_k processes get their own series, all others are added up in the `(other)` series. A process that is not
+labelled yet is tracked as a candidate and replaces the smallest labelled process once it used more since it became a
+candidate than that process. The replaced series disappears and the new one starts at 0, which is
+what Prometheus expects from a counter that appears. The candidates are bounded as well, when there are too many the
+smallest one is forgotten.
+"""
+
+import threading
+import http.server
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+OTHER = '(other)'
+
+# stats key, metric name, unit, factor to get to the unit, help
+METRICS = [
+    ('combined_energy_mj', 'hog_combined_energy_joules', 'joules', 1 / 1_000, 'Energy used by CPU, GPU and ANE'),
+    ('cpu_energy_mj', 'hog_cpu_energy_joules', 'joules', 1 / 1_000, 'Energy used by the CPU'),
+    ('gpu_energy_mj', 'hog_gpu_energy_joules', 'joules', 1 / 1_000, 'Energy used by the GPU'),
+    ('ane_energy_mj', 'hog_ane_energy_joules', 'joules', 1 / 1_000, 'Energy used by the ANE'),
+    ('energy_impact', 'hog_energy_impact', None, 1, 'Energy impact as reported by powermetrics'),
+    ('embodied_carbon_g', 'hog_embodied_carbon_grams', 'grams', 1, 'Embodied carbon of the machine for the time measured'),
+    ('operational_carbon_g', 'hog_operational_carbon_grams', 'grams', 1, 'Carbon emitted by the energy used'),
+]
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class TopKCounters:
+
+    def __init__(self, top_k, max_candidates=None):
+        self.top_k = top_k
+        self.max_candidates = max_candidates or top_k * 4
+        self.labelled = {}
+        self.candidates = {}
+        self.other = 0
+        # What a labelled process used including the time it was a candidate. The ranking is done on this so a process
+        # that was just labelled isn't replaced right away because its series starts at 0.
+        self._scores = {}
+
+    def add(self, name, value):
+        if name in self.labelled:
+            self.labelled[name] += value
+            self._scores[name] += value
+            return
+        if len(self.labelled) < self.top_k:
+            self.labelled[name] = value
+            self._scores[name] = value
+            return
+
+        self.other += value
+        self.candidates[name] = self.candidates.get(name, 0) + value
+
+        smallest = min(self._scores, key=self._scores.get)
+        if self.candidates[name] > self._scores[smallest]:
+            del self.labelled[smallest]
+            del self._scores[smallest]
+            self.labelled[name] = 0
+            self._scores[name] = self.candidates.pop(name)
+        elif len(self.candidates) > self.max_candidates:
+            del self.candidates[min(self.candidates, key=self.candidates.get)]
+
+
+class MetricsExporter:
+
+    def __init__(self, port, stats, top_k=20, host='127.0.0.1'):
+        self.stats = stats
+        self.processes = TopKCounters(top_k)
+        self.samples = 0
+        self._lock = threading.Lock()
+
+        exporter = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_port
+        self._thread = threading.Thread(target=self.server.serve_forever, name='metrics_exporter', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def observe(self, top_processes):
+        with self._lock:
+            self.samples += 1
+            for p in top_processes:
+                if p['energy_impact']:
+                    self.processes.add(p['name'], p['energy_impact'])
+
+    def render(self):
+        stats = dict(self.stats)
+        with self._lock:
+            samples = self.samples
+            processes = sorted(self.processes.labelled.items())
+            other = self.processes.other
+
+        lines = []
+        for key, name, unit, factor, help_text in METRICS:
+            lines.append(f"# TYPE {name} counter")
+            if unit:
+                lines.append(f"# UNIT {name} {unit}")
+            lines.append(f"# HELP {name} {help_text}.")
+            lines.append(f"{name}_total {(stats[key] or 0) * factor}")
+
+        lines.append('# TYPE hog_samples counter')
+        lines.append('# HELP hog_samples Samples processed since the start.')
+        lines.append(f"hog_samples_total {samples}")
+
+        lines.append('# TYPE hog_process_energy_impact counter')
+        lines.append(f"# HELP hog_process_energy_impact Energy impact of the top {self.processes.top_k} processes. "
+                     f"All others are counted as {OTHER}.")
+        for process_name, value in processes:
+            lines.append(f'hog_process_energy_impact_total{{name="{escape(process_name)}"}} {value}')
+        lines.append(f'hog_process_energy_impact_total{{name="{OTHER}"}} {other}')
+
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
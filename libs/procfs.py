@@ -0,0 +1,259 @@
+"""
+Per-process cpu time attribution for systems that expose a procfs (Linux).
+
+powermetrics gives us coalitions with cputime and energy impact on macOS. On Linux there is no such tool so we read
+/proc/<pid>/stat ourselves. Walking thousands of pids every sample is expensive if we open, read and close every file
+each time, so the sampler keeps the stat file descriptors open for the lifetime of a process and re-reads them with
+os.pread. The cmdline of a process is only read once per process lifetime.
+"""
+
+import os
+import resource
+import subprocess
+
+from libs.rules import NameRules, CMDLINE
+
+# Field offsets after the closing ')' of the comm field. See man 5 proc
+STAT_UTIME = 11
+STAT_STIME = 12
+STAT_STARTTIME = 19
+
+STAT_READ_SIZE = 1024
+
+# We never want to use up all the file descriptors of the process for stat handles as sqlite and the upload need some
+# too. Pids over the budget are read with open/read/close every sample.
+FD_RESERVE = 256
+
+
+def parse_stat(raw: bytes):
+    # The comm field can contain spaces and brackets so we split on the last ')'
+    start = raw.find(b'(')
+    end = raw.rfind(b')')
+    if start == -1 or end == -1:
+        return None
+    comm = raw[start + 1:end].decode('utf-8', 'replace')
+    fields = raw[end + 2:].split()
+    try:
+        return comm, int(fields[STAT_UTIME]) + int(fields[STAT_STIME]), int(fields[STAT_STARTTIME])
+    except (IndexError, ValueError):
+        return None
+
+
+def read_cmdline(pid, proc_path='/proc'):
+    try:
+        with open(os.path.join(proc_path, str(pid), 'cmdline'), 'rb') as f:
+            raw = f.read()
+    except OSError:
+        return None
+    return raw.replace(b'\x00', b' ').strip().decode('utf-8', 'replace') or None
+
+
+def get_cmdline_shell_ps(pid):
+    try:
+        result = subprocess.run(
+            ['ps', '-p', str(pid), '-o', 'command='],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=True
+        )
+        return result.stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+
+def get_ancestors(pid, proc_path='/proc'):
+    ancestors = set()
+    while pid > 1 and pid not in ancestors:
+        ancestors.add(pid)
+        try:
+            with open(os.path.join(proc_path, str(pid), 'stat'), 'rb') as f:
+                raw = f.read()
+            pid = int(raw[raw.rfind(b')') + 2:].split()[1])
+        except (OSError, IndexError, ValueError):
+            break
+    return ancestors
+
+
+class CmdlineCache:
+    # Resolves the cmdline of a pid once per process lifetime. On Linux we read /proc/<pid>/cmdline, on macOS we need
+    # to fork ps. As we don't get a start time from powermetrics we key on (pid, name) and drop everything that was
+    # not seen in the last sample so a reused pid is resolved again.
+
+    def __init__(self, proc_path='/proc'):
+        self.proc_path = proc_path
+        self.use_procfs = os.path.isdir(proc_path)
+        self._cache = {}
+        self._seen = set()
+
+    def get(self, pid, name):
+        key = (pid, name)
+        self._seen.add(key)
+        if key not in self._cache:
+            if self.use_procfs:
+                self._cache[key] = read_cmdline(pid, self.proc_path)
+            else:
+                self._cache[key] = get_cmdline_shell_ps(pid)
+        return self._cache[key]
+
+    def end_sample(self):
+        for key in self._cache.keys() - self._seen:
+            del self._cache[key]
+        self._seen = set()
+
+
+class _Process:
+    __slots__ = ('pid', 'fd', 'starttime', 'ticks', 'comm', 'cmdline')
+
+    def __init__(self, pid, fd, starttime, ticks, comm):
+        self.pid = pid
+        self.fd = fd
+        self.starttime = starttime
+        self.ticks = ticks
+        self.comm = comm
+        self.cmdline = None
+
+
+class ProcessSampler:
+
+    def __init__(self, proc_path='/proc', resolve_process=None, max_fds=None):
+        self.proc_path = proc_path
+        self.name_rules = NameRules(resolve_process=resolve_process or [])
+        self.clk_tck = os.sysconf('SC_CLK_TCK')
+        self._procs = {}
+        self._open_fds = 0
+        self._uptime = None
+
+        if max_fds is None:
+            soft_limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+            max_fds = max(0, soft_limit - FD_RESERVE) if soft_limit != resource.RLIM_INFINITY else 65536
+        self.max_fds = max_fds
+
+    def _list_pids(self):
+        pids = set()
+        with os.scandir(self.proc_path) as it:
+            for entry in it:
+                if entry.name.isdigit():
+                    pids.add(int(entry.name))
+        return pids
+
+    def _read_stat(self, proc: _Process):
+        if proc.fd is not None:
+            try:
+                return os.pread(proc.fd, STAT_READ_SIZE, 0)
+            except OSError:
+                return None
+        try:
+            with open(os.path.join(self.proc_path, str(proc.pid), 'stat'), 'rb') as f:
+                return f.read(STAT_READ_SIZE)
+        except OSError:
+            return None
+
+    def _forget(self, pid):
+        proc = self._procs.pop(pid)
+        if proc.fd is not None:
+            os.close(proc.fd)
+            self._open_fds -= 1
+
+    def _add(self, pid):
+        path = os.path.join(self.proc_path, str(pid), 'stat')
+        fd = None
+        try:
+            if self._open_fds < self.max_fds:
+                fd = os.open(path, os.O_RDONLY)
+                self._open_fds += 1
+                raw = os.pread(fd, STAT_READ_SIZE, 0)
+            else:
+                with open(path, 'rb') as f:
+                    raw = f.read(STAT_READ_SIZE)
+        except OSError:
+            if fd is not None:
+                os.close(fd)
+                self._open_fds -= 1
+            return None
+
+        parsed = parse_stat(raw)
+        if not parsed:
+            if fd is not None:
+                os.close(fd)
+                self._open_fds -= 1
+            return None
+
+        comm, ticks, starttime = parsed
+        proc = _Process(pid, fd, starttime, ticks, comm)
+        self._procs[pid] = proc
+        return proc
+
+    def name(self, proc: _Process):
+        if not self.name_rules.decide(proc.comm) & CMDLINE:
+            return proc.comm
+        if proc.cmdline is None:
+            proc.cmdline = read_cmdline(proc.pid, self.proc_path) or proc.comm
+        return proc.cmdline
+
+    def _read_uptime(self):
+        # The time since boot in clock ticks, the unit of the starttime in stat
+        try:
+            with open(os.path.join(self.proc_path, 'uptime'), 'rb') as f:
+                return int(float(f.read().split()[0]) * self.clk_tck)
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def sample(self):
+        # Returns a list of (process, cpu ticks since the last sample). A process that started after the last sample
+        # counts all its ticks, otherwise short lived processes would never show up. Processes we see for the first
+        # time that are older only get a baseline.
+        last_uptime = self._uptime
+        self._uptime = self._read_uptime()
+        pids = self._list_pids()
+
+        for pid in self._procs.keys() - pids:
+            self._forget(pid)
+
+        deltas = []
+        for pid in pids:
+            proc = self._procs.get(pid)
+            if proc is not None:
+                parsed = self._read_stat(proc)
+                parsed = parse_stat(parsed) if parsed else None
+                if not parsed:
+                    self._forget(pid)
+                    continue
+
+                comm, ticks, starttime = parsed
+                if starttime == proc.starttime:
+                    if ticks > proc.ticks:
+                        deltas.append((proc, ticks - proc.ticks))
+                    proc.ticks = ticks
+                    proc.comm = comm
+                    continue
+
+                # The pid was reused by a new process
+                self._forget(pid)
+
+            proc = self._add(pid)
+            if proc and proc.ticks and last_uptime is not None and proc.starttime >= last_uptime:
+                deltas.append((proc, proc.ticks))
+
+        return deltas
+
+    def find_top_processes(self, limit=15):
+        # This returns the same shape as find_top_processes in power_logger.py so the rows can go straight into
+        # top_processes. We have no energy impact on Linux so we sort by cpu time.
+        merged = {}
+        for proc, ticks in self.sample():
+            name = self.name(proc)
+            merged[name] = merged.get(name, 0) + ticks
+
+        output = []
+        for name, ticks in sorted(merged.items(), key=lambda k: k[1], reverse=True)[:limit]:
+            output.append({
+                'name': name,
+                'energy_impact': None,
+                'cputime_ms': ticks * 1_000 / self.clk_tck,
+            })
+        return output
+
+    def close(self):
+        for pid in list(self._procs):
+            self._forget(pid)
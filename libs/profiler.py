@@ -0,0 +1,111 @@
+"""
+Profiles power_logger.py itself so we can see why the hog shows up in its own top processes list.
+
+There are two modes:
+
+- cprofile: Every thread gets its own cProfile profile. This is exact but makes everything quite a bit slower.
+- sampler: A background thread looks at the stacks of all threads every few ms and counts them. This is cheap enough to
+  leave running for a long time. The output is one line per stack in the folded format flamegraph.pl and speedscope
+  understand.
+
+dump() writes one file per thread and can be called as often as we like. Every dump holds everything since the start.
+"""
+
+import os
+import re
+import sys
+import marshal
+import cProfile
+import threading
+import collections
+
+MODES = ['cprofile', 'sampler']
+SAMPLE_INTERVAL = 0.01
+
+
+def _filename(name):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_')
+
+
+class Profiler:
+
+    def __init__(self, mode, directory, sample_interval=SAMPLE_INTERVAL):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profile mode {mode}. Must be one of {MODES}")
+        self.mode = mode
+        self.directory = directory
+        self.sample_interval = sample_interval
+
+        self._profiles = {}
+        self._stacks = collections.defaultdict(collections.Counter)
+        self._samples = 0
+        self._stop = threading.Event()
+        self._sampler = None
+        # dump is called from the SIGINFO/ SIGUSR2 handler, which runs in the main thread between any two bytecodes.
+        # If the main thread holds the lock at that moment a plain Lock would never be released.
+        self._lock = threading.RLock()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        # Only threads that are started after this are profiled so this should be called early
+        if self.mode == 'cprofile':
+            threading.setprofile(self._start_thread)
+            self._enable()
+        else:
+            self._sampler = threading.Thread(target=self._sample, name='profiler', daemon=True)
+            self._sampler.start()
+
+    def _enable(self):
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles[threading.current_thread().name] = profile
+        profile.enable()
+
+    def _start_thread(self, *_):
+        # threading calls this for the first event in every new thread. Enabling the profile replaces this hook.
+        self._enable()
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.sample_interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames() # pylint: disable=protected-access
+            with self._lock:
+                self._samples += 1
+                for ident, frame in frames.items():
+                    if ident == own_id:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    self._stacks[names.get(ident, str(ident))][';'.join(reversed(stack))] += 1
+
+    def dump(self):
+        pid = os.getpid()
+        with self._lock:
+            if self.mode == 'cprofile':
+                for name, profile in self._profiles.items():
+                    # snapshot_stats doesn't stop the profile like create_stats does. The file can be read with pstats.
+                    profile.snapshot_stats()
+                    with open(os.path.join(self.directory, f"{pid}-{_filename(name)}.pstats"), 'wb') as f:
+                        marshal.dump(profile.stats, f)
+            else:
+                for name, stacks in self._stacks.items():
+                    with open(os.path.join(self.directory, f"{pid}-{_filename(name)}.folded"), 'w', encoding='utf-8') as f:
+                        for stack, count in stacks.most_common():
+                            f.write(f"{stack} {count}\n")
+        return self.directory
+
+    def stop(self):
+        if self.mode == 'cprofile':
+            threading.setprofile(None)
+            with self._lock:
+                for profile in self._profiles.values():
+                    profile.disable()
+        else:
+            self._stop.set()
+            self._sampler.join()
+        return self.dump()
@@ -0,0 +1,224 @@
+"""
+Aggregates the local DB into reports: energy impact per app per day, the average power per hour of the day and how
+much of the energy was used during working hours.
+
+SQLite first adds up the rows of every UTC quarter hour, and of every app in it, which is the finest resolution the
+reports need (see utc_offset_ms). This is most of the work. The result is streamed out in chunks into one array per
+column and every chunk is aggregated on its own, so a year of data never has to fit into memory. If NumPy is installed
+the aggregation of a chunk is vectorized. Without NumPy we split the sorted time column into runs that fall into the
+same local hour. The power values are summed up as slices of the arrays in C, the apps are added up in a Python loop
+that runs once per app and quarter hour, not once per sample. Both give the same result.
+
+All days and hours are in the local time of the machine, like in the app.
+
+Rows that cover a whole day can't be put into an hour of the day: the weekly roll-up in power_logger.py leaves one row
+per UTC day without elapsed_ns, and the size budget brings everything before its daily watermark in downsample_status
+to daily rows. Their energy is left out of the hourly and working hours reports and counted as unassigned energy.
+
+The power percentiles come from the quantile sketches in power_sketches (see libs/sketch.py), merged over the range.
+Sketches older than a week are daily in UTC so for these the range is rounded to whole UTC days.
+"""
+
+import csv
+import time
+import array
+import bisect
+import datetime
+
+from libs.sketch import DDSketch
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+REPORTS = ['app_day', 'hourly', 'working_hours', 'power_percentiles']
+PERCENTILES = [50, 95, 99]
+CHUNK_ROWS = 65_536
+
+QUARTER_MS = 15 * 60 * 1_000
+HOUR_MS = 60 * 60 * 1_000
+DAY_MS = 24 * HOUR_MS
+
+
+def utc_offset_ms(quarter):
+    # All UTC offsets are multiples of 15 min so they can only change at the start of a UTC quarter hour. Looking the
+    # offset up once per quarter is exact, even across DST changes. It also means that every quarter falls into one
+    # local hour.
+    return time.localtime(quarter * QUARTER_MS // 1_000).tm_gmtoff * 1_000
+
+
+def stream_columns(cursor, query, params, typecodes):
+    # Yields one array per column for every CHUNK_ROWS rows
+    cursor.execute(query, params)
+    while rows := cursor.fetchmany(CHUNK_ROWS):
+        yield [array.array(t, column) for t, column in zip(typecodes, zip(*rows))]
+
+
+class Report:
+
+    def __init__(self, work_hours=(9, 17), use_numpy=True):
+        self.work_hours = work_hours
+        self.use_numpy = use_numpy and np is not None
+        self.app_day = {}
+        self.hourly_energy = [0] * 24
+        self.hourly_elapsed_ns = [0] * 24
+        self.work_energy = 0
+        self.total_energy = 0
+        self.unassigned_energy = 0
+        self.names = {}
+        self.sketches = {}
+        self._offsets = {}
+
+    @property
+    def backend(self):
+        return 'numpy' if self.use_numpy else 'array'
+
+    def _offset(self, quarter):
+        if quarter not in self._offsets:
+            self._offsets[quarter] = utc_offset_ms(quarter)
+        return self._offsets[quarter]
+
+    def _local_numpy(self, times):
+        quarters, inverse = np.unique(times // QUARTER_MS, return_inverse=True)
+        offsets = np.fromiter((self._offset(int(q)) for q in quarters), dtype=np.int64, count=len(quarters))
+        return times + offsets[inverse]
+
+    def _runs(self, times):
+        # Yields start, end and the local time of the first row for every run of rows in the same UTC quarter hour.
+        # The times have to be sorted.
+        i = 0
+        while i < len(times):
+            quarter = times[i] // QUARTER_MS
+            end = bisect.bisect_left(times, (quarter + 1) * QUARTER_MS, i)
+            yield i, end, times[i] + self._offset(quarter)
+            i = end
+
+    def add_power(self, times, combined_energy, elapsed_ns):
+        start, end = self.work_hours
+        if self.use_numpy:
+            local = self._local_numpy(np.frombuffer(times, dtype=np.int64))
+            energy = np.frombuffer(combined_energy, dtype=np.int64)
+            elapsed = np.frombuffer(elapsed_ns, dtype=np.int64)
+            hour = local // HOUR_MS % 24
+            # 1970-01-01 was a Thursday, this makes Monday 0
+            weekday = (local // DAY_MS + 3) % 7
+
+            hourly_energy = np.bincount(hour, weights=energy, minlength=24)
+            hourly_elapsed = np.bincount(hour, weights=elapsed, minlength=24)
+            for h in range(24):
+                self.hourly_energy[h] += int(hourly_energy[h])
+                self.hourly_elapsed_ns[h] += int(hourly_elapsed[h])
+
+            working = (weekday < 5) & (hour >= start) & (hour < end)
+            self.work_energy += int(energy[working].sum())
+            self.total_energy += int(energy.sum())
+            return
+
+        for i, j, local in self._runs(times):
+            hour = local // HOUR_MS % 24
+            energy = sum(combined_energy[i:j])
+            self.hourly_energy[hour] += energy
+            self.hourly_elapsed_ns[hour] += sum(elapsed_ns[i:j])
+            if (local // DAY_MS + 3) % 7 < 5 and start <= hour < end:
+                self.work_energy += energy
+            self.total_energy += energy
+
+    def add_processes(self, times, name_ids, energy_impact):
+        if self.use_numpy:
+            day = self._local_numpy(np.frombuffer(times, dtype=np.int64)) // DAY_MS
+            keys = (day << 32) | np.frombuffer(name_ids, dtype=np.int64)
+            unique_keys, inverse = np.unique(keys, return_inverse=True)
+            sums = np.bincount(inverse, weights=np.frombuffer(energy_impact, dtype=np.int64))
+            for key, value in zip(unique_keys.tolist(), sums.tolist()):
+                self.app_day[key] = self.app_day.get(key, 0) + int(value)
+            return
+
+        for i, j, local in self._runs(times):
+            day = local // DAY_MS << 32
+            for name_id, value in zip(name_ids[i:j], energy_impact[i:j]):
+                self.app_day[day | name_id] = self.app_day.get(day | name_id, 0) + value
+
+    def read(self, cursor, start_ms=0, end_ms=2**62):
+        cursor.execute('SELECT until FROM downsample_status WHERE resolution = ?', (DAY_MS,))
+        row = cursor.fetchone()
+        daily_until = max(start_ms, row[0] if row else 0)
+        cursor.execute('''SELECT IFNULL(SUM(combined_energy), 0) FROM power_measurements
+                          WHERE time >= ? AND time < ? AND (elapsed_ns IS NULL OR time < ?)''',
+                       (start_ms, end_ms, daily_until))
+        self.unassigned_energy += cursor.fetchone()[0]
+
+        for times, energy, elapsed in stream_columns(
+                cursor,
+                f'''SELECT time / {QUARTER_MS} * {QUARTER_MS} AS quarter, IFNULL(SUM(combined_energy), 0),
+                    SUM(elapsed_ns) FROM power_measurements
+                    WHERE time >= ? AND time < ? AND elapsed_ns IS NOT NULL GROUP BY quarter ORDER BY quarter''',
+                (daily_until, end_ms), 'qqq'):
+            self.add_power(times, energy, elapsed)
+
+        for times, name_ids, energy_impact in stream_columns(
+                cursor,
+                f'''SELECT time / {QUARTER_MS} * {QUARTER_MS} AS quarter, name_id, IFNULL(SUM(energy_impact), 0)
+                    FROM process_history
+                    WHERE time >= ? AND time < ? GROUP BY quarter, name_id ORDER BY quarter''',
+                (start_ms, end_ms), 'qqq'):
+            self.add_processes(times, name_ids, energy_impact)
+
+        self.names = dict(cursor.execute('SELECT id, name FROM process_names').fetchall())
+
+        cursor.execute('SELECT metric, sketch FROM power_sketches WHERE time >= ? AND time < ?', (start_ms, end_ms))
+        for metric, data in cursor:
+            if metric in self.sketches:
+                self.sketches[metric].merge(DDSketch.from_bytes(data))
+            else:
+                self.sketches[metric] = DDSketch.from_bytes(data)
+        return self
+
+    def tables(self, top=None):
+        app_day = []
+        by_day = {}
+        for key, value in self.app_day.items():
+            by_day.setdefault(key >> 32, []).append((value, key & 0xFFFFFFFF))
+        for day in sorted(by_day):
+            date = datetime.date.fromordinal(datetime.date(1970, 1, 1).toordinal() + day).isoformat()
+            for value, name_id in sorted(by_day[day], reverse=True)[:top]:
+                app_day.append({'day': date, 'name': self.names.get(name_id, str(name_id)), 'energy_impact': value})
+
+        hourly = [{
+            'hour': h,
+            'energy_mj': self.hourly_energy[h],
+            # 1 mJ/ns is 10^6 W
+            'avg_power_w': round(self.hourly_energy[h] / self.hourly_elapsed_ns[h] * 1_000_000, 3)
+                           if self.hourly_elapsed_ns[h] else None,
+        } for h in range(24)]
+
+        working_hours = [{
+            'work_hours': f"{self.work_hours[0]}-{self.work_hours[1]}",
+            'work_energy_mj': self.work_energy,
+            'total_energy_mj': self.total_energy,
+            'share': round(self.work_energy / self.total_energy, 4) if self.total_energy else None,
+            'unassigned_energy_mj': self.unassigned_energy,
+        }]
+
+        # The sketches are in mW
+        power_percentiles = [{
+            'metric': metric,
+            'samples': sketch.count,
+            **{f"p{p}_w": round(sketch.quantile(p / 100) / 1_000, 3) for p in PERCENTILES},
+            'max_w': round(sketch.max / 1_000, 3),
+        } for metric, sketch in sorted(self.sketches.items())]
+
+        return {'app_day': app_day, 'hourly': hourly, 'working_hours': working_hours,
+                'power_percentiles': power_percentiles}
+
+
+def write_csv(tables, out):
+    # Every table gets its own header and the tables are separated by an empty line
+    for i, (name, rows) in enumerate(tables.items()):
+        if i:
+            out.write('\n')
+        out.write(f"# {name}\n")
+        if rows:
+            writer = csv.DictWriter(out, fieldnames=list(rows[0]), lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(rows)
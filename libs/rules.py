@@ -0,0 +1,126 @@
+"""
+Decides which coalitions are replaced by their tasks and which processes are named by their cmdline.
+
+The resolve_coalitions and resolve_process settings are lists of rules. A rule is one of
+  - an exact name: `com.apple.terminal`
+  - a prefix: `com.jetbrains.*`, a glob that only has one `*` at the end
+  - a glob: `*python*` or `python3.1?` with the wildcards of fnmatch
+  - a regex: `re:^python3?(\\.\\d+)?$`, searched in the name
+Names are stripped and compared in lower case, so `com.apple.Terminal` and `com.apple.terminal` are the same rule.
+Regexes are kept as they are and are matched ignoring the case.
+
+The rules are compiled once. Exact names are a set, the prefixes one tuple for str.startswith and the globs and
+regexes are compiled patterns that are only tried when nothing else matched. The names repeat every sample so the
+decision for a raw name is cached and most names cost one dict lookup. The cache is dropped when it gets too big so
+short lived processes with changing names can't make it grow forever.
+
+Every rule counts how often it matched, even if the decision came from the cache, so you can see which rules are used.
+"""
+
+import re
+import fnmatch
+
+EXPAND = 1  # The coalition is replaced by its tasks
+CMDLINE = 2  # The process is named by its cmdline
+
+MAX_CACHE = 10_000
+GLOB_CHARS = '*?['
+REGEX_PREFIX = 're:'
+
+
+class Rule:
+    __slots__ = ('setting', 'kind', 'pattern', 'flag', 'hits')
+
+    def __init__(self, setting, kind, pattern, flag):
+        self.setting = setting
+        self.kind = kind
+        self.pattern = pattern
+        self.flag = flag
+        self.hits = 0
+
+    def __repr__(self):
+        return f"{self.setting}:{self.pattern}"
+
+
+def parse_rule(setting, text, flag):
+    text = text.strip()
+    if text.startswith(REGEX_PREFIX):
+        pattern = text[len(REGEX_PREFIX):]
+        try:
+            re.compile(pattern)
+        except re.error as exc:
+            raise ValueError(f"Invalid regex {pattern!r} in {setting}: {exc}") from exc
+        return Rule(setting, 'regex', pattern, flag)
+
+    pattern = text.lower()
+    if not any(char in pattern for char in GLOB_CHARS):
+        return Rule(setting, 'exact', pattern, flag)
+    if pattern.endswith('*') and not any(char in pattern[:-1] for char in GLOB_CHARS):
+        return Rule(setting, 'prefix', pattern[:-1], flag)
+    return Rule(setting, 'glob', pattern, flag)
+
+
+class NameRules:
+
+    def __init__(self, resolve_coalitions=(), resolve_process=(), max_cache=MAX_CACHE):
+        self.rules = [parse_rule('resolve_coalitions', text, EXPAND) for text in resolve_coalitions if text.strip()]
+        self.rules += [parse_rule('resolve_process', text, CMDLINE) for text in resolve_process if text.strip()]
+        self.max_cache = max_cache
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache = {}
+
+        # The first rule of every kind wins for a name, so a name is counted once per rule list
+        self._exact = {}
+        for rule in self.rules:
+            if rule.kind == 'exact':
+                self._exact.setdefault(rule.pattern, []).append(rule)
+        self._prefixes = [rule for rule in self.rules if rule.kind == 'prefix']
+        self._prefix_tuple = tuple(rule.pattern for rule in self._prefixes)
+        self._patterns = [(rule, re.compile(fnmatch.translate(rule.pattern)).match if rule.kind == 'glob'
+                           else re.compile(rule.pattern, re.IGNORECASE).search)
+                          for rule in self.rules if rule.kind in ('glob', 'regex')]
+
+    def _match(self, raw_name):
+        name = raw_name.strip().lower()
+        matched = list(self._exact.get(name, ()))
+        if self._prefix_tuple and name.startswith(self._prefix_tuple):
+            matched += [rule for rule in self._prefixes if name.startswith(rule.pattern)]
+        matched += [rule for rule, match in self._patterns if match(name)]
+
+        # Only the first rule of a setting that matched gets the hit
+        rules = []
+        flags = 0
+        for rule in sorted(matched, key=self.rules.index):
+            if not flags & rule.flag:
+                flags |= rule.flag
+                rules.append(rule)
+        # There is nothing to show for a coalition without a name so it is always replaced by its tasks
+        if not name:
+            flags |= EXPAND
+        return flags, tuple(rules)
+
+    def decide(self, raw_name):
+        # Returns the EXPAND and CMDLINE flags for the name
+        decision = self._cache.get(raw_name)
+        if decision is None:
+            self.cache_misses += 1
+            if len(self._cache) >= self.max_cache:
+                self._cache.clear()
+            decision = self._cache[raw_name] = self._match(raw_name)
+        else:
+            self.cache_hits += 1
+
+        flags, rules = decision
+        for rule in rules:
+            rule.hits += 1
+        return flags
+
+    @property
+    def counters(self):
+        return {
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'cached_names': len(self._cache),
+            'rule_hits': {repr(rule): rule.hits for rule in self.rules},
+        }
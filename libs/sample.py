@@ -0,0 +1,228 @@
+"""
+A compact in-memory model of a powermetrics sample.
+
+plistlib gives us a sample as nested dicts of about 1 MB: every coalition and task has some 60 keys, and there are the
+per cpu clusters, disk, network and gpu values we never look at. A full sample queue held 60 of these. from_plist keeps
+only what the logger uses:
+  - the scalar values of processor, without the clusters
+  - the energy impact of all tasks
+  - a Processes table of the coalitions and one of all their tasks
+
+A table has a column per value. The numbers are array.array buffers, the names are interned as they repeat in every
+sample. The tasks of coalition i are the rows task_starts[i] to task_starts[i + 1] of the tasks table. A coalition
+without a tasks list is its own only task, with NO_PID as pid, so it is kept when it is replaced by its tasks.
+
+load_plist parses the XML of powermetrics into the same dicts and lists as plistlib.loads in less than half the time.
+plistlib looks up a method for every element and keeps a lot of state. We only need the types powermetrics writes
+and let expat collect the text.
+
+Resolving the names mostly keeps the coalitions as they are, so resolve returns the coalitions table itself if no
+coalition is replaced by its tasks and otherwise puts the new table together from slices of the two, which are copied
+in C. A Sample is not changed once it is queued, merge_processes and merge_samples in power_logger.py build new ones.
+"""
+
+import sys
+import array
+import base64
+import xml.parsers.expat
+from datetime import datetime, timezone
+
+from libs.rules import EXPAND, CMDLINE
+
+NO_PID = -1
+
+
+def load_plist(data: bytes):
+    stack = []
+    keys = []
+    text = []
+    result = []
+
+    def add(value):
+        if not stack:
+            result.append(value)
+        elif isinstance(stack[-1], dict):
+            stack[-1][keys.pop()] = value
+        else:
+            stack[-1].append(value)
+
+    def start(name, _):
+        if name in ('dict', 'array'):
+            container = {} if name == 'dict' else []
+            add(container)
+            stack.append(container)
+        text.clear()
+
+    def end(name):
+        value = ''.join(text)
+        if name in ('dict', 'array'):
+            stack.pop()
+        elif name == 'key':
+            keys.append(value)
+        elif name == 'string':
+            add(value)
+        elif name == 'integer':
+            add(int(value))
+        elif name == 'real':
+            add(float(value))
+        elif name == 'true':
+            add(True)
+        elif name == 'false':
+            add(False)
+        elif name == 'date':
+            add(datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ'))
+        elif name == 'data':
+            add(base64.b64decode(value))
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = text.append
+    parser.Parse(data, True)
+    return result[0]
+
+
+class Processes:
+    __slots__ = ('names', 'ids', 'energy_impact', 'energy_impact_per_s', 'cputime_ms_per_s')
+
+    def __init__(self):
+        self.names = []
+        self.ids = array.array('q')  # The coalition id or the pid of a task
+        self.energy_impact = array.array('d')
+        self.energy_impact_per_s = array.array('d')
+        self.cputime_ms_per_s = array.array('d')
+
+    def __len__(self):
+        return len(self.names)
+
+    def append(self, name, process_id, energy_impact, energy_impact_per_s, cputime_ms_per_s):
+        self.names.append(sys.intern(name))
+        self.ids.append(process_id or 0)
+        self.energy_impact.append(energy_impact or 0)
+        self.energy_impact_per_s.append(energy_impact_per_s or 0)
+        self.cputime_ms_per_s.append(cputime_ms_per_s or 0)
+
+    def append_row(self, other, row, rate_factor=1.0):
+        # Copies a row of other. The rates are multiplied by rate_factor, see merge_processes.
+        self.append(other.names[row], other.ids[row], other.energy_impact[row],
+                    other.energy_impact_per_s[row] * rate_factor, other.cputime_ms_per_s[row] * rate_factor)
+
+    def extend(self, other, start, end):
+        self.names.extend(other.names[start:end])
+        self.ids.extend(other.ids[start:end])
+        self.energy_impact.extend(other.energy_impact[start:end])
+        self.energy_impact_per_s.extend(other.energy_impact_per_s[start:end])
+        self.cputime_ms_per_s.extend(other.cputime_ms_per_s[start:end])
+
+
+class Sample:
+    __slots__ = ('time', 'elapsed_ns', 'processor', 'energy_impact_per_s', 'thermal_pressure', 'hw_model',
+                 'checkpoint', 'coalitions', 'tasks', 'task_starts')
+
+    def __init__(self, time_ms, elapsed_ns, processor, energy_impact_per_s, thermal_pressure, hw_model,
+                 coalitions, tasks, task_starts, checkpoint=None):
+        self.time = time_ms
+        self.elapsed_ns = elapsed_ns
+        self.processor = processor
+        self.energy_impact_per_s = energy_impact_per_s
+        self.thermal_pressure = thermal_pressure
+        self.hw_model = hw_model
+        self.coalitions = coalitions
+        self.tasks = tasks
+        self.task_starts = task_starts
+        self.checkpoint = checkpoint
+
+    @classmethod
+    def from_plist(cls, data):
+        coalitions = Processes()
+        tasks = Processes()
+        task_starts = array.array('l', [0])
+        for coalition in data['coalitions']:
+            coalitions.append(coalition['name'], coalition.get('id'), coalition.get('energy_impact'),
+                              coalition.get('energy_impact_per_s'), coalition.get('cputime_ms_per_s'))
+            coalition_tasks = coalition.get('tasks')
+            if isinstance(coalition_tasks, list):
+                for task in coalition_tasks:
+                    tasks.append(task['name'], task.get('pid'), task.get('energy_impact'),
+                                 task.get('energy_impact_per_s'), task.get('cputime_ms_per_s'))
+            else:
+                tasks.append_row(coalitions, len(coalitions) - 1)
+                tasks.ids[-1] = NO_PID
+            task_starts.append(len(tasks))
+
+        # Sql can not handle timestamps so we convert them to milliseconds
+        return cls(int(data['timestamp'].replace(tzinfo=timezone.utc).timestamp() * 1e3),
+                   data['elapsed_ns'],
+                   {key: value for key, value in data['processor'].items()
+                    if isinstance(value, (int, float)) and not isinstance(value, bool)},
+                   data['all_tasks'].get('energy_impact_per_s') or 0,
+                   data.get('thermal_pressure'),
+                   sys.intern(data.get('hw_model') or ''),
+                   coalitions, tasks, task_starts)
+
+    def resolve(self, name_rules, get_cmdline):
+        # Returns the processes with the coalitions the libs/rules.py rules expand replaced by their tasks. Tasks the
+        # rules want to see with their cmdline are named by get_cmdline(pid, name) if it finds one.
+        decide = name_rules.decide
+        coalitions, tasks, task_starts = self.coalitions, self.tasks, self.task_starts
+        expanded = [i for i, name in enumerate(coalitions.names) if decide(name) & EXPAND]
+        if not expanded:
+            return coalitions
+
+        resolved = Processes()
+        start = 0
+        for i in expanded:
+            resolved.extend(coalitions, start, i)
+            first = len(resolved)
+            resolved.extend(tasks, task_starts[i], task_starts[i + 1])
+            # Only tasks have a pid, a coalition can't be looked up
+            for row in range(first, len(resolved)):
+                name = resolved.names[row]
+                if resolved.ids[row] != NO_PID and decide(name) & CMDLINE and \
+                        (cmd := get_cmdline(resolved.ids[row], name)):
+                    resolved.names[row] = cmd
+            start = i + 1
+        resolved.extend(coalitions, start, len(coalitions))
+        return resolved
+
+
+def merge_processes(a, b, a_ns, b_ns):
+    # Returns the coalitions, tasks and task_starts of samples a and b merged. Coalitions are matched by id and name
+    # and tasks by pid and name within their coalition. The energy impact is a counter and is added up, the rates are
+    # weighted by the time they were measured over. Processes that are only in one of the samples had no activity in
+    # the other interval.
+    total_ns = a_ns + b_ns
+    a_factor, b_factor = a_ns / total_ns, b_ns / total_ns
+    coalitions, tasks, task_starts = Processes(), Processes(), array.array('l', [0])
+
+    def add(table, x, row, y, y_row):
+        if y_row is None:
+            table.append_row(x, row, a_factor)
+            return
+        table.append(x.names[row], x.ids[row], x.energy_impact[row] + y.energy_impact[y_row],
+                     x.energy_impact_per_s[row] * a_factor + y.energy_impact_per_s[y_row] * b_factor,
+                     x.cputime_ms_per_s[row] * a_factor + y.cputime_ms_per_s[y_row] * b_factor)
+
+    def task_rows(sample, i):
+        return range(sample.task_starts[i], sample.task_starts[i + 1])
+
+    b_coalitions = {(b.coalitions.ids[i], b.coalitions.names[i]): i for i in range(len(b.coalitions))}
+    for i in range(len(a.coalitions)):
+        j = b_coalitions.pop((a.coalitions.ids[i], a.coalitions.names[i]), None)
+        add(coalitions, a.coalitions, i, b.coalitions, j)
+
+        b_tasks = {} if j is None else {(b.tasks.ids[t], b.tasks.names[t]): t for t in task_rows(b, j)}
+        for t in task_rows(a, i):
+            add(tasks, a.tasks, t, b.tasks, b_tasks.pop((a.tasks.ids[t], a.tasks.names[t]), None))
+        for t in b_tasks.values():
+            tasks.append_row(b.tasks, t, b_factor)
+        task_starts.append(len(tasks))
+
+    for j in b_coalitions.values():
+        coalitions.append_row(b.coalitions, j, b_factor)
+        for t in task_rows(b, j):
+            tasks.append_row(b.tasks, t, b_factor)
+        task_starts.append(len(tasks))
+
+    return coalitions, tasks, task_starts
@@ -0,0 +1,91 @@
+"""
+A bounded queue between the thread that reads the powermetrics output and the thread that processes the samples.
+
+If the processing stalls (a VACUUM holding the DB lock, a slow upload, ...) we still want to drain the pipe so
+powermetrics doesn't block. What happens when the queue is full is decided by the policy:
+
+- block: The reader waits until there is space again. Nothing is lost but powermetrics might block.
+- coalesce: The new sample is merged into the newest queued one with the merge function.
+- drop_oldest: The oldest queued sample is thrown away.
+"""
+
+import collections
+import threading
+
+POLICIES = ['block', 'coalesce', 'drop_oldest']
+
+
+class SampleQueue:
+
+    def __init__(self, maxsize, policy='coalesce', merge=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy {policy}. Must be one of {POLICIES}")
+        if policy == 'coalesce' and merge is None:
+            raise ValueError('The coalesce policy needs a merge function')
+
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.merge = merge
+        self._items = collections.deque()
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self.counters = {
+            'put': 0,
+            'processed': 0,
+            'blocked': 0,
+            'coalesced': 0,
+            'dropped': 0,
+            'max_depth': 0,
+        }
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+    def put(self, item, stop_event=None):
+        with self._cond:
+            self.counters['put'] += 1
+
+            if len(self._items) >= self.maxsize:
+                if self.policy == 'block':
+                    self.counters['blocked'] += 1
+                    while len(self._items) >= self.maxsize and not self._closed:
+                        if stop_event is not None and stop_event.is_set():
+                            return False
+                        self._cond.wait(1)
+                elif self.policy == 'coalesce':
+                    self.counters['coalesced'] += 1
+                    self._items[-1] = self.merge(self._items[-1], item)
+                    return True
+                else:
+                    self.counters['dropped'] += 1
+                    self._items.popleft()
+
+            self._items.append(item)
+            self.counters['max_depth'] = max(self.counters['max_depth'], len(self._items))
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        # Returns None if nothing came in during the timeout or if the queue is closed and empty
+        with self._cond:
+            if not self._items and not self._closed:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self.counters['processed'] += 1
+            self._cond.notify_all()
+            return item
+
+    def close(self):
+        # After closing the consumer gets the remaining items and then None
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        with self._cond:
+            return self._closed and not self._items
@@ -0,0 +1,139 @@
+"""
+An append only log of length prefixed records split into segment files.
+
+Every record is written as a header with the payload length and a crc32 of the payload followed by the payload. If we
+crash in the middle of a write the last record of the active segment is incomplete. This is detected when the log is
+opened again and the segment is truncated to the last complete record.
+
+Segments are rotated when they get too big or too old. Sealed segments are never written to again and can be read and
+removed by another thread. Appending and rotating is safe to call from different threads.
+"""
+
+import os
+import time
+import zlib
+import struct
+import logging
+import threading
+
+HEADER = struct.Struct('<II')
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.log'
+
+
+def segment_sequence(filename):
+    return int(filename[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+
+def read_records(path):
+    # Returns all complete records and the offset after the last complete one
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    records = []
+    offset = 0
+    while offset + HEADER.size <= len(data):
+        length, crc = HEADER.unpack_from(data, offset)
+        start = offset + HEADER.size
+        payload = data[start:start + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            break
+        records.append(payload)
+        offset = start + length
+
+    return records, offset
+
+
+class SegmentLog:
+
+    def __init__(self, directory, max_segment_bytes=4 * 1024 * 1024, max_segment_age=60, fsync_interval=1,
+                 first_sequence=0):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age = max_segment_age
+        self.fsync_interval = fsync_interval
+
+        os.makedirs(directory, exist_ok=True)
+
+        self._fd = None
+        # Segments are consumed in order of their sequence so it must never go backwards, even if all files are gone
+        self._sequence = first_sequence
+        self._size = 0
+        self._opened = 0
+        self._last_sync = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+
+        segments = self.segments()
+        if segments:
+            self._recover(self.path(segments[-1]))
+            # We never append to a segment from an earlier run
+            self._sequence = max(self._sequence, segments[-1] + 1)
+
+    def path(self, sequence):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{sequence:012d}{SEGMENT_SUFFIX}")
+
+    def segments(self):
+        return sorted(segment_sequence(f) for f in os.listdir(self.directory)
+                      if f.startswith(SEGMENT_PREFIX) and f.endswith(SEGMENT_SUFFIX))
+
+    def sealed_segments(self):
+        with self._lock:
+            active = self._sequence if self._fd is not None else None
+        return [s for s in self.segments() if s != active]
+
+    def _recover(self, path):
+        _, offset = read_records(path)
+        if offset != os.path.getsize(path):
+            logging.warning('Truncating torn record at the end of %s from %d to %d bytes',
+                            path, os.path.getsize(path), offset)
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+                os.fsync(f.fileno())
+
+    def _open(self):
+        self._fd = os.open(self.path(self._sequence), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._size = os.fstat(self._fd).st_size
+        self._opened = time.time()
+
+    def append(self, payload: bytes):
+        with self._lock:
+            if self._fd is None:
+                self._open()
+
+            os.write(self._fd, HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self._size += HEADER.size + len(payload)
+            self._dirty = True
+
+            now = time.time()
+            if now - self._last_sync >= self.fsync_interval:
+                self._sync()
+            if self._size >= self.max_segment_bytes or now - self._opened >= self.max_segment_age:
+                self._rotate()
+
+    def _sync(self):
+        if self._fd is not None and self._dirty:
+            os.fsync(self._fd)
+            self._dirty = False
+        self._last_sync = time.time()
+
+    def _rotate(self):
+        if self._fd is None:
+            return
+        self._sync()
+        os.close(self._fd)
+        self._fd = None
+        self._sequence += 1
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def rotate(self, min_age=0):
+        # Seals the active segment if it is at least min_age seconds old. The next append starts a new one.
+        with self._lock:
+            if self._fd is not None and time.time() - self._opened >= min_age:
+                self._rotate()
+
+    def close(self):
+        self.rotate()
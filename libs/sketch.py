@@ -0,0 +1,146 @@
+"""
+A DDSketch quantile sketch so we can answer "what was the p95 power in that hour" without keeping every sample.
+
+Values are counted in logarithmic bins. Bin k holds the values in (gamma^(k-1), gamma^k] with
+gamma = (1 + relative_accuracy) / (1 - relative_accuracy), so every quantile we return is within relative_accuracy of
+the real value. Two sketches with the same accuracy are merged by adding up the bins, which is exact. That is what
+lets us roll hourly sketches up into daily ones and query any range.
+
+With 1% accuracy power values from 1 mW to 1 kW need about 700 bins. If a sketch gets more than max_bins bins the
+lowest ones are collapsed into one, which only makes the lowest quantiles less accurate.
+
+Serialized a sketch is a small header and the counts of all bins from the lowest to the highest as varints. Empty bins
+in between take one byte.
+"""
+
+import math
+import struct
+
+RELATIVE_ACCURACY = 0.01
+MAX_BINS = 2048
+# Everything below this is counted as 0
+MIN_VALUE = 1e-9
+
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<BdQdddiI')
+
+
+def _write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+class DDSketch:
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY, max_bins=MAX_BINS):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(f"The relative accuracy must be between 0 and 1, not {relative_accuracy}")
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.max_bins = max_bins
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        if value < 0:
+            raise ValueError(f"Only values >= 0 can be added, not {value}")
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+        if value < MIN_VALUE:
+            self.zero_count += 1
+            return
+
+        key = math.ceil(math.log(value) / self._log_gamma)
+        self.bins[key] = self.bins.get(key, 0) + 1
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def _collapse(self):
+        keys = sorted(self.bins)
+        lowest = keys[len(keys) - self.max_bins]
+        for key in keys[:len(keys) - self.max_bins]:
+            self.bins[lowest] += self.bins.pop(key)
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Only sketches with the same relative accuracy can be merged')
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+        return self
+
+    def quantile(self, q):
+        if not 0 <= q <= 1:
+            raise ValueError(f"The quantile must be between 0 and 1, not {q}")
+        if not self.count:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return self.min
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                # The value in the bin that is off by at most the relative accuracy in both directions
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_bytes(self):
+        keys = sorted(self.bins)
+        first = keys[0] if keys else 0
+        n_keys = keys[-1] - first + 1 if keys else 0
+        out = bytearray(HEADER.pack(FORMAT_VERSION, self.relative_accuracy, self.zero_count, self.sum,
+                                    self.min if self.count else 0, self.max if self.count else 0, first, n_keys))
+        for key in range(first, first + n_keys):
+            _write_varint(out, self.bins.get(key, 0))
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data, max_bins=MAX_BINS):
+        version, relative_accuracy, zero_count, total, minimum, maximum, first, n_keys = HEADER.unpack_from(data, 0)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unknown sketch format version {version}")
+
+        sketch = cls(relative_accuracy, max_bins)
+        offset = HEADER.size
+        for key in range(first, first + n_keys):
+            count, offset = _read_varint(data, offset)
+            if count:
+                sketch.bins[key] = count
+
+        sketch.zero_count = zero_count
+        sketch.count = zero_count + sum(sketch.bins.values())
+        sketch.sum = total
+        if sketch.count:
+            sketch.min = minimum
+            sketch.max = maximum
+        return sketch
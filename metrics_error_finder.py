@@ -1,34 +1,31 @@
 #!/usr/bin/env python3
 
+# Checks how far the values powermetrics reports for a sample (cputime_ns, energy_impact) are off from the values we
+# calculate from the per second values (cputime_ms_per_s, energy_impact_per_s). find_top_processes in power_logger.py
+# relies on the per second values as the others are broken.
+#
+# Without files this runs powermetrics and prints the summary on SIGINFO and when stopped. With files it analyzes
+# the captured powermetrics output in a process pool:
+#   ./metrics_error_finder.py -j 8 captures/*.plist
+
 # pylint: disable=W0603,W0602
 import json
 import subprocess
-import time
-import plistlib
 import argparse
-import zlib
-import base64
-import xml
 import signal
 import sys
-import uuid
-import os
-import os.path
-import stat
-import urllib.request
-import configparser
-import sqlite3
-import http
-from datetime import timezone
-from pathlib import Path
+import concurrent.futures
+import xml.etree.ElementTree as ET
 
-from libs import caribou
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 # Shared variable to signal the thread to stop
 stop_signal = False
 
-
 def sigint_handler(_, __):
     global stop_signal
     if stop_signal:
@@ -40,41 +37,31 @@ def sigint_handler(_, __):
 
 def siginfo_handler(_, __):
     print(SETTINGS)
-    print(stats)
+    print_summary(stats)
 
 signal.signal(signal.SIGINT, sigint_handler)
 signal.signal(signal.SIGTERM, sigint_handler)
 
-signal.signal(signal.SIGINFO, siginfo_handler)
+# SIGINFO only exists on BSD systems like macOS. On Linux you can send SIGUSR1 instead
+signal.signal(getattr(signal, 'SIGINFO', signal.SIGUSR1), siginfo_handler)
 
 
 
 SETTINGS = {
     'powermetrics': 5000,
+    'threshold': 5,
 }
 
+METRICS = ['cputime_ns', 'energy_impact']
 
-def run_powermetrics():
+# Every summary is a dict of (name, metric) -> list of these. All of them can be added up, max is the max.
+SUMMARY_FIELDS = ['samples', 'suspicious', 'sum_diff', 'max_diff', 'dirty', 'clean']
 
-    cmd = ['powermetrics',
-            '--show-all',
-            '-i', str(SETTINGS['powermetrics']),
-            '-f', 'plist']
+stats = {}
 
-    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True) as process:
-        buffer = []
-        for line in process.stdout:
-            line = line.strip().replace('&', '&amp;')
-            buffer.append(line)
-            if line == '</plist>':
-                parse_powermetrics_output(''.join(buffer))
-                buffer = []
-
-            if stop_signal:
-                break
+# The only parts of a sample we look at
+SAMPLE_KEYS = {'elapsed_ns', 'coalitions'}
 
-        if stop_signal:
-            process.terminate()
 
 def find_top_processes(data: list):
     # As iterm2 will probably show up as it spawns the processes called from the shell we look at the tasks
@@ -87,62 +74,264 @@ def find_top_processes(data: list):
 
     return new_data
 
-def is_difference_more_than_5_percent(x, y):
-    if x == 0 and y == 0:
-        return False  # If both values are 0, the percentage difference is undefined.
 
-    if x == 0 or y == 0:
-        return True  # If one of the values is 0 and the other is not, they differ by more than 5%.
+def plist_value(element):
+    if element.tag == 'dict':
+        children = iter(element)
+        return {key.text: plist_value(value) for key, value in zip(children, children)}
+    if element.tag == 'array':
+        return [plist_value(child) for child in element]
+    if element.tag == 'integer':
+        return int(element.text)
+    if element.tag == 'real':
+        return float(element.text)
+    if element.tag in ('true', 'false'):
+        return element.tag == 'true'
+    return element.text or ''
 
-    percent_difference = abs(x - y) / ((x + y) / 2) * 100
 
-    return percent_difference > 5
+def parse_sample(data: bytes):
+    # plistlib handles every element of the sample in Python. This lets expat build the tree in C and only converts
+    # the keys we need, which is a lot faster for the big samples of --show-all.
+    children = iter(ET.fromstring(data)[0])
+    return {key.text: plist_value(value) for key, value in zip(children, children) if key.text in SAMPLE_KEYS}
 
 
-def parse_powermetrics_output(output: str):
-    global stats
+def parse_samples(outputs):
+    # Returns the columns for all processes in all samples of the given powermetrics outputs
+    names = []
+    columns = {'elapsed_ns': [], 'cputime_ns': [], 'cputime_ms_per_s': [], 'energy_impact': [],
+               'energy_impact_per_s': []}
 
-    for data in output.encode('utf-8').split(b'\x00'):
-        if data:
+    for output in outputs:
+        for data in output.encode('utf-8').split(b'\x00'):
+            if not data:
+                continue
 
             if data == b'powermetrics must be invoked as the superuser\n':
                 raise PermissionError('You need to run this script as root!')
 
             try:
-                data=plistlib.loads(data)
-                data['timezone'] = time.tzname
-                data['timestamp'] = int(data['timestamp'].replace(tzinfo=timezone.utc).timestamp() * 1e3)
-            except xml.parsers.expat.ExpatError as exc:
+                data = parse_sample(data)
+            except ET.ParseError as exc:
                 print(data)
                 raise exc
 
             for process in find_top_processes(data['coalitions']):
+                names.append(process['name'])
+                columns['elapsed_ns'].append(data['elapsed_ns'])
+                for key in METRICS + ['cputime_ms_per_s', 'energy_impact_per_s']:
+                    columns[key].append(process[key])
+
+    return names, columns
+
+
+def dirty_and_clean(columns):
+    # The value powermetrics gives us for the sample and the one we calculate like find_top_processes does
+    if np is not None:
+        elapsed_s = np.asarray(columns['elapsed_ns'], dtype=np.float64) / 1_000_000_000
+        return {
+            'cputime_ns': (np.asarray(columns['cputime_ns'], dtype=np.float64),
+                           np.asarray(columns['cputime_ms_per_s'], dtype=np.float64) * 1_000_000 * elapsed_s),
+            'energy_impact': (np.asarray(columns['energy_impact'], dtype=np.float64),
+                              np.asarray(columns['energy_impact_per_s'], dtype=np.float64) * elapsed_s),
+        }
+
+    elapsed_s = [e / 1_000_000_000 for e in columns['elapsed_ns']]
+    return {
+        'cputime_ns': (columns['cputime_ns'],
+                       [v * 1_000_000 * e for v, e in zip(columns['cputime_ms_per_s'], elapsed_s)]),
+        'energy_impact': (columns['energy_impact'],
+                          [v * e for v, e in zip(columns['energy_impact_per_s'], elapsed_s)]),
+    }
+
+
+def percent_difference(x, y):
+    # Relative to the mean of both. 0 if both are 0 and inf if only one of them is.
+    if np is not None:
+        mean = (x + y) / 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            diff = np.abs(x - y) / mean * 100
+        diff[(x == 0) & (y == 0)] = 0
+        diff[(x == 0) ^ (y == 0)] = np.inf
+        return diff
+
+    def single(a, b):
+        if a == 0 and b == 0:
+            return 0
+        if a == 0 or b == 0:
+            return float('inf')
+        return abs(a - b) / ((a + b) / 2) * 100
+    return [single(a, b) for a, b in zip(x, y)]
+
+
+def summarize(names, columns, threshold):
+    summary = {}
+    if not names:
+        return summary
+
+    if np is not None:
+        unique_names, inverse = np.unique(np.asarray(names, dtype=object), return_inverse=True)
+        for metric, (dirty, clean) in dirty_and_clean(columns).items():
+            diff = percent_difference(dirty, clean)
+            finite = np.where(np.isinf(diff), 0, diff)
+            max_diff = np.zeros(len(unique_names))
+            np.maximum.at(max_diff, inverse, diff)
+            per_name = [np.bincount(inverse, minlength=len(unique_names)),
+                        np.bincount(inverse, weights=diff > threshold, minlength=len(unique_names)),
+                        np.bincount(inverse, weights=finite, minlength=len(unique_names)),
+                        max_diff,
+                        np.bincount(inverse, weights=dirty, minlength=len(unique_names)),
+                        np.bincount(inverse, weights=clean, minlength=len(unique_names))]
+            for i, name in enumerate(unique_names.tolist()):
+                summary[(name, metric)] = [float(column[i]) for column in per_name]
+        return summary
+
+    for metric, (dirty, clean) in dirty_and_clean(columns).items():
+        for name, d, c, diff in zip(names, dirty, clean, percent_difference(dirty, clean)):
+            current = summary.setdefault((name, metric), [0, 0, 0, 0, 0, 0])
+            current[0] += 1
+            current[1] += diff > threshold
+            current[2] += 0 if diff == float('inf') else diff
+            current[3] = max(current[3], diff)
+            current[4] += d
+            current[5] += c
+    return summary
+
+
+def add_summary(total, summary):
+    for key, values in summary.items():
+        if key not in total:
+            total[key] = [0] * len(SUMMARY_FIELDS)
+        current = total[key]
+        for i, field in enumerate(SUMMARY_FIELDS):
+            current[i] = max(current[i], values[i]) if field == 'max_diff' else current[i] + values[i]
+
+
+def analyze(outputs, threshold=SETTINGS['threshold']):
+    return summarize(*parse_samples(outputs), threshold)
+
+
+def read_outputs(filename):
+    buffer = []
+    with open(filename, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip().replace('&', '&amp;')
+            buffer.append(line)
+            if line == '</plist>':
+                yield ''.join(buffer)
+                buffer = []
+
+
+def batches(filenames, batch_size):
+    batch = []
+    for filename in filenames:
+        for output in read_outputs(filename):
+            batch.append(output)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def analyze_files(filenames, jobs=None, batch_size=50, threshold=SETTINGS['threshold']):
+    total = {}
+    if jobs == 1:
+        for batch in batches(filenames, batch_size):
+            add_summary(total, analyze(batch, threshold))
+        return total
+
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        # We only keep a few batches in flight so months of captures don't end up in memory
+        pending = set()
+        max_pending = (pool._max_workers) * 2 # pylint: disable=protected-access
+        for batch in batches(filenames, batch_size):
+            if stop_signal:
+                break
+            pending.add(pool.submit(analyze, batch, threshold))
+            if len(pending) >= max_pending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    add_summary(total, future.result())
+        for future in concurrent.futures.as_completed(pending):
+            add_summary(total, future.result())
+    return total
+
+
+def summary_rows(summary, top=None):
+    rows = []
+    for (name, metric), values in summary.items():
+        v = dict(zip(SUMMARY_FIELDS, values))
+        rows.append({
+            'name': name,
+            'metric': metric,
+            'samples': int(v['samples']),
+            'suspicious': int(v['suspicious']),
+            'suspicious_percent': round(v['suspicious'] / v['samples'] * 100, 2),
+            'mean_diff_percent': round(v['sum_diff'] / v['samples'], 2),
+            'max_diff_percent': v['max_diff'] if v['max_diff'] == float('inf') else round(v['max_diff'], 2),
+            'dirty_total': v['dirty'],
+            'clean_total': round(v['clean'], 2),
+        })
+    rows.sort(key=lambda r: (r['suspicious'], r['samples']), reverse=True)
+    return rows[:top]
+
+
+def print_summary(summary, top=None, output_format='text'):
+    rows = summary_rows(summary, top)
+    if output_format == 'json':
+        # JSON has no infinity. It means one of the values was 0.
+        for r in rows:
+            if r['max_diff_percent'] == float('inf'):
+                r['max_diff_percent'] = None
+        print(json.dumps(rows, indent=2))
+        return
+
+    print(f"{'Name':40} {'Metric':14} {'Samples':>8} {'Suspicious':>10} {'Susp %':>7} {'Mean %':>8} {'Max %':>8}")
+    for r in rows:
+        print(f"{r['name'][:40]:40} {r['metric']:14} {r['samples']:8} {r['suspicious']:10} "
+              f"{r['suspicious_percent']:7} {r['mean_diff_percent']:8} {r['max_diff_percent']:8}")
+
+
+def run_powermetrics():
+
+    cmd = ['powermetrics',
+            '--show-all',
+            '-i', str(SETTINGS['powermetrics']),
+            '-f', 'plist']
+
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True) as process:
+        buffer = []
+        for line in process.stdout:
+            line = line.strip().replace('&', '&amp;')
+            buffer.append(line)
+            if line == '</plist>':
+                add_summary(stats, analyze([''.join(buffer)], SETTINGS['threshold']))
+                buffer = []
+
+            if stop_signal:
+                break
+
+        if stop_signal:
+            process.terminate()
 
-                cpu_ns_dirty = process['cputime_ns']
-                cpu_ns_clean = ((process['cputime_ms_per_s'] * 1_000_000)  / 1_000_000_000) * data['elapsed_ns']
-
-                ei_dirty = process['energy_impact']
-                ei_clean =  process['energy_impact_per_s'] * data['elapsed_ns'] / 1_000_000_000
-
-                if is_difference_more_than_5_percent(cpu_ns_dirty, cpu_ns_clean) or \
-                    is_difference_more_than_5_percent(ei_dirty, ei_clean):
-
-                    print(f"Name       : {process['name']}")
-                    print(f"Elapsed ns : {data['elapsed_ns']}")
-                    print('')
-                    print(f"CPU Time ns       : {process['cputime_ns']}")
-                    print(f"CPU Time ns / con : {cpu_ns_clean}")
-                    print(f"cputime_ms_per_s  : {process['cputime_ms_per_s']}")
-                    print('')
-                    print(f"energy_impact       : {process['energy_impact']}")
-                    print(f"energy_impact con   : {ei_clean}")
-                    print(f"energy_impact_per_s : {process['energy_impact_per_s']}")
-                    print('')
-                    print(f"diskio_bytesread      : {process['diskio_bytesread']}")
-                    print(f"diskio_bytesread_per_s: {process['diskio_bytesread_per_s']}")
-                    print('')
-                    print(process)
-                    print('------------')
 
 if __name__ == '__main__':
-    run_powermetrics()
+    parser = argparse.ArgumentParser(description='Compares the per sample values of powermetrics with the per second ones.')
+    parser.add_argument('files', nargs='*', help='Captured powermetrics plist output. Runs powermetrics if empty.')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of processes to analyze the files with')
+    parser.add_argument('--threshold', type=float, default=SETTINGS['threshold'],
+                        help='Differences above this percent count as suspicious')
+    parser.add_argument('--top', type=int, help='Only show the n processes with the most suspicious samples')
+    parser.add_argument('--format', choices=['text', 'json'], default='text', help='Output format')
+    args = parser.parse_args()
+
+    SETTINGS['threshold'] = args.threshold
+
+    if args.files:
+        stats = analyze_files(args.files, args.jobs, threshold=args.threshold)
+    else:
+        run_powermetrics()
+
+    print_summary(stats, args.top, args.format)
@@ -0,0 +1,46 @@
+"""
+This migration moves the process names into their own table so top_processes rows only store an integer id. The old
+row shape is still available through the top_processes view.
+
+Migration Name: process_names
+Migration Version: 20261019100000
+"""
+
+def upgrade(connection):
+    connection.execute('''CREATE TABLE IF NOT EXISTS process_names
+                (id INTEGER PRIMARY KEY,
+                name STRING UNIQUE)''')
+
+    connection.execute('''CREATE TABLE IF NOT EXISTS process_measurements
+                (time INT, name_id INT, energy_impact INT, cputime_per INT)''')
+
+    connection.execute('''INSERT OR IGNORE INTO process_names (name)
+                SELECT DISTINCT IFNULL(name, '') FROM top_processes''')
+
+    connection.execute('''INSERT INTO process_measurements (time, name_id, energy_impact, cputime_per)
+                SELECT t.time, n.id, t.energy_impact, t.cputime_per
+                FROM top_processes t JOIN process_names n ON n.name = IFNULL(t.name, '')''')
+
+    connection.execute('DROP TABLE top_processes')
+
+    connection.execute('''CREATE VIEW top_processes AS
+                SELECT p.time, n.name, p.energy_impact, p.cputime_per
+                FROM process_measurements p JOIN process_names n ON n.id = p.name_id''')
+
+    connection.commit()
+
+
+def downgrade(connection):
+    connection.execute('DROP VIEW top_processes')
+
+    connection.execute('''CREATE TABLE top_processes
+                (time INT, name STRING, energy_impact INT, cputime_per INT)''')
+
+    connection.execute('''INSERT INTO top_processes (time, name, energy_impact, cputime_per)
+                SELECT p.time, n.name, p.energy_impact, p.cputime_per
+                FROM process_measurements p JOIN process_names n ON n.id = p.name_id''')
+
+    connection.execute('DROP TABLE process_measurements')
+    connection.execute('DROP TABLE process_names')
+
+    connection.commit()
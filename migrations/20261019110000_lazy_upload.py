@@ -0,0 +1,37 @@
+"""
+The upload records are now built from power_measurements and process_measurements when we upload and not stored for
+every sample. We need the values that were only part of the upload record in power_measurements and remember up to
+which time everything has been uploaded.
+
+Migration Name: lazy_upload
+Migration Version: 20261019110000
+"""
+
+def upgrade(connection):
+    connection.execute('ALTER TABLE power_measurements ADD COLUMN elapsed_ns INT')
+    connection.execute('ALTER TABLE power_measurements ADD COLUMN thermal_pressure STRING')
+    connection.execute('ALTER TABLE power_measurements ADD COLUMN grid_intensity INT')
+    connection.execute('ALTER TABLE power_measurements ADD COLUMN hw_model STRING')
+
+    connection.execute('CREATE INDEX IF NOT EXISTS power_measurements_time ON power_measurements (time)')
+    connection.execute('CREATE INDEX IF NOT EXISTS process_measurements_time ON process_measurements (time)')
+
+    connection.execute('CREATE TABLE IF NOT EXISTS upload_status (time INT)')
+    # Everything that is already in the DB has its record in measurements so we don't want to upload it again
+    connection.execute('INSERT INTO upload_status (time) SELECT IFNULL(MAX(time), 0) FROM power_measurements')
+
+    connection.commit()
+
+
+def downgrade(connection):
+    connection.execute('DROP TABLE upload_status')
+
+    connection.execute('DROP INDEX process_measurements_time')
+    connection.execute('DROP INDEX power_measurements_time')
+
+    connection.execute('ALTER TABLE power_measurements DROP COLUMN hw_model')
+    connection.execute('ALTER TABLE power_measurements DROP COLUMN grid_intensity')
+    connection.execute('ALTER TABLE power_measurements DROP COLUMN thermal_pressure')
+    connection.execute('ALTER TABLE power_measurements DROP COLUMN elapsed_ns')
+
+    connection.commit()
@@ -0,0 +1,23 @@
+"""
+Pending uploads are split into batches that are leased by the upload threads.
+
+Migration Name: upload_batches
+Migration Version: 20261019120000
+"""
+
+def upgrade(connection):
+    connection.execute('''CREATE TABLE IF NOT EXISTS upload_batches
+                (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source STRING,
+                first INT,
+                last INT,
+                idempotency_key STRING,
+                leased_until FLOAT DEFAULT 0)''')
+
+    connection.commit()
+
+
+def downgrade(connection):
+    connection.execute('DROP TABLE upload_batches')
+
+    connection.commit()
@@ -0,0 +1,19 @@
+"""
+Remembers up to which time the data has been downsampled to a coarser resolution to stay in the DB size budget.
+
+Migration Name: downsample_status
+Migration Version: 20261019130000
+"""
+
+def upgrade(connection):
+    connection.execute('''CREATE TABLE IF NOT EXISTS downsample_status
+                (resolution INT PRIMARY KEY,
+                until INT)''')
+
+    connection.commit()
+
+
+def downgrade(connection):
+    connection.execute('DROP TABLE downsample_status')
+
+    connection.commit()
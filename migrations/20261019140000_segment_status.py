@@ -0,0 +1,18 @@
+"""
+Remembers the last segment of the segment log sink that was compacted into the DB so a segment is never imported twice.
+
+Migration Name: segment_status
+Migration Version: 20261019140000
+"""
+
+def upgrade(connection):
+    connection.execute('CREATE TABLE IF NOT EXISTS segment_status (sequence INT)')
+    connection.execute('INSERT INTO segment_status (sequence) VALUES (-1)')
+
+    connection.commit()
+
+
+def downgrade(connection):
+    connection.execute('DROP TABLE segment_status')
+
+    connection.commit()
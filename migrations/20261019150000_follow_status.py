@@ -0,0 +1,20 @@
+"""
+Remembers how far we got in a file we follow with --follow so a restart continues after the last stored sample.
+
+Migration Name: follow_status
+Migration Version: 20261019150000
+"""
+
+def upgrade(connection):
+    connection.execute('''CREATE TABLE IF NOT EXISTS follow_status
+                (path STRING PRIMARY KEY,
+                inode INT,
+                offset INT)''')
+
+    connection.commit()
+
+
+def downgrade(connection):
+    connection.execute('DROP TABLE follow_status')
+
+    connection.commit()
@@ -0,0 +1,23 @@
+"""
+Quantile sketches of the power per sample for every hour and, once the hour is older than a week, every day. See
+libs/sketch.py.
+
+Migration Name: power_sketches
+Migration Version: 20261019160000
+"""
+
+def upgrade(connection):
+    connection.execute('''CREATE TABLE IF NOT EXISTS power_sketches
+                (time INT,
+                resolution INT,
+                metric STRING,
+                sketch BLOB,
+                PRIMARY KEY (time, resolution, metric))''')
+
+    connection.commit()
+
+
+def downgrade(connection):
+    connection.execute('DROP TABLE power_sketches')
+
+    connection.commit()
@@ -0,0 +1,23 @@
+"""
+Processes whose energy impact jumped way above their moving average. See libs/anomaly.py.
+
+Migration Name: process_anomalies
+Migration Version: 20261019170000
+"""
+
+def upgrade(connection):
+    connection.execute('''CREATE TABLE IF NOT EXISTS process_anomalies
+                (time INT,
+                name_id INT,
+                energy_impact INT,
+                expected INT,
+                score FLOAT)''')
+    connection.execute('CREATE INDEX IF NOT EXISTS process_anomalies_time ON process_anomalies (time)')
+
+    connection.commit()
+
+
+def downgrade(connection):
+    connection.execute('DROP TABLE process_anomalies')
+
+    connection.commit()
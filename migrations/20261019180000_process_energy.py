@@ -0,0 +1,30 @@
+"""
+Stores the share of the combined energy in mJ every process got next to its energy impact. What went to processes that
+are not stored is kept with the sample so both add up to combined_energy. The top_processes view shows the energy too.
+
+Migration Name: process_energy
+Migration Version: 20261019180000
+"""
+
+def upgrade(connection):
+    connection.execute('ALTER TABLE process_measurements ADD COLUMN combined_energy INT')
+    connection.execute('ALTER TABLE power_measurements ADD COLUMN unattributed_energy INT')
+
+    connection.execute('DROP VIEW top_processes')
+    connection.execute('''CREATE VIEW top_processes AS
+                SELECT p.time, n.name, p.energy_impact, p.cputime_per, p.combined_energy
+                FROM process_measurements p JOIN process_names n ON n.id = p.name_id''')
+
+    connection.commit()
+
+
+def downgrade(connection):
+    connection.execute('DROP VIEW top_processes')
+    connection.execute('''CREATE VIEW top_processes AS
+                SELECT p.time, n.name, p.energy_impact, p.cputime_per
+                FROM process_measurements p JOIN process_names n ON n.id = p.name_id''')
+
+    connection.execute('ALTER TABLE process_measurements DROP COLUMN combined_energy')
+    connection.execute('ALTER TABLE power_measurements DROP COLUMN unattributed_energy')
+
+    connection.commit()
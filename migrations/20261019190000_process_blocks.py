@@ -0,0 +1,60 @@
+"""
+Stores the top processes of a sample as one block instead of one row per process. A block is a JSON array with
+[name_id, energy_impact, cputime in µs, combined_energy] for every process. The time is only stored once per sample
+and there is one index entry per sample instead of one per process, which makes the DB about half the size.
+
+process_measurements becomes a view that decodes the blocks when it is queried, so everything that reads it gets the
+same rows as before. A time range on the view only decodes the blocks in that range. Inserts into the view are turned
+into a block per row by a trigger so old code that writes rows still works. The logger writes the blocks itself.
+
+Migration Name: process_blocks
+Migration Version: 20261019190000
+"""
+
+def upgrade(connection):
+    connection.execute('CREATE TABLE process_blocks (time INT, processes STRING)')
+    connection.execute('''INSERT INTO process_blocks (time, processes)
+                SELECT time, json_group_array(json_array(name_id, energy_impact, CAST(ROUND(cputime_per * 1000) AS INT),
+                    combined_energy))
+                FROM (SELECT * FROM process_measurements ORDER BY time, rowid)
+                GROUP BY time''')
+    connection.execute('CREATE INDEX process_blocks_time ON process_blocks (time)')
+
+    connection.execute('DROP VIEW top_processes')
+    connection.execute('DROP TABLE process_measurements')
+
+    connection.execute('''CREATE VIEW process_measurements AS
+                SELECT b.time, json_extract(p.value, '$[0]') AS name_id, json_extract(p.value, '$[1]') AS energy_impact,
+                    json_extract(p.value, '$[2]') / 1000.0 AS cputime_per, json_extract(p.value, '$[3]') AS combined_energy
+                FROM process_blocks b, json_each(b.processes) p''')
+    connection.execute('''CREATE TRIGGER process_measurements_insert INSTEAD OF INSERT ON process_measurements
+                BEGIN
+                    INSERT INTO process_blocks (time, processes) VALUES (NEW.time, json_array(json_array(NEW.name_id,
+                        NEW.energy_impact, CAST(ROUND(NEW.cputime_per * 1000) AS INT), NEW.combined_energy)));
+                END''')
+    connection.execute('''CREATE VIEW top_processes AS
+                SELECT p.time, n.name, p.energy_impact, p.cputime_per, p.combined_energy
+                FROM process_measurements p JOIN process_names n ON n.id = p.name_id''')
+
+    connection.commit()
+
+
+def downgrade(connection):
+    connection.execute('DROP VIEW top_processes')
+    connection.execute('DROP TRIGGER process_measurements_insert')
+    connection.execute('DROP VIEW process_measurements')
+
+    connection.execute('''CREATE TABLE process_measurements
+                (time INT, name_id INT, energy_impact INT, cputime_per INT, combined_energy INT)''')
+    connection.execute('''INSERT INTO process_measurements
+                SELECT b.time, json_extract(p.value, '$[0]'), json_extract(p.value, '$[1]'),
+                    json_extract(p.value, '$[2]') / 1000.0, json_extract(p.value, '$[3]')
+                FROM process_blocks b, json_each(b.processes) p''')
+    connection.execute('DROP TABLE process_blocks')
+    connection.execute('CREATE INDEX process_measurements_time ON process_measurements (time)')
+
+    connection.execute('''CREATE VIEW top_processes AS
+                SELECT p.time, n.name, p.energy_impact, p.cputime_per, p.combined_energy
+                FROM process_measurements p JOIN process_names n ON n.id = p.name_id''')
+
+    connection.commit()
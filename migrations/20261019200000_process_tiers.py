@@ -0,0 +1,75 @@
+"""
+Makes process_measurements a table with one row per process again. Decoding the blocks of process_blocks made every
+scan of the processes about three times slower, and the app, the reports and the upload all scan them.
+
+process_blocks only keeps the aggregated tier now: what the weekly roll-up and the downsampling of the size budget
+produce. These are few rows per time, and only read when we look at the whole history, so storing them as one block
+per time costs next to nothing to decode. The raw samples are written to process_measurements. process_history is a
+view over both tiers and top_processes now shows everything in it.
+
+All blocks are decoded into process_measurements here. The next optimizer run puts the aggregated ones back.
+
+Migration Name: process_tiers
+Migration Version: 20261019200000
+"""
+
+def upgrade(connection):
+    connection.execute('DROP VIEW top_processes')
+    connection.execute('DROP TRIGGER process_measurements_insert')
+    connection.execute('DROP VIEW process_measurements')
+
+    connection.execute('''CREATE TABLE process_measurements
+                (time INT, name_id INT, energy_impact INT, cputime_per INT, combined_energy INT)''')
+    connection.execute('''INSERT INTO process_measurements
+                SELECT b.time, json_extract(p.value, '$[0]'), json_extract(p.value, '$[1]'),
+                    json_extract(p.value, '$[2]') / 1000.0, json_extract(p.value, '$[3]')
+                FROM process_blocks b, json_each(b.processes) p
+                ORDER BY b.time''')
+    connection.execute('DELETE FROM process_blocks')
+    connection.execute('CREATE INDEX process_measurements_time ON process_measurements (time)')
+
+    connection.execute('''CREATE VIEW process_history AS
+                SELECT time, name_id, energy_impact, cputime_per, combined_energy FROM process_measurements
+                UNION ALL
+                SELECT b.time, json_extract(p.value, '$[0]'), json_extract(p.value, '$[1]'),
+                    json_extract(p.value, '$[2]') / 1000.0, json_extract(p.value, '$[3]')
+                FROM process_blocks b, json_each(b.processes) p''')
+    # A join on process_history would be materialized with all rows first, joining every tier on its own is as fast as
+    # the join on process_measurements
+    connection.execute('''CREATE VIEW top_processes AS
+                SELECT p.time, n.name, p.energy_impact, p.cputime_per, p.combined_energy
+                FROM process_measurements p JOIN process_names n ON n.id = p.name_id
+                UNION ALL
+                SELECT b.time, n.name, json_extract(p.value, '$[1]'), json_extract(p.value, '$[2]') / 1000.0,
+                    json_extract(p.value, '$[3]')
+                FROM process_blocks b, json_each(b.processes) p
+                    JOIN process_names n ON n.id = json_extract(p.value, '$[0]')''')
+
+    connection.commit()
+
+
+def downgrade(connection):
+    connection.execute('DROP VIEW top_processes')
+    connection.execute('DROP VIEW process_history')
+
+    connection.execute('''INSERT INTO process_blocks (time, processes)
+                SELECT time, json_group_array(json_array(name_id, energy_impact, CAST(ROUND(cputime_per * 1000) AS INT),
+                    combined_energy))
+                FROM (SELECT * FROM process_measurements ORDER BY time, rowid)
+                GROUP BY time''')
+    connection.execute('DROP TABLE process_measurements')
+
+    connection.execute('''CREATE VIEW process_measurements AS
+                SELECT b.time, json_extract(p.value, '$[0]') AS name_id, json_extract(p.value, '$[1]') AS energy_impact,
+                    json_extract(p.value, '$[2]') / 1000.0 AS cputime_per, json_extract(p.value, '$[3]') AS combined_energy
+                FROM process_blocks b, json_each(b.processes) p''')
+    connection.execute('''CREATE TRIGGER process_measurements_insert INSTEAD OF INSERT ON process_measurements
+                BEGIN
+                    INSERT INTO process_blocks (time, processes) VALUES (NEW.time, json_array(json_array(NEW.name_id,
+                        NEW.energy_impact, CAST(ROUND(NEW.cputime_per * 1000) AS INT), NEW.combined_energy)));
+                END''')
+    connection.execute('''CREATE VIEW top_processes AS
+                SELECT p.time, n.name, p.energy_impact, p.cputime_per, p.combined_energy
+                FROM process_measurements p JOIN process_names n ON n.id = p.name_id''')
+
+    connection.commit()
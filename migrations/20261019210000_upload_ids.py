@@ -0,0 +1,87 @@
+"""
+The upload follows power_measurements by an id and not by time anymore. time is the wall clock of the sample, so a
+clock that goes back or a capture that is followed after newer samples were stored adds rows before the time that is
+already uploaded, and these were never selected. The id only grows, AUTOINCREMENT never hands out an id again and unlike
+a rowid VACUUM doesn't change it.
+
+The rows get their ids in the order of their time. upload_status keeps the id of the last uploaded row and the open
+batches are moved to the ids of the rows they cover, so they keep their idempotency keys.
+
+Migration Name: upload_ids
+Migration Version: 20261019210000
+"""
+
+COLUMNS = '''time, combined_energy, cpu_energy, gpu_energy, ane_energy, energy_impact, co2eq, elapsed_ns,
+             thermal_pressure, grid_intensity, hw_model, unattributed_energy'''
+
+def upgrade(connection):
+    connection.execute('''CREATE TABLE power_measurements_ids
+                (time INT,
+                combined_energy INT,
+                cpu_energy INT,
+                gpu_energy INT,
+                ane_energy INT,
+                energy_impact INT,
+                co2eq FLOAT,
+                elapsed_ns INT,
+                thermal_pressure STRING,
+                grid_intensity INT,
+                hw_model STRING,
+                unattributed_energy INT,
+                id INTEGER PRIMARY KEY AUTOINCREMENT)''')
+    connection.execute(f'''INSERT INTO power_measurements_ids ({COLUMNS})
+                SELECT {COLUMNS} FROM power_measurements ORDER BY time, rowid''')
+    connection.execute('DROP TABLE power_measurements')
+    connection.execute('ALTER TABLE power_measurements_ids RENAME TO power_measurements')
+    connection.execute('CREATE INDEX power_measurements_time ON power_measurements (time)')
+
+    connection.execute('ALTER TABLE upload_status ADD COLUMN last_id INT')
+    connection.execute('''UPDATE upload_status SET last_id = (SELECT IFNULL(MAX(id), 0) FROM power_measurements
+                                                          WHERE time <= upload_status.time)''')
+    connection.execute('ALTER TABLE upload_status DROP COLUMN time')
+
+    connection.execute('''UPDATE upload_batches SET
+                first = (SELECT MIN(id) FROM power_measurements
+                         WHERE time BETWEEN upload_batches.first AND upload_batches.last),
+                last = (SELECT MAX(id) FROM power_measurements
+                        WHERE time BETWEEN upload_batches.first AND upload_batches.last)
+                WHERE source = 'power_measurements' ''')
+    connection.execute("DELETE FROM upload_batches WHERE source = 'power_measurements' AND first IS NULL")
+
+    connection.commit()
+
+
+def downgrade(connection):
+    connection.execute('''UPDATE upload_batches SET
+                first = (SELECT MIN(time) FROM power_measurements
+                         WHERE id BETWEEN upload_batches.first AND upload_batches.last),
+                last = (SELECT MAX(time) FROM power_measurements
+                        WHERE id BETWEEN upload_batches.first AND upload_batches.last)
+                WHERE source = 'power_measurements' ''')
+    connection.execute("DELETE FROM upload_batches WHERE source = 'power_measurements' AND first IS NULL")
+
+    connection.execute('ALTER TABLE upload_status ADD COLUMN time INT')
+    connection.execute('''UPDATE upload_status SET time = (SELECT IFNULL(MAX(time), 0) FROM power_measurements
+                                                       WHERE id <= upload_status.last_id)''')
+    connection.execute('ALTER TABLE upload_status DROP COLUMN last_id')
+
+    connection.execute('''CREATE TABLE power_measurements_times
+                (time INT,
+                combined_energy INT,
+                cpu_energy INT,
+                gpu_energy INT,
+                ane_energy INT,
+                energy_impact INT,
+                co2eq FLOAT,
+                elapsed_ns INT,
+                thermal_pressure STRING,
+                grid_intensity INT,
+                hw_model STRING,
+                unattributed_energy INT)''')
+    connection.execute(f'''INSERT INTO power_measurements_times ({COLUMNS})
+                SELECT {COLUMNS} FROM power_measurements ORDER BY id''')
+    connection.execute('DROP TABLE power_measurements')
+    connection.execute('ALTER TABLE power_measurements_times RENAME TO power_measurements')
+    connection.execute('CREATE INDEX power_measurements_time ON power_measurements (time)')
+
+    connection.commit()
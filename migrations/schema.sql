@@ -0,0 +1,115 @@
+-- The DB as all migrations leave it. New DBs are created from this in one go instead of replaying every migration.
+-- When you add a migration update this file and the version at the end. tests/schema_tester.py checks both match.
+
+BEGIN;
+
+CREATE TABLE migration_version (version text);
+
+CREATE TABLE measurements
+    (id INTEGER PRIMARY KEY,
+    time INT,
+    data STRING,
+    uploaded INT);
+
+CREATE TABLE power_measurements
+    (time INT,
+    combined_energy INT,
+    cpu_energy INT,
+    gpu_energy INT,
+    ane_energy INT,
+    energy_impact INT,
+    co2eq FLOAT,
+    elapsed_ns INT,
+    thermal_pressure STRING,
+    grid_intensity INT,
+    hw_model STRING,
+    unattributed_energy INT,
+    id INTEGER PRIMARY KEY AUTOINCREMENT);
+
+CREATE INDEX power_measurements_time ON power_measurements (time);
+
+CREATE TABLE settings
+    (time INT,
+    machine_uuid TEXT,
+    powermetrics INT,
+    api_url STRING,
+    upload_delta INT,
+    upload_data NUMERIC);
+
+CREATE TABLE process_names
+    (id INTEGER PRIMARY KEY,
+    name STRING UNIQUE);
+
+CREATE TABLE process_measurements
+    (time INT,
+    name_id INT,
+    energy_impact INT,
+    cputime_per INT,
+    combined_energy INT);
+
+CREATE INDEX process_measurements_time ON process_measurements (time);
+
+CREATE TABLE process_blocks
+    (time INT,
+    processes STRING);
+
+CREATE INDEX process_blocks_time ON process_blocks (time);
+
+CREATE VIEW process_history AS
+    SELECT time, name_id, energy_impact, cputime_per, combined_energy FROM process_measurements
+    UNION ALL
+    SELECT b.time, json_extract(p.value, '$[0]'), json_extract(p.value, '$[1]'),
+        json_extract(p.value, '$[2]') / 1000.0, json_extract(p.value, '$[3]')
+    FROM process_blocks b, json_each(b.processes) p;
+
+CREATE VIEW top_processes AS
+    SELECT p.time, n.name, p.energy_impact, p.cputime_per, p.combined_energy
+    FROM process_measurements p JOIN process_names n ON n.id = p.name_id
+    UNION ALL
+    SELECT b.time, n.name, json_extract(p.value, '$[1]'), json_extract(p.value, '$[2]') / 1000.0,
+        json_extract(p.value, '$[3]')
+    FROM process_blocks b, json_each(b.processes) p
+        JOIN process_names n ON n.id = json_extract(p.value, '$[0]');
+
+CREATE TABLE upload_status (last_id INT);
+INSERT INTO upload_status VALUES (0);
+
+CREATE TABLE upload_batches
+    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source STRING,
+    first INT,
+    last INT,
+    idempotency_key STRING,
+    leased_until FLOAT DEFAULT 0);
+
+CREATE TABLE downsample_status
+    (resolution INT PRIMARY KEY,
+    until INT);
+
+CREATE TABLE segment_status (sequence INT);
+INSERT INTO segment_status VALUES (-1);
+
+CREATE TABLE follow_status
+    (path STRING PRIMARY KEY,
+    inode INT,
+    offset INT);
+
+CREATE TABLE power_sketches
+    (time INT,
+    resolution INT,
+    metric STRING,
+    sketch BLOB,
+    PRIMARY KEY (time, resolution, metric));
+
+CREATE TABLE process_anomalies
+    (time INT,
+    name_id INT,
+    energy_impact INT,
+    expected INT,
+    score FLOAT);
+
+CREATE INDEX process_anomalies_time ON process_anomalies (time);
+
+INSERT INTO migration_version VALUES ('20261019210000');
+
+COMMIT;
@@ -4,11 +4,10 @@
 import json
 import subprocess
 import time
-import plistlib
 import argparse
 import zlib
 import base64
-import xml
+import xml.parsers.expat
 import signal
 import sys
 import uuid
@@ -23,12 +22,30 @@ import threading
 import logging
 import select
 import math
+import random
+import statistics
+import collections
+import heapq
 from functools import lru_cache
 
-from datetime import timezone
+from datetime import datetime
 from pathlib import Path
 
 from libs import caribou
+from libs import procfs
+from libs.sample_queue import SampleQueue
+from libs.segment_log import SegmentLog, read_records
+from libs.live_ring import RingWriter
+from libs import profiler as hog_profiler
+from libs.metrics_exporter import MetricsExporter
+from libs.follow import Follower
+from libs.sketch import DDSketch
+from libs.anomaly import EwmaDetector
+from libs import attribution
+from libs import report
+from libs import export
+from libs import rules
+from libs.sample import Sample, Processes, merge_processes, load_plist
 
 VERSION = '0.6'
 
@@ -60,6 +77,9 @@ APP_SUPPORT_PATH = Path(f"/Library/Application Support/{APP_NAME}")
 APP_SUPPORT_PATH.mkdir(parents=True, exist_ok=True)
 
 DATABASE_FILE = APP_SUPPORT_PATH / 'db.db'
+# The most recent samples for the app. See libs/live_ring.py
+LIVE_RING_FILE = APP_SUPPORT_PATH / 'live.ring'
+PROFILE_PATH = APP_SUPPORT_PATH / 'profiles'
 
 stats = {
     'combined_energy_mj': 0,
@@ -72,6 +92,7 @@ stats = {
 }
 
 MIGRATIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+SCHEMA_FILE = os.path.join(MIGRATIONS_PATH, 'schema.sql')
 
 global_settings = {}
 
@@ -80,6 +101,13 @@ machine_uuid = None
 conn = None
 c = None
 
+sample_queue = None
+live_ring = None
+profiler = None
+metrics_exporter = None
+sampling = None
+name_rules = None
+
 def kill_program():
     # We set the stop_signal for everything to shut down in an orderly fashion
     global stop_signal
@@ -102,11 +130,24 @@ def siginfo_handler(_, __):
     print(global_settings)
     print(stats)
     logging.info(f"System stats:\n{stats}\n{global_settings}")
+    if sample_queue:
+        print(sample_queue.counters)
+        logging.info(f"Sample queue:\n{sample_queue.counters}")
+    if name_rules:
+        print(name_rules.counters)
+        logging.info(f"Name rules:\n{name_rules.counters}")
+    profile_handler(_, __)
+
+def profile_handler(_, __):
+    if profiler:
+        logging.info(f"Profiles written to {profiler.dump()}")
 
 signal.signal(signal.SIGINT, sigint_handler)
 signal.signal(signal.SIGTERM, sigint_handler)
 
-signal.signal(signal.SIGINFO, siginfo_handler)
+# SIGINFO only exists on BSD systems like macOS. On Linux you can send SIGUSR1 instead
+signal.signal(getattr(signal, 'SIGINFO', signal.SIGUSR1), siginfo_handler)
+signal.signal(signal.SIGUSR2, profile_handler)
 
 
 
@@ -120,86 +161,365 @@ def sleeper(stop_event, duration):
         time.sleep(1)
 
 
-def run_powermetrics(local_stop_signal, filename: str = None):
+def process_samples(local_stop_signal, local_queue):
+    # This is the worker that does everything that can be slow so the reader can keep draining the powermetrics pipe
+    global storage_window, power_sketches, anomaly_detector
+    storage_window = StorageWindow(global_settings['storage_window'])
+    power_sketches = PowerSketches()
+    if global_settings['anomaly_threshold'] > 0:
+        anomaly_detector = EwmaDetector(global_settings['anomaly_threshold'], global_settings['anomaly_processes'])
+
+    while not local_queue.closed:
+        data = local_queue.get(timeout=1)
+        if data is None:
+            continue
+
+        try:
+            process_sample(data)
+        except Exception as exc: # pylint: disable=broad-exception-caught
+            logging.exception(f"Processing a sample failed: {exc}")
+            local_stop_signal.set()
+            local_queue.close()
+            return
+
+        logging.info(stats)
+
+    # We don't want to lose the last window when we shut down
+    flush_storage_window()
+    power_sketches.flush()
+
+
+def run_powermetrics(local_stop_signal, filename: str = None, follow=False):
+    global sample_queue, sampling
+
     buffer = []
 
-    def process_line(line):
+    # A replayed file has the interval it was recorded with
+    if not filename:
+        sampling = AdaptiveInterval(global_settings['powermetrics'],
+                                    global_settings['powermetrics_min'], global_settings['powermetrics_max'],
+                                    global_settings['adaptive_sampling'])
+
+    # When we read from a file there is no reason to merge or lose samples, we just read slower
+    policy = 'block' if filename else global_settings['queue_policy']
+    sample_queue = SampleQueue(global_settings['queue_size'], policy, merge_samples)
+
+    worker_thread = threading.Thread(target=process_samples, args=(local_stop_signal, sample_queue))
+    worker_thread.start()
+
+    def process_line(line, checkpoint=None):
         line = line.strip().replace('&', '&amp;')
         buffer.append(line)
 
         if line == '</plist>':
             logging.debug('Parsing new input')
-            parse_powermetrics_output(''.join(buffer))
+            for data in parse_plist(''.join(buffer)):
+                # Where the sample ends in the followed file. It is saved with the sample, see save_record.
+                data.checkpoint = checkpoint
+                sample_queue.put(data, local_stop_signal)
             buffer.clear()
 
-            logging.info(stats)
+    try:
+        if follow:
+            follow_file(local_stop_signal, process_line, filename, buffer.clear)
+        else:
+            read_powermetrics(local_stop_signal, process_line, filename, buffer.clear)
+    finally:
+        sample_queue.close()
+        worker_thread.join()
+        # Everything that is still in the segment log goes to the DB before we exit
+        sink.close()
+
 
+def read_powermetrics(local_stop_signal, process_line, filename: str = None, on_restart=None):
     if filename:
         logging.info(f"Reading file {filename}")
         with open(filename, 'r', encoding='utf-8') as file:
-            for line in file.readlines():
+            for line in file:
+                if local_stop_signal.is_set():
+                    break
                 process_line(line)
 
     else:
-        cmd = ['powermetrics',
-               '--show-all',
-               '-i', str(global_settings['powermetrics']),
-               '-f', 'plist']
+        # powermetrics can't change its interval while running so we restart it when the adaptive sampling asks for
+        # a new one. The sample it was in the middle of is lost.
+        while not local_stop_signal.is_set():
+            interval = sampling.interval
+            sampling.changed.clear()
+            if on_restart:
+                on_restart()
+            run_powermetrics_process(local_stop_signal, process_line, interval)
+
+
+def follow_file(local_stop_signal, process_line, filename, on_switch=None):
+    # For machines where powermetrics already writes to a file. We ingest what it appends and continue after the last
+    # sample that made it into the DB when we are restarted. on_switch is called when the file was rotated or
+    # truncated, the sample we were in the middle of will never be finished.
+    path = os.path.abspath(filename)
+
+    # Records in the segment log are not in the DB yet so their checkpoints aren't either
+    if global_settings['sink'] == 'segment':
+        sink.compact(0)
+
+    inode, offset = conn.execute('SELECT inode, offset FROM follow_status WHERE path = ?',
+                                 (path,)).fetchone() or (None, 0)
+
+    logging.info(f"Following file {path}")
+    follower = Follower(path, inode, offset, on_switch)
+    try:
+        for line, inode, offset in follower.lines(local_stop_signal):
+            process_line(line.decode('utf-8', errors='replace'), (path, inode, offset))
+    finally:
+        follower.close()
+
+
+def run_powermetrics_process(local_stop_signal, process_line, interval):
+    cmd = ['powermetrics',
+           '--show-all',
+           '-i', str(interval),
+           '-f', 'plist']
+
+    logging.info(f"Starting powermetrics process: {' '.join(cmd)}")
+
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True) as process:
+
+        os.set_blocking(process.stdout.fileno(), False)
+
+        partial_buffer = ''
+        while not local_stop_signal.is_set():
+            if sampling.changed.is_set():
+                logging.info(f"Sampling interval changed from {interval} to {sampling.interval} ms")
+                process.terminate()
+                return
+
+            # Make sure that the timeout is greater than the output is coming in
+            rlist, _, _ = select.select([process.stdout], [], [], interval / 1_000 * 2)
+            if rlist:
+                # This is a little hacky. The problem is that select just reads data and doesn't respect the lines
+                # so it happens that we read in the middle of a line.
+                data = rlist[0].read()
+
+                if data == '':
+                    logging.error('EOF reached: the subprocess has closed its stdout.')
+                    local_stop_signal.set()
+                    break
+
+                data = partial_buffer + data
+                lines = data.splitlines()
+                try:
+                    if not data.endswith('\n'):
+                        partial_buffer = lines.pop()
+                    else:
+                        partial_buffer = ''
+
+                    for line in lines:
+                        process_line(line)
+                except IndexError:
+                    # This happens when the process is killed before we exit here so stop_signal should be set. If not
+                    # there is a problem with powermetrics and we should report and exit.
+                    if not local_stop_signal.is_set():
+                        logging.error('The pipe to powermetrics has been closed. Exiting')
+                        local_stop_signal.set()
+                        break # be explicit
 
-        logging.info(f"Starting powermetrics process: {' '.join(cmd)}")
 
-        with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True) as process:
+def run_procfs(local_stop_signal, proc_path='/proc'):
+    # On Linux there is no powermetrics so we only record the processes from procfs
+    sampler = procfs.ProcessSampler(proc_path, global_settings['resolve_process'])
+    sampler.sample() # We need a baseline for the deltas
 
-            os.set_blocking(process.stdout.fileno(), False)
+    logging.info(f"Sampling processes from {proc_path}")
 
-            partial_buffer = ''
-            while not local_stop_signal.is_set():
-                # Make sure that the timeout is greater than the output is coming in
-                rlist, _, _ = select.select([process.stdout], [], [], int(global_settings['powermetrics'] / 1_000 * 2 ))
-                if rlist:
-                    # This is a little hacky. The problem is that select just reads data and doesn't respect the lines
-                    # so it happens that we read in the middle of a line.
-                    data = rlist[0].read()
+    while not local_stop_signal.is_set():
+        sleeper(local_stop_signal, global_settings['powermetrics'] / 1_000)
+        if local_stop_signal.is_set():
+            break
+
+        save_top_processes(c, int(time.time() * 1_000), sampler.find_top_processes())
+        conn.commit()
+        logging.debug('Processes added to the DB')
+
+    sampler.close()
+
+
+# We need to limit the amount of data here as otherwise the payload becomes to big
+UPLOAD_BATCH_SIZE = 10
+
+def build_upload_data(row, top_processes):
+    (_, timestamp, combined_energy, cpu_energy, gpu_energy, ane_energy, energy_impact, co2eq,
+     elapsed_ns, thermal_pressure, grid_intensity, hw_model) = row
+
+    return {
+        'machine_uuid': machine_uuid,
+        'timestamp': timestamp,
+        'top_processes': top_processes,
+        'timezone': f"{time.tzname[0]}/{time.tzname[1]}",
+        'grid_intensity_cog': grid_intensity,
+        'combined_energy_mj': combined_energy,
+        'cpu_energy_mj': cpu_energy,
+        'gpu_energy_mj': gpu_energy,
+        'ane_energy_mj': ane_energy,
+        'energy_impact': energy_impact,
+        'hw_model': hw_model,
+        'elapsed_ns': elapsed_ns,
+        'thermal_pressure': thermal_pressure,
+        'embodied_carbon_g': embodied_co2eq_g(round(elapsed_ns / 1_000_000_000)) if elapsed_ns else 0,
+        'operational_carbon_g': co2eq,
+    }
 
-                    if data == '':
-                        logging.error('EOF reached: the subprocess has closed its stdout.')
-                        local_stop_signal.set()
-                        break
-
-                    data = partial_buffer + data
-                    lines = data.splitlines()
-                    try:
-                        if not data.endswith('\n'):
-                            partial_buffer = lines.pop()
-                        else:
-                            partial_buffer = ''
-
-                        for line in lines:
-                            process_line(line)
-                    except IndexError:
-                        # This happens when the process is killed before we exit here so stop_signal should be set. If not
-                        # there is a problem with powermetrics and we should report and exit.
-                        if not local_stop_signal.is_set():
-                            logging.error('The pipe to powermetrics has been closed. Exiting')
-                            local_stop_signal.set()
-                            break # be explicit
+def encode_upload_data(upload_data):
+    compressed_data = zlib.compress(str(json.dumps(upload_data, cls=RemoveNaNEncoder)).encode())
+    return base64.b64encode(compressed_data).decode()
+
+def get_upload_rows(tc, source, first, last):
+    # Returns the rows of a batch as (row_id, time, data)
+    if source == 'measurements':
+        # Old versions stored the finished upload record for every sample
+        tc.execute('SELECT id, time, data FROM measurements WHERE id BETWEEN ? AND ? ORDER BY id;', (first, last))
+        return tc.fetchall()
+
+    tc.execute('''SELECT id, time, combined_energy, cpu_energy, gpu_energy, ane_energy, energy_impact, co2eq,
+                    elapsed_ns, thermal_pressure, grid_intensity, hw_model
+                  FROM power_measurements
+                  WHERE id BETWEEN ? AND ?
+                  ORDER BY id;''', (first, last))
+    rows = tc.fetchall()
+    if not rows:
+        return []
+
+    tc.execute('''SELECT p.time, n.name, p.energy_impact, p.cputime_per
+                  FROM process_measurements p JOIN process_names n ON n.id = p.name_id
+                  WHERE p.time IN (SELECT time FROM power_measurements WHERE id BETWEEN ? AND ?)
+                  ORDER BY p.time, p.rowid;''', (first, last))
+    top_processes = {}
+    for time_val, name, energy_impact, cputime_ms in tc.fetchall():
+        top_processes.setdefault(time_val, []).append({
+            'name': name,
+            'energy_impact': energy_impact,
+            'cputime_ms': cputime_ms,
+        })
 
+    return [(row[0], row[1], encode_upload_data(build_upload_data(row, top_processes.get(row[1], []))))
+            for row in rows]
+
+
+# Pending uploads are split into batches that are written to upload_batches before they are sent. A batch is leased by
+# one upload thread at a time so we can have multiple requests in flight. If we crash after the upload but before the
+# batch was acknowledged it is sent again with the same idempotency key so the server can drop the duplicate.
+UPLOAD_LEASE_SECONDS = 120
+UPLOAD_BACKOFF_BASE_SECONDS = 5
+
+upload_lock = threading.Lock()
+
+def reset_upload_leases():
+    # No upload thread is running yet so every lease is stale. Acknowledged batches stay acknowledged.
+    c.execute('UPDATE upload_batches SET leased_until = 0 WHERE leased_until IS NOT NULL;')
+    conn.commit()
+
+def create_upload_batch(tc, batch_size):
+    tc.execute("SELECT MAX(last) FROM upload_batches WHERE source = 'measurements';")
+    last_id = tc.fetchone()[0] or 0
+    tc.execute('SELECT id FROM measurements WHERE uploaded = 0 AND id > ? ORDER BY id LIMIT ?;', (last_id, batch_size))
+    ids = tc.fetchall()
+    if ids:
+        return 'measurements', ids[0][0], ids[-1][0]
+
+    # Batches are ranges of ids. The time of a row can be older than rows that are already uploaded, e.g. if the clock
+    # went back or we follow an old capture.
+    tc.execute('''SELECT MAX((SELECT last_id FROM upload_status),
+                      IFNULL((SELECT MAX(last) FROM upload_batches WHERE source = 'power_measurements'), 0));''')
+    last_power_id = tc.fetchone()[0]
+    tc.execute('SELECT id FROM power_measurements WHERE id > ? ORDER BY id LIMIT ?;', (last_power_id, batch_size))
+    power_ids = tc.fetchall()
+    if not power_ids:
+        return None
+
+    return 'power_measurements', power_ids[0][0], power_ids[-1][0]
+
+def lease_upload_batch(tc, batch_size=UPLOAD_BATCH_SIZE):
+    with upload_lock:
+        now = time.time()
+
+        tc.execute('''SELECT id, source, first, last, idempotency_key FROM upload_batches
+                      WHERE leased_until < ? ORDER BY id LIMIT 1;''', (now,))
+        batch = tc.fetchone()
+
+        if not batch:
+            new_batch = create_upload_batch(tc, batch_size)
+            if not new_batch:
+                return None
+            source, first, last = new_batch
+            idempotency_key = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{machine_uuid}/{source}/{first}/{last}"))
+            tc.execute('INSERT INTO upload_batches (source, first, last, idempotency_key) VALUES (?, ?, ?, ?);',
+                       (source, first, last, idempotency_key))
+            batch = (tc.lastrowid, source, first, last, idempotency_key)
+
+        tc.execute('UPDATE upload_batches SET leased_until = ? WHERE id = ?;', (now + UPLOAD_LEASE_SECONDS, batch[0]))
+        tc.connection.commit()
+        return batch
+
+def ack_upload_batch(tc, batch):
+    batch_id, source, first, last, _ = batch
+    with upload_lock:
+        if source == 'measurements':
+            tc.execute('DELETE FROM upload_batches WHERE id = ?;', (batch_id,))
+            tc.execute('DELETE FROM measurements WHERE id BETWEEN ? AND ?;', (first, last))
+        else:
+            # Batches can be acknowledged out of order. Everything before the oldest open batch is uploaded. The
+            # acknowledged batches after it are kept with leased_until NULL, otherwise create_upload_batch would
+            # create them again once the older batch is done.
+            tc.execute('UPDATE upload_batches SET leased_until = NULL WHERE id = ?;', (batch_id,))
+            tc.execute('''SELECT MIN(first) FROM upload_batches
+                          WHERE source = 'power_measurements' AND leased_until IS NOT NULL;''')
+            oldest_open = tc.fetchone()[0]
+            if oldest_open is None:
+                tc.execute("SELECT MAX(last) FROM upload_batches WHERE source = 'power_measurements';")
+                uploaded_until = tc.fetchone()[0]
+            else:
+                uploaded_until = oldest_open - 1
+            mark_uploaded(tc, uploaded_until)
+            tc.execute('''DELETE FROM upload_batches
+                          WHERE source = 'power_measurements' AND leased_until IS NULL AND last <= ?;''',
+                       (uploaded_until,))
+        tc.connection.commit()
+
+def release_upload_batch(tc, batch, retry_in):
+    with upload_lock:
+        tc.execute('UPDATE upload_batches SET leased_until = ? WHERE id = ?;', (time.time() + retry_in, batch[0]))
+        tc.connection.commit()
+
+def upload_backoff(failures):
+    # Exponential backoff with full jitter so that a fleet of clients doesn't hit the server at the same time after an
+    # outage. We never wait longer than the normal upload_delta.
+    return random.uniform(0, min(global_settings['upload_delta'], UPLOAD_BACKOFF_BASE_SECONDS * 2 ** failures))
+
+def mark_uploaded(tc, uploaded_until):
+    tc.execute('UPDATE upload_status SET last_id = MAX(last_id, ?);', (uploaded_until,))
+
+def uploaded_before(tc):
+    # Returns the time before which every row is uploaded. Rows are uploaded in the order of their id, which is not the
+    # order of their time, so this is the oldest row that is still to be uploaded and not the time of the last id.
+    tc.execute('''SELECT IFNULL(MIN(time), (SELECT IFNULL(MAX(time) + 1, 0) FROM power_measurements))
+                  FROM power_measurements WHERE id > (SELECT last_id FROM upload_status);''')
+    return tc.fetchone()[0]
 
 def upload_data_to_endpoint(local_stop_signal):
+    failures = 0
 
-    while not local_stop_signal.is_set():
-        thread_conn = sqlite3.connect(DATABASE_FILE)
-        tc = thread_conn.cursor()
+    thread_conn = sqlite3.connect(DATABASE_FILE)
+    tc = thread_conn.cursor()
 
-        # We need to limit the amount of data here as otherwise the payload becomes to big
-        tc.execute('SELECT id, time, data FROM measurements WHERE uploaded = 0 LIMIT 10;')
-        rows = tc.fetchall()
+    while not local_stop_signal.is_set():
+        batch = lease_upload_batch(tc, UPLOAD_BATCH_SIZE)
 
         # When everything is uploaded we sleep
-        if not rows:
+        if not batch:
             sleeper(local_stop_signal, global_settings['upload_delta'])
             continue
 
+        _, source, first, last, idempotency_key = batch
+        rows = get_upload_rows(tc, source, first, last)
+
         payload = []
         for row in rows:
             row_id, time_val, data_val = row
@@ -221,7 +541,7 @@ def upload_data_to_endpoint(local_stop_signal):
             })
 
         request_data = json.dumps(payload).encode('utf-8')
-        headers = {'content-type': 'application/json'}
+        headers = {'content-type': 'application/json', 'Idempotency-Key': idempotency_key}
         if global_settings['gmt_auth_token']:
             headers['X-Authentication'] = global_settings['gmt_auth_token']
 
@@ -237,18 +557,17 @@ def upload_data_to_endpoint(local_stop_signal):
 
         logging.info(f"Uploading {len(payload)} rows to: {global_settings['api_url']}")
 
+        uploaded = False
         try:
             start_time = time.time()
             with urllib.request.urlopen(req, timeout=30) as response:
                 if response.status == 204:
-                    for p in payload:
-                        tc.execute('DELETE FROM measurements WHERE id = ?;', (p['row_id'],))
-                    thread_conn.commit()
+                    ack_upload_batch(tc, batch)
+                    uploaded = True
                     upload_delta = time.time() - start_time
                     logging.debug(f"Uploaded. Took {upload_delta:.2f} seconds")
                 else:
                     logging.info(f"Failed to upload data: {payload}\n HTTP status: {response.status}")
-                    sleeper(local_stop_signal, global_settings['upload_delta']) # Sleep if there is an error
                 kill_timer.cancel()
         except (urllib.error.HTTPError,
                 ConnectionRefusedError,
@@ -257,11 +576,18 @@ def upload_data_to_endpoint(local_stop_signal):
                 ConnectionResetError) as exc:
             logging.debug(f"Upload exception: {exc}")
             kill_timer.cancel()
-            sleeper(local_stop_signal, global_settings['upload_delta']) # Sleep if there is an error
 
-        thread_conn.close()
+        if uploaded:
+            failures = 0
+        else:
+            retry_in = upload_backoff(failures)
+            failures += 1
+            release_upload_batch(tc, batch, retry_in)
+            sleeper(local_stop_signal, retry_in) # Sleep if there is an error
+
+    thread_conn.close()
 
-def find_top_processes(data: list, elapsed_ns:int):
+def find_top_processes(processes: Processes, elapsed_ns:int, energies: list = None):
     # As iterm2 will probably show up as it spawns the processes called from the shell we look at the tasks
     # new_data = []
     # for coalition in data:
@@ -269,18 +595,81 @@ def find_top_processes(data: list, elapsed_ns:int):
     #         new_data.extend(coalition['tasks'])
     #     else:
     #         new_data.append(coalition)
+    # energies are the mJ of every process from attribution.attribute_columns, in the same order as processes
+    if energies is None:
+        energies = [0] * len(processes)
+
     output = []
-    for p in sorted(data, key=lambda k: k['energy_impact'], reverse=True)[:15]:
+    # The same order as sorted(..., reverse=True)[:15] but without sorting all processes
+    for i in heapq.nlargest(15, range(len(processes)), key=processes.energy_impact.__getitem__):
         output.append({
-            'name': p['name'],
+            'name': processes.names[i],
             # Energy_impact and cputime are broken so we need to use the per_s and convert them
             # Check the https://www.green-coding.io/blog/ for details
-            'energy_impact': round((p['energy_impact_per_s'] / 1_000_000_000) * elapsed_ns),
-            'cputime_ms': p['cputime_ms_per_s'] * (elapsed_ns / 1_000_000_000),
+            'energy_impact': round((processes.energy_impact_per_s[i] / 1_000_000_000) * elapsed_ns),
+            'cputime_ms': processes.cputime_ms_per_s[i] * (elapsed_ns / 1_000_000_000),
+            'combined_energy': energies[i],
         })
     return output
 
 
+# Process names repeat every sample so we keep the name -> id mapping in memory. Names that come from a cmdline can
+# be quite unique so we don't let this grow forever.
+process_name_ids = {}
+PROCESS_NAME_CACHE_SIZE = 10_000
+
+# Held from looking up the ids of a sample until its rows are written, see prune_process_names
+process_names_lock = threading.Lock()
+
+def get_process_name_id(cursor, name):
+    # The cache is shared with the segment compactor so we never read it back after a clear
+    name_id = process_name_ids.get(name)
+    if name_id is None:
+        if len(process_name_ids) >= PROCESS_NAME_CACHE_SIZE:
+            process_name_ids.clear()
+        cursor.execute('INSERT OR IGNORE INTO process_names (name) VALUES (?)', (name,))
+        cursor.execute('SELECT id FROM process_names WHERE name = ?', (name,))
+        name_id = cursor.fetchone()[0]
+        process_name_ids[name] = name_id
+    return name_id
+
+def save_top_processes(cursor, timestamp, top_processes):
+    with process_names_lock:
+        cursor.executemany('''INSERT INTO process_measurements (time, name_id, energy_impact, cputime_per,
+                                combined_energy) VALUES (?, ?, ?, ?, ?)''',
+            [(timestamp, get_process_name_id(cursor, p['name']), p['energy_impact'], p['cputime_ms'],
+              p.get('combined_energy'))
+             for p in top_processes])
+
+def prune_process_names(tc):
+    # Deletes the names nothing refers to anymore, e.g. after trim_step. Must be called without an open transaction.
+    # A writer holds process_names_lock from taking an id out of the cache until its rows are written. So once the
+    # cache is cleared every id a writer still holds is in a row, and new ids only come from inside a write transaction
+    # that the DELETE has to wait for.
+    with process_names_lock:
+        process_name_ids.clear()
+    tc.execute('''DELETE FROM process_names
+                  WHERE id NOT IN (SELECT name_id FROM process_history)
+                    AND id NOT IN (SELECT name_id FROM process_anomalies);''')
+    pruned = tc.rowcount
+    tc.connection.commit()
+    return pruned
+
+# Aggregated rows go to the aggregated tier, see migrations/20261019200000_process_tiers.py. All processes of a time are
+# stored as one block with [name_id, energy_impact, cputime in µs, combined_energy] for every process.
+def save_process_blocks(tc, table):
+    # Stores the rows of table, which has the columns of process_measurements, as one block per time
+    tc.execute(f'''INSERT INTO process_blocks (time, processes)
+                   SELECT time, json_group_array(json_array(name_id, energy_impact,
+                       CAST(ROUND(cputime_per * 1000) AS INT), combined_energy))
+                   FROM {table} GROUP BY time;''')
+
+def delete_processes(tc, start, end):
+    # Deletes the processes of [start, end) from both tiers
+    tc.execute('DELETE FROM process_measurements WHERE time >= ? AND time < ?;', (start, end))
+    tc.execute('DELETE FROM process_blocks WHERE time >= ? AND time < ?;', (start, end))
+
+
 class RemoveNaNEncoder(json.JSONEncoder):
     def encode(self, obj):
         def remove_nan(o):
@@ -297,40 +686,23 @@ class RemoveNaNEncoder(json.JSONEncoder):
         return super(RemoveNaNEncoder, self).encode(cleaned_obj)
 
 
-def get_cmdline_shell_ps(pid):
-    try:
-        result = subprocess.run(
-            ['ps', '-p', str(pid), '-o', 'command='],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            check=True
-        )
-        return result.stdout.strip()
-    except subprocess.CalledProcessError:
-        return None
-
-def resolve_names(data):
-    updated_coalitions = []
-
-    for coalition in data['coalitions']:
-        name = coalition['name'].strip().lower()
-        if name in global_settings['resolve_coalitions'] or not name:
-            tasks = coalition.get('tasks', [])
-            updated_coalitions.extend(tasks if isinstance(tasks, list) else [coalition])
-        else:
-            updated_coalitions.append(coalition)
+# We only want to look up the cmdline once per process lifetime as this forks a ps on macOS
+cmdline_cache = procfs.CmdlineCache()
 
-    for i, coalition in enumerate(updated_coalitions):
-        if coalition['name'].lower().strip() in global_settings['resolve_process']:
-            if cmd := get_cmdline_shell_ps(coalition['pid']):
-                updated_coalitions[i]['name'] = cmd
+def resolve_names(sample: Sample):
+    # Returns the processes of the sample we attribute the energy to, see Sample.resolve
+    global name_rules
+    # The rules are compiled in main so a broken regex stops the start. Tests call this without main.
+    if name_rules is None:
+        name_rules = rules.NameRules(global_settings['resolve_coalitions'], global_settings['resolve_process'])
 
-    data['coalitions'] = updated_coalitions
+    processes = sample.resolve(name_rules, cmdline_cache.get)
+    cmdline_cache.end_sample()
 
-    return data
+    return processes
 
 get_grid_intensity_cache = {'value': None, 'timestamp': 0}
+ELECTRICITYMAPS_URL = 'https://api.electricitymap.org/v3/carbon-intensity/latest'
 
 def get_grid_intensity():
     global get_grid_intensity_cache
@@ -344,7 +716,7 @@ def get_grid_intensity():
     if time.time() - get_grid_intensity_cache['timestamp'] < 900:
         return get_grid_intensity_cache['value']
 
-    url = 'https://api.electricitymap.org/v3/carbon-intensity/latest'
+    url = ELECTRICITYMAPS_URL
     headers = {'auth-token': global_settings['electricitymaps_token']}
 
     kill_timer = threading.Timer(60.0, kill_program)
@@ -381,7 +753,7 @@ def get_mac_model():
         for line in result.stdout.splitlines():
             if 'Model Identifier' in line:
                 return line.split(":")[1].strip()
-    except subprocess.CalledProcessError as e:
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
         logging.error(f"Error occurred while fetching Mac model: {e}")
         return None
 
@@ -414,102 +786,434 @@ def embodied_co2eq_g(time_delta_seconds: int):
     return (embodied_co2eq_total / total_seconds) * time_delta_seconds * 1000 # in g
 
 
-def parse_powermetrics_output(output: str):
-    global stats
-
+def parse_plist(output: str):
+    # This is only the parsing so the reader thread can hand the samples on quickly. Everything slow happens in
+    # process_sample on the worker.
+    samples = []
     for data in output.encode('utf-8').split(b'\x00'):
         if data:
-            grid_intensity = get_grid_intensity()
-
             if data == b'powermetrics must be invoked as the superuser\n':
                 raise PermissionError('You need to run this script as root!')
 
             try:
-                data = plistlib.loads(data)
-                data = resolve_names(data)
-                # Sql can not handle timestamps so we convert them to milliseconds
-                data['timestamp'] = int(data['timestamp'].replace(tzinfo=timezone.utc).timestamp() * 1e3)
+                samples.append(Sample.from_plist(load_plist(data)))
             except xml.parsers.expat.ExpatError as exc:
                 logging.error(f"XML Error:\n{data}")
                 raise exc
 
+    return samples
+
 
-            cpu_energy_data = {}
-            energy_impact = round(data['all_tasks'].get('energy_impact_per_s') * data['elapsed_ns'] / 1_000_000_000)
-            if 'ane_energy' in data['processor']:
-                cpu_energy_data = {
-                    'combined_energy': round(data['processor'].get('combined_power', 0) * data['elapsed_ns'] / 1_000_000_000.0),
-                    'cpu_energy': round(data['processor'].get('cpu_energy', 0)),
-                    'gpu_energy': round(data['processor'].get('gpu_energy', 0)),
-                    'ane_energy': round(data['processor'].get('ane_energy', 0)),
-                    'energy_impact': energy_impact,
-                }
-            elif 'package_joules' in data['processor']:
-                # Intel processors report in joules/ watts and not mJ
-                cpu_energy_data = {
-                    'combined_energy': round(data['processor'].get('package_joules', 0) * 1_000),
-                    'cpu_energy': round(data['processor'].get('cpu_joules', 0) * 1_000),
-                    'gpu_energy': round(data['processor'].get('igpu_watts', 0) * data['elapsed_ns'] / 1_000_000_000.0 * 1_000),
-                    'ane_energy': 0,
-                    'energy_impact': energy_impact,
-                }
-
-            if grid_intensity:
-                co2eq = cpu_energy_data['combined_energy'] * grid_intensity / 3_600_000_000 # We need to convert to kWh from mJ
+THERMAL_PRESSURE_LEVELS = ['Nominal', 'Moderate', 'Heavy', 'Trapping', 'Sleeping']
+
+# These are numbers but not counters
+IDENTIFIER_KEYS = {'id', 'pid', 'parent_pid', 'responsible_pid', 'started_abstime_ns'}
+
+def merge_counters(a: dict, b: dict, a_ns: int, b_ns: int):
+    # Rates are weighted by the time they were measured over, everything else that is a number is a counter
+    merged = dict(b)
+    for key, value in a.items():
+        if key not in b or key in IDENTIFIER_KEYS or isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        if key.endswith(('_per_s', '_power', '_watts', '_ratio')):
+            merged[key] = (value * a_ns + b[key] * b_ns) / (a_ns + b_ns)
+        else:
+            merged[key] = value + b[key]
+    return merged
+
+def merge_samples(a: Sample, b: Sample):
+    # Merges two consecutive samples into one that covers both intervals. We use this when the processing can't keep
+    # up and the sample queue is full.
+    a_ns, b_ns = a.elapsed_ns, b.elapsed_ns
+    thermal_pressure = b.thermal_pressure
+    if a.thermal_pressure in THERMAL_PRESSURE_LEVELS and b.thermal_pressure in THERMAL_PRESSURE_LEVELS:
+        thermal_pressure = max(a.thermal_pressure, b.thermal_pressure, key=THERMAL_PRESSURE_LEVELS.index)
+    return Sample(b.time, a_ns + b_ns,
+                  merge_counters(a.processor, b.processor, a_ns, b_ns),
+                  (a.energy_impact_per_s * a_ns + b.energy_impact_per_s * b_ns) / (a_ns + b_ns),
+                  thermal_pressure,
+                  b.hw_model,
+                  *merge_processes(a, b, a_ns, b_ns),
+                  b.checkpoint)
+
+
+class StorageWindow:
+    # Accumulates the samples of one storage window in memory so we only write one row per window. The values are
+    # rounded per sample before they are summed so the totals are exactly the same as storing every sample.
+
+    def __init__(self, window_ms: int):
+        self.window_ms = window_ms
+        self.key = None
+        self.record = None
+        self.processes = {}
+
+    def add(self, record: dict, top_processes: list):
+        # Returns the finished (record, top_processes) of the previous window if this sample starts a new one
+        key = record['time'] // self.window_ms if self.window_ms > 0 else record['time']
+        finished = self.flush() if self.key is not None and key != self.key else None
+
+        if self.record is None:
+            self.key = key
+            self.record = dict(record)
+        else:
+            for field in ['combined_energy', 'cpu_energy', 'gpu_energy', 'ane_energy', 'energy_impact', 'elapsed_ns',
+                          'unattributed_energy']:
+                self.record[field] += record[field]
+            if record['co2eq'] is not None:
+                self.record['co2eq'] = (self.record['co2eq'] or 0) + record['co2eq']
+            if record['thermal_pressure'] in THERMAL_PRESSURE_LEVELS and \
+                    self.record['thermal_pressure'] in THERMAL_PRESSURE_LEVELS:
+                self.record['thermal_pressure'] = max(self.record['thermal_pressure'], record['thermal_pressure'],
+                                                      key=THERMAL_PRESSURE_LEVELS.index)
+            for field in ['time', 'grid_intensity', 'hw_model', 'checkpoint']:
+                self.record[field] = record[field]
+
+        for process in top_processes:
+            if process['name'] in self.processes:
+                self.processes[process['name']]['energy_impact'] += process['energy_impact']
+                self.processes[process['name']]['cputime_ms'] += process['cputime_ms']
+                self.processes[process['name']]['combined_energy'] += process['combined_energy']
             else:
-                co2eq = None
+                self.processes[process['name']] = dict(process)
+
+        if self.window_ms <= 0:
+            return self.flush()
+        return finished
+
+    def flush(self):
+        if self.record is None:
+            return None
+        # We keep every process that made it into the top processes of one of the samples so the totals stay the same
+        top_processes = sorted(self.processes.values(), key=lambda k: k['energy_impact'], reverse=True)
+        finished = (self.record, top_processes)
+        self.key = None
+        self.record = None
+        self.processes = {}
+        return finished
+
+
+storage_window = None
+
+
+# The power per sample of these record fields is kept in quantile sketches per hour so we can answer percentile
+# questions after the samples themselves are aggregated away. The hourly sketches are merged into daily ones by
+# optimize_DB after SKETCH_HOURLY_DAYS.
+SKETCH_METRICS = {
+    'combined_power': 'combined_energy',
+    'cpu_power': 'cpu_energy',
+    'gpu_power': 'gpu_energy',
+    'ane_power': 'ane_energy',
+}
+SKETCH_FLUSH_MS = 5 * 60 * 1000
+SKETCH_HOURLY_DAYS = 7
 
+def merge_power_sketch(cursor, time_ms, resolution, metric, sketch):
+    cursor.execute('SELECT sketch FROM power_sketches WHERE time = ? AND resolution = ? AND metric = ?',
+                   (time_ms, resolution, metric))
+    if row := cursor.fetchone():
+        sketch.merge(DDSketch.from_bytes(row[0]))
+    cursor.execute('INSERT OR REPLACE INTO power_sketches (time, resolution, metric, sketch) VALUES (?, ?, ?, ?)',
+                   (time_ms, resolution, metric, sketch.to_bytes()))
 
-            c.execute('''INSERT INTO power_measurements
-                      (time, combined_energy, cpu_energy, gpu_energy, ane_energy, energy_impact, co2eq ) VALUES
-                      (?, ?, ?, ?, ?, ?, ?)''',
-                    (data['timestamp'],
-                     cpu_energy_data['combined_energy'],
-                     cpu_energy_data['cpu_energy'],
-                     cpu_energy_data['gpu_energy'],
-                     cpu_energy_data['ane_energy'],
-                     cpu_energy_data['energy_impact'],
-                     co2eq))
+class PowerSketches:
+    # Collects the samples since the last flush in memory. A flush merges them into the stored sketch of the hour so
+    # a restart in the middle of an hour keeps what was there. At most SKETCH_FLUSH_MS of samples are lost on a crash.
 
+    def __init__(self):
+        self.hour = None
+        self.flushed_at = None
+        self.pending = {}
 
-            top_processes = find_top_processes(data['coalitions'], data['elapsed_ns'])
-            for process in top_processes:
-                c.execute('INSERT INTO top_processes (time, name, energy_impact, cputime_per) VALUES (?, ?, ?, ?)',
-                    (data['timestamp'], process['name'], process['energy_impact'], process['cputime_ms']))
+    def add(self, record):
+        if not record['elapsed_ns']:
+            return
 
+        hour = record['time'] // HOUR_MS * HOUR_MS
+        if self.hour is not None and hour != self.hour:
+            self.flush()
+        if self.hour is None:
+            self.hour = hour
+            self.flushed_at = record['time']
 
-            # Create the new upload data structure
-            upload_data = {
-                'machine_uuid': machine_uuid,
-                'timestamp': data['timestamp'],
-                'top_processes': top_processes,
-                'timezone': f"{time.tzname[0]}/{time.tzname[1]}",
-                'grid_intensity_cog': grid_intensity,
-                'combined_energy_mj': cpu_energy_data['combined_energy'],
-                'cpu_energy_mj': cpu_energy_data['cpu_energy'],
-                'gpu_energy_mj': cpu_energy_data['gpu_energy'],
-                'ane_energy_mj': cpu_energy_data['ane_energy'],
-                'energy_impact': cpu_energy_data['energy_impact'],
-                'hw_model': data['hw_model'],
-                'elapsed_ns': data['elapsed_ns'],
-                'thermal_pressure': data['thermal_pressure'],
-                'embodied_carbon_g': embodied_co2eq_g(round(data['elapsed_ns'] / 1_000_000_000)),
-                'operational_carbon_g': co2eq,
-            }
+        for metric, field in SKETCH_METRICS.items():
+            # mJ per ns to mW
+            self.pending.setdefault(metric, DDSketch()).add(record[field] * 1_000_000_000 / record['elapsed_ns'])
+
+        if record['time'] - self.flushed_at >= SKETCH_FLUSH_MS:
+            self.flush()
+
+    def flush(self):
+        if self.hour is None:
+            return
+        for metric, sketch in self.pending.items():
+            merge_power_sketch(c, self.hour, HOUR_MS, metric, sketch)
+        conn.commit()
+        logging.debug(f"Flushed the power sketches of {self.hour}")
+        self.hour = None
+        self.pending = {}
+
+power_sketches = None
+anomaly_detector = None
+
+
+# How many samples we look at before changing the interval and how much the power and energy impact have to move
+# (standard deviation / mean) to sample faster or slower
+ADAPTIVE_WINDOW = 6
+ADAPTIVE_BUSY = 0.25
+ADAPTIVE_IDLE = 0.05
+
+def coefficient_of_variation(values):
+    mean = statistics.fmean(values)
+    return statistics.pstdev(values, mean) / mean if mean else 0
+
+class AdaptiveInterval:
+    # If the power draw and energy impact move a lot we halve the powermetrics interval to see what is going on. If
+    # they stay flat we double it as sampling an idle machine often only costs energy. After every change we wait for
+    # a full window at the new interval so we don't flip back and forth.
+
+    def __init__(self, interval, min_interval, max_interval, enabled=True):
+        self.interval = interval
+        self.min_interval = min(min_interval, interval)
+        self.max_interval = max(max_interval, interval)
+        self.enabled = enabled
+        self.changed = threading.Event()
+        self.power = collections.deque(maxlen=ADAPTIVE_WINDOW)
+        self.energy_impact = collections.deque(maxlen=ADAPTIVE_WINDOW)
+
+    def add(self, record):
+        if not self.enabled or not record['elapsed_ns']:
+            return
+
+        elapsed_s = record['elapsed_ns'] / 1_000_000_000
+        self.power.append(record['combined_energy'] / elapsed_s)
+        self.energy_impact.append(record['energy_impact'] / elapsed_s)
+        if len(self.power) < ADAPTIVE_WINDOW:
+            return
+
+        variation = max(coefficient_of_variation(self.power), coefficient_of_variation(self.energy_impact))
+        if variation > ADAPTIVE_BUSY:
+            interval = max(self.min_interval, self.interval // 2)
+        elif variation < ADAPTIVE_IDLE:
+            interval = min(self.max_interval, self.interval * 2)
+        else:
+            return
+
+        if interval != self.interval:
+            logging.debug(f"Variation {variation:.2f}, changing the sampling interval to {interval} ms")
+            self.interval = interval
+            self.power.clear()
+            self.energy_impact.clear()
+            self.changed.set()
+
+
+def sampling_interval():
+    return sampling.interval if sampling else global_settings['powermetrics']
+
+def parse_powermetrics_output(output: str):
+    for data in parse_plist(output):
+        process_sample(data)
+
+def process_sample(sample: Sample):
+    global stats
 
-            compressed_data = zlib.compress(str(json.dumps(upload_data, cls=RemoveNaNEncoder)).encode())
-            compressed_data_str = base64.b64encode(compressed_data).decode()
+    grid_intensity = get_grid_intensity()
 
-            c.execute('INSERT INTO measurements (time, data, uploaded) VALUES (?, ?, 0)',
-                    (data['timestamp'], compressed_data_str))
+    processes = resolve_names(sample)
+    processor = sample.processor
+
+    cpu_energy_data = {}
+    energy_impact = round(sample.energy_impact_per_s * sample.elapsed_ns / 1_000_000_000)
+    if 'ane_energy' in processor:
+        cpu_energy_data = {
+            'combined_energy': round(processor.get('combined_power', 0) * sample.elapsed_ns / 1_000_000_000.0),
+            'cpu_energy': round(processor.get('cpu_energy', 0)),
+            'gpu_energy': round(processor.get('gpu_energy', 0)),
+            'ane_energy': round(processor.get('ane_energy', 0)),
+            'energy_impact': energy_impact,
+        }
+    elif 'package_joules' in processor:
+        # Intel processors report in joules/ watts and not mJ
+        cpu_energy_data = {
+            'combined_energy': round(processor.get('package_joules', 0) * 1_000),
+            'cpu_energy': round(processor.get('cpu_joules', 0) * 1_000),
+            'gpu_energy': round(processor.get('igpu_watts', 0) * sample.elapsed_ns / 1_000_000_000.0 * 1_000),
+            'ane_energy': 0,
+            'energy_impact': energy_impact,
+        }
+
+    if grid_intensity:
+        co2eq = cpu_energy_data['combined_energy'] * grid_intensity / 3_600_000_000 # We need to convert to kWh from mJ
+    else:
+        co2eq = None
+
+
+    record = {
+        'time': sample.time,
+        **cpu_energy_data,
+        'co2eq': co2eq,
+        'elapsed_ns': sample.elapsed_ns,
+        'thermal_pressure': sample.thermal_pressure,
+        'grid_intensity': grid_intensity,
+        'hw_model': sample.hw_model,
+        'checkpoint': sample.checkpoint,
+    }
+
+    # The combined energy is split over all coalitions. What the coalitions that are not in the top processes got is
+    # stored with the sample so the processes and unattributed_energy always add up to combined_energy.
+    energies = attribution.attribute_columns(processes.energy_impact_per_s, processes.cputime_ms_per_s,
+                                             cpu_energy_data['combined_energy'])
+    top_processes = find_top_processes(processes, sample.elapsed_ns, energies)
+    record['unattributed_energy'] = cpu_energy_data['combined_energy'] - sum(p['combined_energy'] for p in top_processes)
+
+    if live_ring:
+        live_ring.publish(record, top_processes)
+
+    if sampling:
+        sampling.add(record)
+
+    if metrics_exporter:
+        metrics_exporter.observe(top_processes)
+
+    # Before the storage window so the sketches see the power of every single sample
+    if power_sketches:
+        power_sketches.add(record)
+
+    if anomaly_detector and (anomalies := anomaly_detector.detect(record['time'], top_processes, record['elapsed_ns'])):
+        save_anomalies(c, anomalies)
+        conn.commit()
+
+    if finished := storage_window.add(record, top_processes):
+        sink.write(*finished)
+
+    sample_stats = {
+        'combined_energy_mj': cpu_energy_data['combined_energy'],
+        'cpu_energy_mj': cpu_energy_data['cpu_energy'],
+        'gpu_energy_mj': cpu_energy_data['gpu_energy'],
+        'ane_energy_mj': cpu_energy_data['ane_energy'],
+        'energy_impact': cpu_energy_data['energy_impact'],
+        'embodied_carbon_g': embodied_co2eq_g(round(sample.elapsed_ns / 1_000_000_000)),
+        'operational_carbon_g': co2eq,
+    }
+
+    for key in stats:
+        if sample_stats[key]:
+            stats[key] += sample_stats[key]
+
+def save_record(cursor, record: dict, top_processes: list):
+    # The upload record is built from these rows when we upload. See get_upload_rows
+    cursor.execute('''INSERT INTO power_measurements
+              (time, combined_energy, cpu_energy, gpu_energy, ane_energy, energy_impact, co2eq,
+               elapsed_ns, thermal_pressure, grid_intensity, hw_model, unattributed_energy) VALUES
+              (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            (record['time'],
+             record['combined_energy'],
+             record['cpu_energy'],
+             record['gpu_energy'],
+             record['ane_energy'],
+             record['energy_impact'],
+             record['co2eq'],
+             record['elapsed_ns'],
+             record['thermal_pressure'],
+             record['grid_intensity'],
+             record['hw_model'],
+             record.get('unattributed_energy')))
+
+    save_top_processes(cursor, record['time'], top_processes)
+
+    # In follow mode this is in the same transaction as the sample so after a restart we continue right after it
+    if record.get('checkpoint'):
+        cursor.execute('INSERT OR REPLACE INTO follow_status (path, inode, offset) VALUES (?, ?, ?)',
+                       record['checkpoint'])
+
+def save_anomalies(cursor, anomalies):
+    for a in anomalies:
+        logging.info(f"{a['name']} used {a['energy_impact']} energy impact, {a['expected']} was expected "
+                     f"(z-score {a['score']:.1f})")
+    with process_names_lock:
+        cursor.executemany('''INSERT INTO process_anomalies (time, name_id, energy_impact, expected, score)
+                              VALUES (?, ?, ?, ?, ?)''',
+            [(a['time'], get_process_name_id(cursor, a['name']), a['energy_impact'], a['expected'], a['score'])
+             for a in anomalies])
+
+def flush_storage_window():
+    if storage_window and (finished := storage_window.flush()):
+        sink.write(*finished)
+
+
+# Where the finished records go. The sqlite sink writes and commits every record. The segment sink appends the records
+# to a log on disk, which is a lot cheaper, and a compactor thread moves them into the DB in bulk every minute.
+SINKS = ['sqlite', 'segment']
+SEGMENT_COMPACT_INTERVAL = 60
+
+class SqliteSink:
+
+    def write(self, record, top_processes):
+        save_record(c, record, top_processes)
+        conn.commit()
+        logging.debug('Data added to the DB')
+
+    def close(self):
+        pass
+
+
+class SegmentSink:
+
+    def __init__(self, directory):
+        thread_conn = sqlite3.connect(DATABASE_FILE)
+        compacted = thread_conn.execute('SELECT sequence FROM segment_status').fetchone()[0]
+        thread_conn.close()
+
+        self.log = SegmentLog(directory, max_segment_age=SEGMENT_COMPACT_INTERVAL, first_sequence=compacted + 1)
+        self.compact_lock = threading.Lock()
+
+    def write(self, record, top_processes):
+        self.log.append(json.dumps([record, top_processes], separators=(',', ':')).encode())
+        logging.debug('Data added to the segment log')
+
+    def compact(self, min_age=SEGMENT_COMPACT_INTERVAL):
+        # Moves all sealed segments into the DB. The segment sequence is stored in the same transaction as the rows so
+        # if we crash before the file is removed it is not imported again.
+        self.log.rotate(min_age)
+
+        with self.compact_lock:
+            thread_conn = sqlite3.connect(DATABASE_FILE)
+            tc = thread_conn.cursor()
+            compacted = tc.execute('SELECT sequence FROM segment_status').fetchone()[0]
+
+            for sequence in self.log.sealed_segments():
+                path = self.log.path(sequence)
+                if sequence > compacted:
+                    records, _ = read_records(path)
+                    for payload in records:
+                        save_record(tc, *json.loads(payload))
+                    tc.execute('UPDATE segment_status SET sequence = ?', (sequence,))
+                    thread_conn.commit()
+                    logging.debug(f"Compacted {len(records)} records from {path}")
+                os.remove(path)
 
-            conn.commit()
-            logging.debug('Data added to the DB')
+            thread_conn.close()
 
+    def close(self):
+        self.log.close()
+        self.compact(0)
 
-            for key in stats:
-                if upload_data[key]:
-                    stats[key] += upload_data[key]
+
+sink = None
+
+def create_sink():
+    if global_settings['sink'] not in SINKS:
+        raise ValueError(f"Unknown sink {global_settings['sink']}. Must be one of {SINKS}")
+    if global_settings['sink'] == 'segment':
+        return SegmentSink(f"{DATABASE_FILE}.segments")
+    return SqliteSink()
+
+def compact_segments(local_stop_signal):
+    while not local_stop_signal.is_set():
+        sleeper(local_stop_signal, SEGMENT_COMPACT_INTERVAL)
+        try:
+            sink.compact()
+        except sqlite3.Error as exc:
+            logging.error(f"Compacting the segment log failed: {exc}")
 
 def save_settings():
     global machine_uuid
@@ -520,6 +1224,10 @@ def save_settings():
     if result:
         machine_uuid, last_powermetrics, last_api_url, last_upload_delta, last_upload_data = result
 
+        if global_settings['upload_data'] and not last_upload_data:
+            # Nothing that was recorded while uploading was disabled should be uploaded now
+            c.execute('UPDATE upload_status SET last_id = (SELECT IFNULL(MAX(id), 0) FROM power_measurements);')
+
         if (last_powermetrics == global_settings['powermetrics'] and
             last_api_url.strip() == global_settings['api_url'].strip() and
             last_upload_delta == global_settings['upload_delta'] and
@@ -551,26 +1259,33 @@ def is_powermetrics_running():
     except:
         return False
 
-def check_DB(local_stop_signal, stime: SharedTime):
-    # The powermetrics script should return ever global_settings['powermetrics'] ms but because of the way we batch things
+def check_db_interval():
+    # The powermetrics script should return ever sampling_interval() ms but because of the way we batch things
     # we will not get values every n ms so we have quite a big value here.
-    # powermetrics = 5000 ms in production and 1000 in dev mode
+    # powermetrics = 5000 ms in production and 1000 in dev mode. With adaptive sampling this follows the current interval.
 
-    interval_sec = global_settings['powermetrics'] * 20  / 1_000
+    # With a storage window we only get a new row per window. The segment sink only writes to the DB when compacting.
+    interval_sec = max(sampling_interval() * 20, global_settings['storage_window'] * 2) / 1_000
+    if global_settings['sink'] == 'segment':
+        interval_sec += SEGMENT_COMPACT_INTERVAL * 2
+    return interval_sec
 
+def check_DB(local_stop_signal, stime: SharedTime):
     # We first sleep for quite some time to give the program some time to add data to the DB
-    sleeper(local_stop_signal, interval_sec)
+    sleeper(local_stop_signal, check_db_interval())
 
 
     while not local_stop_signal.is_set():
         logging.debug('DB Check')
 
+        interval_sec = check_db_interval()
+
         n_ago = int((stime.get_tick() - interval_sec) * 1_000)
 
         thread_conn = sqlite3.connect(DATABASE_FILE)
         tc = thread_conn.cursor()
 
-        tc.execute('SELECT MAX(time) FROM measurements')
+        tc.execute('SELECT MAX(time) FROM power_measurements')
         result = tc.fetchone()
 
         thread_conn.close()
@@ -585,139 +1300,364 @@ def check_DB(local_stop_signal, stime: SharedTime):
 
         logging.debug('Power metrics running check')
         if not is_powermetrics_running():
-            logging.error('Powermetrics is not running. Stopping!')
-            local_stop_signal.set()
+            # When the sampling interval changes we might look just between stopping and starting powermetrics
+            sleeper(local_stop_signal, 1)
+            if not is_powermetrics_running():
+                logging.error('Powermetrics is not running. Stopping!')
+                local_stop_signal.set()
 
         sleeper(local_stop_signal, interval_sec)
 
 
-def optimize_DB(local_stop_signal):
-    while not local_stop_signal.is_set():
+HOUR_MS = 60 * 60 * 1000
+DAY_MS = 24 * HOUR_MS
 
-        logging.debug("Starting DB optimization for power_measurements")
+# Every step of the size budget enforcement only touches one day (raw -> hourly, trimming) or one week
+# (hourly -> daily) of data so one optimizer run never does unbounded work.
+DB_BUDGET_MAX_STEPS = 50
 
-        thread_conn = sqlite3.connect(DATABASE_FILE)
-        tc = thread_conn.cursor()
+def db_used_bytes(tc):
+    # Pages on the freelist are free space in the file that will be reused or removed by the next VACUUM
+    tc.execute('PRAGMA page_count;')
+    page_count = tc.fetchone()[0]
+    tc.execute('PRAGMA freelist_count;')
+    freelist_count = tc.fetchone()[0]
+    tc.execute('PRAGMA page_size;')
+    return (page_count - freelist_count) * tc.fetchone()[0]
+
+def aggregate_range(tc, start, end, bucket_ms):
+    # Replaces all rows in [start, end) with one row per bucket
+    thermal_pressure_index = ' '.join(f"WHEN '{level}' THEN {i}" for i, level in enumerate(THERMAL_PRESSURE_LEVELS))
+    thermal_pressure_level = ' '.join(f"WHEN {i} THEN '{level}'" for i, level in enumerate(THERMAL_PRESSURE_LEVELS))
+
+    tc.execute(f"""
+        CREATE TEMPORARY TABLE temp_downsample AS
+        SELECT
+            (time / ?) * ? AS time,
+            SUM(combined_energy) AS combined_energy,
+            SUM(cpu_energy) AS cpu_energy,
+            SUM(gpu_energy) AS gpu_energy,
+            SUM(ane_energy) AS ane_energy,
+            SUM(energy_impact) AS energy_impact,
+            SUM(co2eq) AS co2eq,
+            SUM(elapsed_ns) AS elapsed_ns,
+            CASE MAX(CASE thermal_pressure {thermal_pressure_index} END) {thermal_pressure_level} END AS thermal_pressure,
+            AVG(grid_intensity) AS grid_intensity,
+            MAX(hw_model) AS hw_model,
+            SUM(unattributed_energy) AS unattributed_energy,
+            MIN(id) AS id
+        FROM power_measurements
+        WHERE time >= ? AND time < ?
+        GROUP BY 1;
+    """, (bucket_ms, bucket_ms, start, end))
+    tc.execute('DELETE FROM power_measurements WHERE time >= ? AND time < ?;', (start, end))
+    # Every bucket keeps the smallest id of its rows. These rows are uploaded so a new id would upload them again.
+    tc.execute('''INSERT INTO power_measurements (time, combined_energy, cpu_energy, gpu_energy, ane_energy,
+                    energy_impact, co2eq, elapsed_ns, thermal_pressure, grid_intensity, hw_model, unattributed_energy,
+                    id)
+                  SELECT * FROM temp_downsample;''')
+    tc.execute('DROP TABLE temp_downsample;')
+
+    tc.execute('''
+        CREATE TEMPORARY TABLE temp_downsample AS
+        SELECT (time / ?) * ? AS time, name_id, SUM(energy_impact) AS energy_impact, SUM(cputime_per) AS cputime_per,
+            SUM(combined_energy) AS combined_energy
+        FROM process_history
+        WHERE time >= ? AND time < ?
+        GROUP BY 1, name_id;
+    ''', (bucket_ms, bucket_ms, start, end))
+    delete_processes(tc, start, end)
+    save_process_blocks(tc, 'temp_downsample')
+    tc.execute('DROP TABLE temp_downsample;')
+
+def downsample_step(tc, bucket_ms, chunk_ms, limit):
+    # Downsamples the next chunk of data that hasn't been brought to bucket_ms yet. Returns False if there is nothing
+    # left that we are allowed to touch.
+    tc.execute('SELECT until FROM downsample_status WHERE resolution = ?;', (bucket_ms,))
+    row = tc.fetchone()
+    if row:
+        start = row[0]
+    else:
+        tc.execute('SELECT MIN(time) FROM power_measurements;')
+        oldest = tc.fetchone()[0]
+        if oldest is None:
+            return False
+        start = (oldest // DAY_MS) * DAY_MS
+
+    end = min(start + chunk_ms, (limit // bucket_ms) * bucket_ms)
+    if end <= start:
+        return False
+
+    aggregate_range(tc, start, end, bucket_ms)
+    tc.execute('INSERT OR REPLACE INTO downsample_status (resolution, until) VALUES (?, ?);', (bucket_ms, end))
+    return True
+
+def trim_step(tc, limit):
+    # Deletes the oldest day of data
+    tc.execute('SELECT MIN(time) FROM power_measurements;')
+    oldest = tc.fetchone()[0]
+    if oldest is None:
+        return False
 
-        # This is for legacy systems. We just make sure that there are no values left
-        tc.execute('DELETE FROM measurements WHERE data IS NULL;')
+    end = min((oldest // DAY_MS) * DAY_MS + DAY_MS, limit)
+    if end <= oldest:
+        return False
+
+    tc.execute('DELETE FROM power_measurements WHERE time < ?;', (end,))
+    delete_processes(tc, 0, end)
+    tc.execute('DELETE FROM process_anomalies WHERE time < ?;', (end,))
+    # Only sketches that lie completely in the deleted range
+    tc.execute('DELETE FROM power_sketches WHERE time + resolution <= ?;', (end,))
+    return True
+
+def rollup_power_sketches(tc, before):
+    # Merges the hourly sketches of every UTC day that ended before `before` into daily ones and removes them
+    before = before // DAY_MS * DAY_MS
+    daily = {}
+    tc.execute('SELECT time, metric, sketch FROM power_sketches WHERE resolution = ? AND time < ?;', (HOUR_MS, before))
+    for time_ms, metric, data in tc.fetchall():
+        key = (time_ms // DAY_MS * DAY_MS, metric)
+        if key in daily:
+            daily[key].merge(DDSketch.from_bytes(data))
+        else:
+            daily[key] = DDSketch.from_bytes(data)
+
+    for (day, metric), sketch in daily.items():
+        merge_power_sketch(tc, day, DAY_MS, metric, sketch)
+    tc.execute('DELETE FROM power_sketches WHERE resolution = ? AND time < ?;', (HOUR_MS, before))
+    return len(daily)
+
+def enforce_db_size_budget(tc):
+    budget = global_settings['db_size_budget'] * 1024 * 1024
+    if budget <= 0:
+        return
+
+    if global_settings['upload_data']:
+        # Data that still needs to be uploaded must stay as it is
+        limit = uploaded_before(tc)
+    else:
+        limit = int(time.time() * 1000)
+
+    for _ in range(DB_BUDGET_MAX_STEPS):
+        used = db_used_bytes(tc)
+        if used <= budget:
+            return
+
+        tc.execute('SELECT IFNULL((SELECT until FROM downsample_status WHERE resolution = ?), 0);', (HOUR_MS,))
+        hourly_until = tc.fetchone()[0]
+
+        # We first bring the oldest data to hourly, then to daily and only then delete data
+        if downsample_step(tc, HOUR_MS, DAY_MS, limit):
+            logging.debug(f"DB uses {used} bytes of {budget}. Downsampled a day to hourly values.")
+        elif downsample_step(tc, DAY_MS, 7 * DAY_MS, min(limit, hourly_until)):
+            logging.debug(f"DB uses {used} bytes of {budget}. Downsampled a week to daily values.")
+        elif trim_step(tc, limit):
+            tc.connection.commit()
+            pruned = prune_process_names(tc)
+            logging.info(f"DB uses {used} bytes of {budget}. Deleted the oldest day and {pruned} unused names.")
+        else:
+            logging.error(f"DB uses {used} bytes of {budget} and there is nothing left we can downsample or delete.")
+            return
+
+        tc.connection.commit()
+
+    logging.info('DB is still over the size budget. Continuing in the next optimization run.')
+
+
+def optimize_db_once():
+    logging.debug("Starting DB optimization for power_measurements")
+
+    thread_conn = sqlite3.connect(DATABASE_FILE)
+    tc = thread_conn.cursor()
 
-        one_week_ago = int(time.time() * 1000) - 7 * 24 * 60 * 60 * 1000  # Adjusted for milliseconds
+    # This is for legacy systems. We just make sure that there are no values left
+    tc.execute('DELETE FROM measurements WHERE data IS NULL;')
 
-        aggregate_query = """
+    one_week_ago = int(time.time() * 1000) - 7 * 24 * 60 * 60 * 1000  # Adjusted for milliseconds
+
+    if global_settings['upload_data']:
+        # We can't aggregate rows that have not been uploaded yet as the upload record is built from them
+        one_week_ago = min(one_week_ago, uploaded_before(tc))
+    else:
+        # Old versions filled this even if the upload was disabled and nothing ever removed the rows
+        tc.execute('DELETE FROM measurements;')
+
+    aggregate_query = """
+    SELECT
+        strftime('%s', date(time / 1000, 'unixepoch')) * 1000 AS day_epoch,
+        SUM(combined_energy),
+        SUM(cpu_energy),
+        SUM(gpu_energy),
+        SUM(ane_energy),
+        SUM(energy_impact),
+        SUM(co2eq),
+        SUM(unattributed_energy),
+        MIN(id)
+    FROM
+        power_measurements
+    WHERE
+        time < ?
+    GROUP BY
+        day_epoch;
+    """
+    tc.execute(aggregate_query, (one_week_ago,))
+    aggregated_data = tc.fetchall()
+
+    tc.execute("""
+        CREATE TEMPORARY TABLE temp_power_measurements (
+            time INT,
+            combined_energy INT,
+            cpu_energy INT,
+            gpu_energy INT,
+            ane_energy INT,
+            energy_impact INT,
+            co2eq FLOAT,
+            unattributed_energy INT,
+            id INT
+        );
+    """)
+
+    insert_temp_query = """
+        INSERT INTO temp_power_measurements (time, combined_energy, cpu_energy, gpu_energy, ane_energy, energy_impact, co2eq,
+            unattributed_energy, id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
+    """
+    tc.executemany(insert_temp_query, aggregated_data)
+
+    delete_query = """
+        DELETE FROM power_measurements WHERE time < ?;
+    """
+    tc.execute(delete_query, (one_week_ago,))
+
+    # Like in aggregate_range every day keeps the smallest id of its rows so it isn't uploaded again
+    insert_back_query = """
+        INSERT INTO power_measurements (time, combined_energy, cpu_energy, gpu_energy, ane_energy, energy_impact, co2eq,
+            unattributed_energy, id)
+        SELECT * FROM temp_power_measurements;
+    """
+    tc.execute(insert_back_query)
+
+    tc.execute("DROP TABLE temp_power_measurements;")
+
+    logging.debug("Starting DB optimization for top_processes")
+
+    # Do the same with processes
+    aggregate_query = """
         SELECT
-            strftime('%s', date(time / 1000, 'unixepoch')) * 1000 AS day_epoch,
-            SUM(combined_energy),
-            SUM(cpu_energy),
-            SUM(gpu_energy),
-            SUM(ane_energy),
-            SUM(energy_impact),
-            SUM(co2eq)
+            name_id,
+            SUM(energy_impact) AS total_energy_impact,
+            SUM(cputime_per) AS total_cputime_per,
+            SUM(combined_energy) AS total_combined_energy
         FROM
-            power_measurements
+            process_history
         WHERE
             time < ?
         GROUP BY
-            day_epoch;
-        """
-        tc.execute(aggregate_query, (one_week_ago,))
-        aggregated_data = tc.fetchall()
-
-        tc.execute("""
-            CREATE TEMPORARY TABLE temp_power_measurements (
-                time INT,
-                combined_energy INT,
-                cpu_energy INT,
-                gpu_energy INT,
-                ane_energy INT,
-                energy_impact INT,
-                co2eq FLOAT
-            );
-        """)
-
-        insert_temp_query = """
-            INSERT INTO temp_power_measurements (time, combined_energy, cpu_energy, gpu_energy, ane_energy, energy_impact, co2eq)
-            VALUES (?, ?, ?, ?, ?, ?, ?);
-        """
-        tc.executemany(insert_temp_query, aggregated_data)
-
-        delete_query = """
-            DELETE FROM power_measurements WHERE time < ?;
-        """
-        tc.execute(delete_query, (one_week_ago,))
-
-        insert_back_query = """
-            INSERT INTO power_measurements (time, combined_energy, cpu_energy, gpu_energy, ane_energy, energy_impact, co2eq)
-            SELECT * FROM temp_power_measurements;
-        """
-        tc.execute(insert_back_query)
-
-        tc.execute("DROP TABLE temp_power_measurements;")
-
-        logging.debug("Starting DB optimization for top_processes")
-
-        # Do the same with processes
-        aggregate_query = """
-            SELECT
-                name,
-                SUM(energy_impact) AS total_energy_impact,
-                AVG(cputime_per) AS average_cputime_per
-            FROM
-                top_processes
-            WHERE
-                time < ?
-            GROUP BY
-                name;
-        """
-        tc.execute(aggregate_query, (one_week_ago,))
-        aggregated_data = tc.fetchall()
-
-        tc.execute("""
-            CREATE TEMPORARY TABLE temp_top_processes (
-                name STRING,
-                total_energy_impact INT,
-                average_cputime_per INT
-            );
-        """)
-
-        insert_temp_query = """
-            INSERT INTO temp_top_processes (name, total_energy_impact, average_cputime_per)
-            VALUES (?, ?, ?);
-        """
-        tc.executemany(insert_temp_query, aggregated_data)
-
-        tc.execute("DELETE FROM top_processes WHERE time < ?;", (one_week_ago,))
-
-        insert_back_query = """
-            INSERT INTO top_processes (time, name, energy_impact, cputime_per)
-            SELECT ?, name, total_energy_impact, average_cputime_per FROM temp_top_processes;
-        """
-        tc.execute(insert_back_query, (one_week_ago,))
-
-        # Drop the temporary table
-        tc.execute("DROP TABLE temp_top_processes;")
-
-        thread_conn.commit()
-
-        # We vacuum to actually reduce the file size. We probably don't need to vacuum this often but I would rather
-        # do it here then have another thread.
-        tc.execute("VACUUM;")
-
-        logging.debug("Ending DB optimization")
+            name_id;
+    """
+    tc.execute(aggregate_query, (one_week_ago,))
+    aggregated_data = tc.fetchall()
 
-        sleeper(local_stop_signal, 3600) # We only need to optimize every hour
+    tc.execute("""
+        CREATE TEMPORARY TABLE temp_top_processes (
+            name_id INT,
+            total_energy_impact INT,
+            total_cputime_per INT,
+            total_combined_energy INT
+        );
+    """)
 
-        thread_conn.close()
+    insert_temp_query = """
+        INSERT INTO temp_top_processes (name_id, total_energy_impact, total_cputime_per, total_combined_energy)
+        VALUES (?, ?, ?, ?);
+    """
+    tc.executemany(insert_temp_query, aggregated_data)
+
+    delete_processes(tc, 0, one_week_ago)
+
+    insert_back_query = """
+        INSERT INTO process_blocks (time, processes)
+        SELECT ?, json_group_array(json_array(name_id, total_energy_impact,
+            CAST(ROUND(total_cputime_per * 1000) AS INT), total_combined_energy))
+        FROM temp_top_processes HAVING COUNT(*) > 0;
+    """
+    tc.execute(insert_back_query, (one_week_ago,))
+
+    # Drop the temporary table
+    tc.execute("DROP TABLE temp_top_processes;")
+
+    rolled_up = rollup_power_sketches(tc, int(time.time() * 1000) - SKETCH_HOURLY_DAYS * DAY_MS)
+    logging.debug(f"Rolled up {rolled_up} daily power sketches")
+
+    thread_conn.commit()
+
+    enforce_db_size_budget(tc)
+
+    pruned = prune_process_names(tc)
+    logging.debug(f"Deleted {pruned} process names that are not used anymore")
+
+    # We vacuum to actually reduce the file size. We probably don't need to vacuum this often but I would rather
+    # do it here then have another thread.
+    tc.execute("VACUUM;")
+
+    logging.debug("Ending DB optimization")
+
+    thread_conn.close()
+
+def optimize_DB(local_stop_signal):
+    while not local_stop_signal.is_set():
+        optimize_db_once()
+        sleeper(local_stop_signal, 3600) # We only need to optimize every hour
 
 
 def is_power_logger_running():
     try:
-        subprocess.check_output(['pgrep', '-f', sys.argv[0]])
-        logging.error(f"There is already a {sys.argv[0]} process running! Maybe check launchctl?")
-        sys.exit(4)
+        output = subprocess.check_output(['pgrep', '-f', sys.argv[0]]).decode()
     except subprocess.CalledProcessError:
         return False
 
+    # pgrep on macOS excludes itself and all ancestors. On Linux it only excludes itself so we need to filter out our
+    # own process and the sudo/ shell that started us.
+    pids = {int(pid) for pid in output.split()} - procfs.get_ancestors(os.getpid())
+    if pids:
+        logging.error(f"There is already a {sys.argv[0]} process running! Maybe check launchctl?")
+        sys.exit(4)
+    return False
+
+def latest_migration(directory=MIGRATIONS_PATH):
+    # Migration files start with their version so we don't need to import them like caribou does
+    versions = [f[:caribou.UTC_LENGTH] for f in os.listdir(directory)
+                if f.endswith('.py') and f[:caribou.UTC_LENGTH].isdigit()]
+    return max(versions, default=None)
+
+def schema_version(cursor):
+    try:
+        row = cursor.execute(f"SELECT version FROM {caribou.VERSION_TABLE}").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return str(row[0]) if row else None
+
+def migrate_db(connection, db_file=None):
+    # caribou imports every migration and opens its own connection on every start just to find out there is nothing
+    # to do. We only call it if the version in the DB is not the newest migration. A new DB is created from the
+    # consolidated schema in one transaction and only the migrations that are newer than the schema are replayed.
+    cursor = connection.cursor()
+    latest = latest_migration()
+    version = schema_version(cursor)
+    if version == latest:
+        return
+
+    if version is None and not cursor.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()[0]:
+        with open(SCHEMA_FILE, 'r', encoding='utf-8') as f:
+            connection.executescript(f.read())
+        version = schema_version(cursor)
+        logging.info(f"Created the DB from the schema at version {version}")
+        if version == latest:
+            return
+
+    logging.info(f"Migrating the DB from version {version} to {latest}")
+    caribou.upgrade(db_file or DATABASE_FILE, MIGRATIONS_PATH)
+
 def set_tick(local_stop_signal, stime):
     while not local_stop_signal.is_set():
         stime.set_tick()
@@ -734,6 +1674,20 @@ def get_settings(debug = False, test=False):
         'electricitymaps_token': None,
         'powermetrics': 5000,
         'upload_delta': 300,
+        'upload_concurrency': 2,
+        'adaptive_sampling': False,
+        'powermetrics_min': 1000,
+        'powermetrics_max': 30000,
+        'storage_window': 0,
+        'db_size_budget': 0,
+        'queue_size': 60,
+        'queue_policy': 'coalesce',
+        'sink': 'sqlite',
+        'live_samples': 60,
+        'metrics_port': 0,
+        'metrics_top_processes': 20,
+        'anomaly_threshold': 4.0,
+        'anomaly_processes': 1000,
         'api_url': 'http://api.green-coding.internal:9142/v2/hog/add',
         'gmt_auth_token': 'DEFAULT',
     }
@@ -776,6 +1730,20 @@ def get_settings(debug = False, test=False):
         ret_settings = {
             'powermetrics': int(config['DEFAULT'].get('powermetrics', default_settings['powermetrics'])),
             'upload_delta': int(config['DEFAULT'].get('upload_delta', default_settings['upload_delta'])),
+            'upload_concurrency': int(config['DEFAULT'].getint('upload_concurrency', default_settings['upload_concurrency'])),
+            'adaptive_sampling': bool(config['DEFAULT'].getboolean('adaptive_sampling', default_settings['adaptive_sampling'])),
+            'powermetrics_min': int(config['DEFAULT'].getint('powermetrics_min', default_settings['powermetrics_min'])),
+            'powermetrics_max': int(config['DEFAULT'].getint('powermetrics_max', default_settings['powermetrics_max'])),
+            'storage_window': int(config['DEFAULT'].getint('storage_window', default_settings['storage_window'])),
+            'db_size_budget': int(config['DEFAULT'].getint('db_size_budget', default_settings['db_size_budget'])),
+            'queue_size': int(config['DEFAULT'].getint('queue_size', default_settings['queue_size'])),
+            'queue_policy': config['DEFAULT'].get('queue_policy', default_settings['queue_policy']).strip(),
+            'sink': config['DEFAULT'].get('sink', default_settings['sink']).strip(),
+            'live_samples': int(config['DEFAULT'].getint('live_samples', default_settings['live_samples'])),
+            'metrics_port': int(config['DEFAULT'].getint('metrics_port', default_settings['metrics_port'])),
+            'metrics_top_processes': int(config['DEFAULT'].getint('metrics_top_processes', default_settings['metrics_top_processes'])),
+            'anomaly_threshold': float(config['DEFAULT'].getfloat('anomaly_threshold', default_settings['anomaly_threshold'])),
+            'anomaly_processes': int(config['DEFAULT'].getint('anomaly_processes', default_settings['anomaly_processes'])),
             'api_url': config['DEFAULT'].get('api_url', default_settings['api_url']),
             'upload_data': bool(config['DEFAULT'].getboolean('upload_data', default_settings['upload_data'])),
             'resolve_coalitions': config['DEFAULT'].get('resolve_coalitions', default_settings['resolve_coalitions']),
@@ -789,15 +1757,60 @@ def get_settings(debug = False, test=False):
     else:
         ret_settings = default_settings
 
+    # The rules are lower cased in libs/rules.py, regexes have to keep their case
     if not isinstance(ret_settings['resolve_coalitions'], list):
-        ret_settings['resolve_coalitions'] = [x.strip().lower() for x in ret_settings['resolve_coalitions'].split(',')]
+        ret_settings['resolve_coalitions'] = [x.strip() for x in ret_settings['resolve_coalitions'].split(',')]
 
     if not isinstance(ret_settings['resolve_process'], list):
-        ret_settings['resolve_process'] = [x.strip().lower() for x in ret_settings['resolve_process'].split(',')]
+        ret_settings['resolve_process'] = [x.strip() for x in ret_settings['resolve_process'].split(',')]
 
     return ret_settings
 
 
+def run_report(report_args):
+    # Reports only read the DB so they don't need root and can run next to the logger
+    def day_ms(day):
+        return int(time.mktime(datetime.strptime(day, '%Y-%m-%d').timetuple()) * 1_000)
+
+    start_ms = day_ms(report_args.start) if report_args.start else 0
+    end_ms = day_ms(report_args.end) + report.DAY_MS if report_args.end else 2**62
+    work_hours = tuple(int(h) for h in report_args.work_hours.split('-'))
+
+    read_conn = sqlite3.connect(f"file:{DATABASE_FILE}?mode=ro", uri=True)
+    result = report.Report(work_hours, use_numpy=not report_args.no_numpy).read(read_conn.cursor(), start_ms, end_ms)
+    read_conn.close()
+
+    tables = {name: rows for name, rows in result.tables(report_args.top).items() if name in report_args.reports}
+
+    if report_args.format == 'csv':
+        report.write_csv(tables, sys.stdout)
+    else:
+        json.dump({'backend': result.backend, **tables}, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+def run_export(export_args):
+    # Like the reports this only reads the DB. Raises ValueError for a table or range that can't be exported.
+    def day_ms(day):
+        return int(time.mktime(datetime.strptime(day, '%Y-%m-%d').timetuple()) * 1_000)
+
+    start_ms = day_ms(export_args.start) if export_args.start else None
+    end_ms = day_ms(export_args.end) + report.DAY_MS if export_args.end else None
+
+    read_conn = sqlite3.connect(f"file:{DATABASE_FILE}?mode=ro", uri=True)
+    try:
+        if export_args.output:
+            with open(export_args.output, 'w', encoding='utf-8', newline='') as out:
+                rows = export.export(read_conn.cursor(), out, export_args.table, start_ms, end_ms, export_args.format,
+                                     export_args.jobs, not export_args.raw)
+        else:
+            rows = export.export(read_conn.cursor(), sys.stdout, export_args.table, start_ms, end_ms,
+                                 export_args.format, export_args.jobs, not export_args.raw)
+    finally:
+        read_conn.close()
+    print(f"Exported {rows} rows of {export_args.table}", file=sys.stderr)
+
+
 if __name__ == '__main__':
 
 
@@ -815,19 +1828,61 @@ if __name__ == '__main__':
     parser.add_argument('-d', '--dev', action='store_true', help='Enable development mode api endpoints and log level.')
     parser.add_argument('-w', '--website', action='store_true', help='Shows the website URL')
     parser.add_argument('-f', '--file', type=str, help='Path to the input file')
+    parser.add_argument('--follow', action='store_true',
+                        help='Keep reading the file as powermetrics appends to it. Continues where it stopped.')
     parser.add_argument('-v', '--log-level', choices=LOG_LEVELS, default='info', help='Logging level')
     parser.add_argument('-o', '--output-file', type=str, help='Path to the output log file.')
     parser.add_argument('-t', '--test', action='store_true', help='If this is set the program will write to the test DB.')
+    parser.add_argument('-p', '--profile', choices=hog_profiler.MODES,
+                        help='Profile all threads. Profiles are written on SIGINFO/ SIGUSR2 and on exit.')
+    parser.add_argument('--profile-dir', type=str, help='Where to write the profiles to.')
+
+    subparsers = parser.add_subparsers(dest='command')
+    report_parser = subparsers.add_parser('report', help='Prints aggregates of the local DB and exits.')
+    report_parser.add_argument('--from', dest='start', type=str, help='First day to include as YYYY-MM-DD')
+    report_parser.add_argument('--to', dest='end', type=str, help='Last day to include as YYYY-MM-DD')
+    report_parser.add_argument('--format', choices=['json', 'csv'], default='json', help='Output format')
+    report_parser.add_argument('--reports', type=lambda x: x.split(','), default=report.REPORTS,
+                               help=f"Comma separated list of reports out of {','.join(report.REPORTS)}")
+    report_parser.add_argument('--work-hours', type=str, default='9-17', help='Working hours on weekdays as start-end')
+    report_parser.add_argument('--top', type=int, help='Only list the top n apps per day')
+    report_parser.add_argument('--no-numpy', action='store_true', help="Don't use NumPy even if it is installed")
+
+    export_parser = subparsers.add_parser('export', help='Streams a table of the local DB as NDJSON or CSV and exits.')
+    export_parser.add_argument('table', help='Table to export, like power_measurements or measurements')
+    export_parser.add_argument('--from', dest='start', type=str, help='First day to include as YYYY-MM-DD')
+    export_parser.add_argument('--to', dest='end', type=str, help='Last day to include as YYYY-MM-DD')
+    export_parser.add_argument('--format', choices=export.FORMATS, default='ndjson', help='Output format')
+    export_parser.add_argument('--output', type=str, help='File to write to instead of stdout')
+    export_parser.add_argument('-j', '--jobs', type=int, default=1, help='Encode the rows in this many processes')
+    export_parser.add_argument('--raw', action='store_true', help="Don't decode the data column of measurements")
 
     args = parser.parse_args()
 
     if args.dev:
         args.log_level = 'debug'
 
+    if args.follow and not args.file:
+        parser.error('--follow needs a file to follow (-f)')
+
     if args.test:
         DATABASE_FILE = '/tmp/power_hog_test.db'
+        LIVE_RING_FILE = '/tmp/power_hog_test.ring'
+        PROFILE_PATH = '/tmp/power_hog_test_profiles'
 
-    conn = sqlite3.connect(DATABASE_FILE)
+    if args.command == 'report':
+        run_report(args)
+        sys.exit(0)
+
+    if args.command == 'export':
+        try:
+            run_export(args)
+        except ValueError as exc:
+            parser.error(str(exc))
+        sys.exit(0)
+
+    # The samples are written by the worker thread. The connection is only ever used by one thread at a time.
+    conn = sqlite3.connect(DATABASE_FILE, check_same_thread=False)
     c = conn.cursor()
 
     log_level = getattr(logging, args.log_level.upper())
@@ -842,12 +1897,23 @@ if __name__ == '__main__':
 
     global_settings = get_settings(args.dev, args.test)
 
+    try:
+        name_rules = rules.NameRules(global_settings['resolve_coalitions'], global_settings['resolve_process'])
+    except ValueError as exc:
+        parser.error(str(exc))
+
     if os.geteuid() != 0:
         logging.error('The script needs to be run as root!')
         sys.exit(1)
 
     is_power_logger_running()
 
+    # We start profiling before any other thread is started so we see all of them
+    if args.profile:
+        profiler = hog_profiler.Profiler(args.profile, args.profile_dir or PROFILE_PATH)
+        profiler.start()
+        logging.info(f"Profiling with {args.profile}")
+
     # Make sure that everyone can write to the DB
     os.chmod(DATABASE_FILE, stat.S_IRUSR | stat.S_IWUSR |
                 stat.S_IRGRP | stat.S_IWGRP |
@@ -855,7 +1921,7 @@ if __name__ == '__main__':
 
 
     # Make sure the DB is migrated
-    caribou.upgrade(DATABASE_FILE, MIGRATIONS_PATH)
+    migrate_db(conn)
 
     if not save_settings():
         logging.debug(f"Setting: {global_settings}")
@@ -868,13 +1934,32 @@ if __name__ == '__main__':
     shared_time = SharedTime()
 
     if global_settings['upload_data']:
-        upload_thread = threading.Thread(target=upload_data_to_endpoint, args=(stop_signal,))
-        upload_thread.start()
-        logging.debug('Upload thread started')
-
-    db_checker_thread = threading.Thread(target=check_DB, args=(stop_signal, shared_time), daemon=True)
-    db_checker_thread.start()
-    logging.debug('DB checker thread started')
+        reset_upload_leases()
+        for _ in range(max(1, global_settings['upload_concurrency'])):
+            upload_thread = threading.Thread(target=upload_data_to_endpoint, args=(stop_signal,))
+            upload_thread.start()
+        logging.debug(f"{global_settings['upload_concurrency']} upload threads started")
+
+    if global_settings['metrics_port'] > 0:
+        metrics_exporter = MetricsExporter(global_settings['metrics_port'], stats, global_settings['metrics_top_processes'])
+        metrics_exporter.start()
+        logging.debug(f"Metrics exporter listening on 127.0.0.1:{metrics_exporter.port}")
+
+    # In procfs mode there is no powermetrics process and no measurements for the checker to look at
+    procfs_mode = not args.file and sys.platform == 'linux'
+
+    if not procfs_mode:
+        sink = create_sink()
+        if global_settings['live_samples'] > 0:
+            live_ring = RingWriter(LIVE_RING_FILE, global_settings['live_samples'])
+        if global_settings['sink'] == 'segment':
+            compact_thread = threading.Thread(target=compact_segments, args=(stop_signal,), daemon=True)
+            compact_thread.start()
+            logging.debug('Segment compactor thread started')
+
+        db_checker_thread = threading.Thread(target=check_DB, args=(stop_signal, shared_time), daemon=True)
+        db_checker_thread.start()
+        logging.debug('DB checker thread started')
 
     ticker_thread = threading.Thread(target=set_tick, args=(stop_signal, shared_time), daemon=True)
     ticker_thread.start()
@@ -885,6 +1970,13 @@ if __name__ == '__main__':
     logging.debug('DB optimizer thread started')
 
 
-    run_powermetrics(stop_signal, args.file)
+    try:
+        if procfs_mode:
+            run_procfs(stop_signal)
+        else:
+            run_powermetrics(stop_signal, args.file, args.follow)
+    finally:
+        if profiler:
+            logging.info(f"Profiles written to {profiler.stop()}")
 
     c.close()
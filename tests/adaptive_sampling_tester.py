@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# Runs power_logger.py against a fake powermetrics that records the interval it was started with. The fake reports a
+# jumpy power draw first and a flat one after that. The interval has to go down to the minimum and then up to the
+# maximum and the DB check has to follow it.
+
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+from libs import caribou
+
+START, MIN, MAX = 400, 100, 1600
+PHASE_TIMEOUT = 30
+
+FAKE_POWERMETRICS = '''#!{python}
+import sys, time, random, plistlib, datetime
+
+interval = int(sys.argv[sys.argv.index('-i') + 1])
+with open({log!r}, 'a', encoding='utf-8') as f:
+    f.write(f"{{interval}}\\n")
+
+with open({fixture!r}, 'rb') as f:
+    sample = plistlib.loads(f.read().split(b'</plist>')[0] + b'</plist>')
+
+while True:
+    with open({phase!r}, 'r', encoding='utf-8') as f:
+        busy = f.read() == 'busy'
+    sample['timestamp'] = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    sample['elapsed_ns'] = interval * 1_000_000
+    sample['processor']['combined_power'] = random.uniform(1_000, 20_000) if busy else 5_000
+    sample['all_tasks']['energy_impact_per_s'] = random.uniform(10, 500) if busy else 100
+    sys.stdout.buffer.write(plistlib.dumps(sample) + b'\\n')
+    sys.stdout.flush()
+    time.sleep(interval / 1_000)
+'''
+
+
+def requested():
+    with open(log_file, 'r', encoding='utf-8') as f:
+        return [int(line) for line in f]
+
+
+def wait_for(interval):
+    end = time.time() + PHASE_TIMEOUT
+    while time.time() < end and not stop.is_set():
+        if power_logger.sampling and power_logger.sampling.interval == interval and requested()[-1] == interval:
+            return True
+        time.sleep(0.1)
+    return False
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    log_file = os.path.join(tmp, 'intervals')
+    phase_file = os.path.join(tmp, 'phase')
+    with open(phase_file, 'w', encoding='utf-8') as f:
+        f.write('busy')
+
+    fake = os.path.join(tmp, 'powermetrics')
+    with open(fake, 'w', encoding='utf-8') as f:
+        f.write(FAKE_POWERMETRICS.format(
+            python=sys.executable, log=log_file, phase=phase_file,
+            fixture=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'powermetrics_test_output.plist')))
+    os.chmod(fake, 0o755)
+    os.environ['PATH'] = f"{tmp}:{os.environ['PATH']}"
+
+    db_file = os.path.join(tmp, 'adaptive.db')
+    caribou.upgrade(db_file, power_logger.MIGRATIONS_PATH)
+    power_logger.conn = sqlite3.connect(db_file, check_same_thread=False)
+    power_logger.c = power_logger.conn.cursor()
+    power_logger.global_settings = {**power_logger.get_settings(test=True), 'adaptive_sampling': True,
+                                    'powermetrics': START, 'powermetrics_min': MIN, 'powermetrics_max': MAX}
+    power_logger.sink = power_logger.SqliteSink()
+
+    stop = threading.Event()
+    logger = threading.Thread(target=power_logger.run_powermetrics, args=(stop,))
+    logger.start()
+
+    went_down = wait_for(MIN)
+    with open(phase_file, 'w', encoding='utf-8') as f:
+        f.write('idle')
+    went_up = went_down and wait_for(MAX)
+    check_interval = power_logger.check_db_interval()
+
+    stop.set()
+    logger.join()
+    rows = power_logger.conn.execute('SELECT COUNT(*) FROM power_measurements').fetchone()[0]
+    power_logger.conn.close()
+    intervals = requested()
+
+print(f"Requested intervals: {intervals}, {rows} rows stored")
+
+if not went_down or not went_up or intervals[0] != START or sorted(intervals[:intervals.index(MIN) + 1], reverse=True) \
+        != intervals[:intervals.index(MIN) + 1] or sorted(intervals[intervals.index(MIN):]) != intervals[intervals.index(MIN):]:
+    print('[ERROR] The sampling interval did not follow the activity!')
+    raise SystemExit(1)
+
+if check_interval != MAX * 20 / 1_000:
+    print(f"[ERROR] The DB check did not follow the interval! {check_interval}")
+    raise SystemExit(1)
+
+print('[PASS] The sampling interval follows the activity!')
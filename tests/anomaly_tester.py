@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+# Feeds synthetic samples with noisy but steady processes through power_logger.py and injects spikes into some of
+# them. Every spike and nothing else has to end up in process_anomalies. The interval changes between samples so the
+# detector has to look at the energy impact per second. Also checks that the state of the detector stays bounded.
+
+import os
+import sys
+import random
+import sqlite3
+import plistlib
+import datetime
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+from libs.anomaly import EwmaDetector
+from libs.sample import Sample
+
+SAMPLES = 600
+PROCESSES = 15
+SPIKES = 20
+THRESHOLD = 6
+
+random.seed(7)
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'powermetrics_test_output.plist'), 'rb') as f:
+    template = plistlib.loads(f.read().split(b'</plist>')[0] + b'</plist>')
+
+rates = {f"app{i}": random.uniform(5, 500) for i in range(PROCESSES)}
+# A spike makes the variance of the process go up for a while so the spikes of one process are far apart
+spikes = set()
+while len(spikes) < SPIKES:
+    i, name = random.randrange(50, SAMPLES), random.choice(list(rates))
+    if all(n != name or abs(j - i) > 50 for j, n in spikes):
+        spikes.add((i, name))
+
+
+def sample(i, now):
+    elapsed_ns = random.choice([1, 2, 5]) * 1_000_000_000
+    coalitions = []
+    for name, rate in rates.items():
+        rate = rate * random.gauss(1, 0.05)
+        if (i, name) in spikes:
+            rate = rate * 8 + 200
+        coalitions.append({'name': name, 'pid': 0, 'energy_impact_per_s': rate, 'cputime_ms_per_s': 1.0,
+                           'energy_impact': 0, 'tasks': []})
+    return Sample.from_plist({**template, 'timestamp': now, 'elapsed_ns': elapsed_ns, 'coalitions': coalitions}), elapsed_ns
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    db_file = os.path.join(tmp, 'anomaly.db')
+    power_logger.conn = sqlite3.connect(db_file)
+    power_logger.c = power_logger.conn.cursor()
+    power_logger.migrate_db(power_logger.conn, db_file)
+    power_logger.global_settings = power_logger.get_settings(test=True)
+    power_logger.storage_window = power_logger.StorageWindow(0)
+    power_logger.anomaly_detector = EwmaDetector(THRESHOLD)
+    power_logger.sink = power_logger.SqliteSink()
+
+    now = datetime.datetime(2026, 10, 19, 12)
+    times = []
+    for i in range(SAMPLES):
+        data, elapsed_ns = sample(i, now)
+        power_logger.process_sample(data)
+        times.append(int(now.replace(tzinfo=datetime.timezone.utc).timestamp() * 1_000))
+        now += datetime.timedelta(microseconds=elapsed_ns // 1_000)
+
+    found = {(times.index(t), name) for t, name in power_logger.conn.execute(
+        'SELECT a.time, n.name FROM process_anomalies a JOIN process_names n ON n.id = a.name_id').fetchall()}
+    power_logger.conn.close()
+
+print(f"{len(spikes)} spikes injected, {len(found)} anomalies found")
+if found != spikes:
+    print(f"[ERROR] Missed {sorted(spikes - found)}, wrongly flagged {sorted(found - spikes)}")
+    raise SystemExit(1)
+
+detector = EwmaDetector(max_processes=10)
+for i in range(1_000):
+    detector.detect(i, [{'name': f"proc{i % 50}", 'energy_impact': 10}], 1_000_000_000)
+if len(detector.state) != 10 or detector.counters['evicted'] != 990:
+    print(f"[ERROR] The detector isn't bounded: {len(detector.state)} processes, {detector.counters}")
+    raise SystemExit(1)
+
+print('[PASS] All injected spikes were found and nothing else!')
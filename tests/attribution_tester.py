@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+# Checks that the combined energy of a sample is split over the coalitions in whole mJ that add up exactly, that NumPy
+# and the fallback agree and that the stored processes and unattributed_energy add up to combined_energy per row.
+
+import os
+import sys
+import time
+import array
+import random
+import sqlite3
+import plistlib
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+from libs import attribution
+
+plistfile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'powermetrics_test_output.plist')
+
+
+def fail(message):
+    print(f"[ERROR] {message}")
+    raise SystemExit(1)
+
+
+random.seed(3)
+for _ in range(500):
+    coalitions = [{'energy_impact_per_s': random.choice([0, random.uniform(0, 50), random.uniform(0, 5000)]),
+                   'cputime_ms_per_s': random.uniform(0, 1000)} for _ in range(random.randint(1, 500))]
+    if random.random() < 0.1:
+        for c in coalitions:
+            c['energy_impact_per_s'] = 0
+    total = random.randint(0, 2_000_000)
+
+    shares = attribution.attribute(coalitions, total, use_numpy=False)
+    key = 'energy_impact_per_s' if any(round(c['energy_impact_per_s'] * attribution.WEIGHT_SCALE) for c in coalitions) \
+        else 'cputime_ms_per_s'
+    weight_sum = sum(round(c[key] * attribution.WEIGHT_SCALE) for c in coalitions)
+    if weight_sum and sum(shares) != total or min(shares) < 0:
+        fail(f"Shares of {total} add up to {sum(shares)}")
+    if weight_sum and any(abs(s - total * round(c[key] * attribution.WEIGHT_SCALE) / weight_sum) >= 1
+                          for s, c in zip(shares, coalitions)):
+        fail('A share is more than 1 mJ off its proportion')
+    if attribution.np is not None and attribution.attribute(coalitions, total) != shares:
+        fail('NumPy and the fallback disagree')
+
+# An energy impact that rounds to 0 for every coalition splits by cpu time
+for use_numpy in ([False, True] if attribution.np is not None else [False]):
+    shares = attribution.attribute_columns(array.array('d', [1e-9, 1e-9]), array.array('d', [100, 300]), 1000, use_numpy)
+    if shares != [250, 750]:
+        fail(f"Energy impacts that round to 0 were split as {shares} and not by cpu time")
+
+with open(plistfile, 'rb') as f:
+    coalitions = plistlib.loads(f.read().split(b'</plist>')[0] + b'</plist>')['coalitions']
+for use_numpy in ([False, True] if attribution.np is not None else [False]):
+    start = time.perf_counter()
+    for _ in range(1_000):
+        attribution.attribute(coalitions, 123_456, use_numpy)
+    print(f"{'numpy' if use_numpy else 'array'}: {(time.perf_counter() - start) * 1_000:.1f} µs per sample "
+          f"with {len(coalitions)} coalitions")
+print('[PASS] Shares add up exactly!')
+
+
+def run(db_file, window_ms):
+    power_logger.conn = sqlite3.connect(db_file)
+    power_logger.c = power_logger.conn.cursor()
+    power_logger.migrate_db(power_logger.conn, db_file)
+    power_logger.global_settings = {**power_logger.get_settings(test=True), 'storage_window': window_ms}
+    power_logger.storage_window = power_logger.StorageWindow(window_ms)
+    power_logger.sink = power_logger.SqliteSink()
+
+    buffer = []
+    with open(plistfile, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip().replace('&', '&amp;')
+            buffer.append(line)
+            if line == '</plist>':
+                power_logger.parse_powermetrics_output(''.join(buffer))
+                buffer.clear()
+    power_logger.flush_storage_window()
+
+    rows = power_logger.conn.execute('''
+        SELECT m.time, m.combined_energy, m.unattributed_energy, SUM(p.combined_energy)
+        FROM power_measurements m JOIN process_measurements p ON p.time = m.time
+        GROUP BY m.time''').fetchall()
+    power_logger.conn.close()
+    return rows
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    for window_ms in [0, 3_000]:
+        rows = run(os.path.join(tmp, f"attribution_{window_ms}.db"), window_ms)
+        if not rows or any(combined != unattributed + processes for _, combined, unattributed, processes in rows):
+            fail(f"Stored energy doesn't add up with a {window_ms} ms window: {rows}")
+
+print('[PASS] Process energy and unattributed energy add up to the combined energy!')
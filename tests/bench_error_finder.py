@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+# Builds a capture by repeating the test plist and compares the batch analyzer of metrics_error_finder.py against
+# checking one process at a time like the script used to. The suspicious counts have to be the same.
+# Usage: ./bench_error_finder.py [samples] [jobs]
+
+import os
+import sys
+import time
+import plistlib
+import tempfile
+import collections
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import metrics_error_finder
+
+N_SAMPLES = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+JOBS = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+# The processes in the test plist are all within 5 %, so we use a lower threshold to have something to compare
+THRESHOLD = 1
+plistfile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'powermetrics_test_output.plist')
+
+
+def is_difference_more_than_threshold(x, y):
+    if x == 0 and y == 0:
+        return False
+    if x == 0 or y == 0:
+        return True
+    return abs(x - y) / ((x + y) / 2) * 100 > THRESHOLD
+
+
+def one_at_a_time(filename):
+    # The old way, minus the printing
+    suspicious = collections.Counter()
+    for output in metrics_error_finder.read_outputs(filename):
+        for data in output.encode('utf-8').split(b'\x00'):
+            if not data:
+                continue
+            data = plistlib.loads(data)
+            for process in metrics_error_finder.find_top_processes(data['coalitions']):
+                cpu_ns_clean = ((process['cputime_ms_per_s'] * 1_000_000) / 1_000_000_000) * data['elapsed_ns']
+                ei_clean = process['energy_impact_per_s'] * data['elapsed_ns'] / 1_000_000_000
+                if is_difference_more_than_threshold(process['cputime_ns'], cpu_ns_clean):
+                    suspicious[(process['name'], 'cputime_ns')] += 1
+                if is_difference_more_than_threshold(process['energy_impact'], ei_clean):
+                    suspicious[(process['name'], 'energy_impact')] += 1
+    return suspicious
+
+
+with open(plistfile, 'r', encoding='utf-8') as f:
+    fixture = f.read()
+fixture_samples = fixture.count('</plist>')
+
+with tempfile.TemporaryDirectory() as tmp:
+    capture = os.path.join(tmp, 'capture.plist')
+    with open(capture, 'w', encoding='utf-8') as f:
+        for _ in range(N_SAMPLES // fixture_samples):
+            f.write(fixture)
+            f.write('\n')
+
+    print(f"{N_SAMPLES // fixture_samples * fixture_samples} samples, "
+          f"{'numpy' if metrics_error_finder.np is not None else 'no numpy'}")
+
+    start = time.perf_counter()
+    expected = one_at_a_time(capture)
+    print(f"One at a time : {time.perf_counter() - start:6.2f} s")
+
+    start = time.perf_counter()
+    serial = metrics_error_finder.analyze_files([capture], jobs=1, threshold=THRESHOLD)
+    print(f"Batch, 1 job  : {time.perf_counter() - start:6.2f} s")
+
+    start = time.perf_counter()
+    parallel = metrics_error_finder.analyze_files([capture], jobs=JOBS, threshold=THRESHOLD)
+    print(f"Batch, {JOBS} jobs : {time.perf_counter() - start:6.2f} s")
+
+for summary in [serial, parallel]:
+    got = {k: v[1] for k, v in summary.items() if v[1]}
+    if not expected or got != dict(expected):
+        print(f"[ERROR] Suspicious counts don't match! {got} != {dict(expected)}")
+        raise SystemExit(1)
+
+print('[PASS] Suspicious counts match!')
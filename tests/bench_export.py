@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+# Measures how fast `power_logger.py export` streams the measurements table with its payloads decoded, as NDJSON and
+# CSV and with different numbers of jobs, and how much memory it needs. For comparison it also loads everything with
+# fetchall and decodes it in memory, which is what you would do by hand.
+# Every run is its own process so the peak RSS is only that of the run (and its pool).
+# Usage: ./bench_export.py [rows]
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import resource
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+from libs import export
+
+N_ROWS = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1] != '--run' else 100_000
+RUNS = [('fetchall', 'ndjson', 1), ('export', 'ndjson', 1), ('export', 'csv', 1), ('export', 'ndjson', 2),
+        ('export', 'ndjson', 4)]
+
+
+def fill_db(db_file):
+    power_logger.machine_uuid = 'bench'
+    power_logger.global_settings = power_logger.get_settings(test=True)
+    conn = sqlite3.connect(db_file)
+    power_logger.migrate_db(conn, db_file)
+    start = int(time.time() * 1_000) - N_ROWS * 5_000
+    batch = []
+    for i in range(N_ROWS):
+        row = (i, start + i * 5_000, random.randint(0, 5_000), random.randint(0, 5_000), 0, 0, random.randint(0, 500),
+               None, 5_000_000_000, 'Nominal', None, 'MacBookPro18,3')
+        top_processes = [{'name': f"app{n}", 'energy_impact': random.randint(0, 100), 'cputime_ms': random.random()}
+                         for n in random.sample(range(200), 15)]
+        batch.append((row[1], power_logger.encode_upload_data(power_logger.build_upload_data(row, top_processes))))
+        if len(batch) == 10_000:
+            conn.executemany('INSERT INTO measurements (time, data, uploaded) VALUES (?, ?, 0)', batch)
+            batch.clear()
+    conn.executemany('INSERT INTO measurements (time, data, uploaded) VALUES (?, ?, 0)', batch)
+    conn.commit()
+    conn.close()
+
+
+def run(mode, fmt, jobs, db_file, out_file):
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    start = time.perf_counter()
+    with open(out_file, 'w', encoding='utf-8', newline='') as out:
+        if mode == 'fetchall':
+            rows = conn.execute('SELECT * FROM measurements').fetchall()
+            decoded = [{'id': r[0], 'time': r[1], 'data': export.decode_payload(r[2]), 'uploaded': r[3]} for r in rows]
+            out.write(''.join(json.dumps(d) + '\n' for d in decoded))
+            n_rows = len(rows)
+        else:
+            n_rows = export.export(conn.cursor(), out, 'measurements', fmt=fmt, jobs=jobs)
+    duration = time.perf_counter() - start
+    conn.close()
+
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1_024
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+    print(json.dumps({'rows': n_rows, 'seconds': duration, 'peak_rss': peak, 'bytes': os.path.getsize(out_file)}))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run']:
+        run(sys.argv[2], sys.argv[3], int(sys.argv[4]), sys.argv[5], sys.argv[6])
+        raise SystemExit(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, 'export.db')
+        fill_db(db_file)
+        print(f"{N_ROWS} measurements rows, {os.path.getsize(db_file) / 1024 / 1024:.0f} MB DB")
+
+        for mode, fmt, jobs in RUNS:
+            out_file = os.path.join(tmp, f"out.{fmt}")
+            result = json.loads(subprocess.run([sys.executable, __file__, '--run', mode, fmt, str(jobs), db_file,
+                                                out_file], check=True, capture_output=True, text=True).stdout)
+            print(f"{mode:8} {fmt:6} jobs {jobs}: {result['rows'] / result['seconds']:8.0f} rows/s, "
+                  f"{result['bytes'] / result['seconds'] / 1024 / 1024:5.1f} MB/s out, "
+                  f"peak RSS {result['peak_rss'] / 1024 / 1024:6.1f} MB")
+            os.remove(out_file)
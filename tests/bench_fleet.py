@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+# Simulates a fleet of machines that all upload their backlog to one endpoint at the same time, like after an outage
+# of the server or when everybody opens their laptop in the morning. Every client is its own process with its own DB
+# running upload_data_to_endpoint from power_logger.py with upload_concurrency threads. They upload to the stand-in
+# from ingest_standin.py, which can be slowed down or made to fail.
+#
+# Prints the throughput, the latency of the requests as the clients see it and as the server sees it, and how long the
+# clients needed to drain their backlog. Fails if a row didn't arrive exactly once.
+# Usage: ./bench_fleet.py [--clients 20] [--backlog-hours 2] [--batch-size 10] [--latency 20] [--outage 10]
+
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import threading
+import statistics
+import urllib.request
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+from ingest_standin import IngestStandIn
+
+PROCESS_NAMES = 50
+TOP_PROCESSES = 15
+
+
+def fill_db(db_file, samples, interval):
+    conn = sqlite3.connect(db_file)
+    power_logger.migrate_db(conn, db_file)
+    conn.executemany('INSERT INTO process_names (id, name) VALUES (?, ?)',
+                     [(i, f"app{i}") for i in range(PROCESS_NAMES)])
+    start = int(time.time() * 1_000) - samples * interval * 1_000
+    for i in range(samples):
+        timestamp = start + i * interval * 1_000
+        conn.execute('''INSERT INTO power_measurements (time, combined_energy, cpu_energy, gpu_energy, ane_energy,
+                        energy_impact, co2eq, elapsed_ns, thermal_pressure, grid_intensity, hw_model)
+                        VALUES (?, ?, ?, 0, 0, ?, NULL, ?, 'Nominal', NULL, 'MacBookPro18,3')''',
+                     (timestamp, random.randint(0, 5000), random.randint(0, 5000), random.randint(0, 500),
+                      interval * 1_000_000_000))
+        conn.executemany('INSERT INTO process_measurements (time, name_id, energy_impact, cputime_per) VALUES (?, ?, ?, ?)',
+                         [(timestamp, n, random.randint(0, 100), random.random() * 100)
+                          for n in random.sample(range(PROCESS_NAMES), TOP_PROCESSES)])
+    conn.commit()
+    max_id = conn.execute('SELECT MAX(id) FROM power_measurements').fetchone()[0]
+    conn.close()
+    return max_id
+
+
+def run_client(index, db_file, max_id, url, args, go, results):
+    latencies = []
+    urlopen = urllib.request.urlopen
+
+    # Only measures the requests upload_data_to_endpoint makes, what it does with them stays the same
+    def timed_urlopen(*a, **kw):
+        start = time.perf_counter()
+        try:
+            return urlopen(*a, **kw)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    urllib.request.urlopen = timed_urlopen
+
+    power_logger.DATABASE_FILE = db_file
+    power_logger.machine_uuid = f"fleet-{index}"
+    power_logger.UPLOAD_BATCH_SIZE = args.batch_size
+    power_logger.global_settings = {
+        **power_logger.get_settings(test=True),
+        'api_url': url,
+        'upload_delta': args.upload_delta,
+    }
+    power_logger.conn = sqlite3.connect(db_file)
+    power_logger.c = power_logger.conn.cursor()
+    power_logger.reset_upload_leases()
+
+    go.wait()
+    start = time.perf_counter()
+    stop = threading.Event()
+    threads = [threading.Thread(target=power_logger.upload_data_to_endpoint, args=(stop,))
+               for _ in range(args.concurrency)]
+    for t in threads:
+        t.start()
+
+    drained = None
+    while time.perf_counter() - start < args.timeout:
+        if power_logger.c.execute('SELECT last_id FROM upload_status').fetchone()[0] >= max_id:
+            drained = time.perf_counter() - start
+            break
+        time.sleep(0.05)
+
+    stop.set()
+    for t in threads:
+        t.join()
+    power_logger.conn.close()
+    results.put((index, drained, latencies))
+
+
+def percentiles(values):
+    if len(values) < 2:
+        return 'n/a'
+    q = statistics.quantiles(values, n=100, method='inclusive')
+    return f"p50 {q[49] * 1_000:.0f} ms, p95 {q[94] * 1_000:.0f} ms, p99 {q[98] * 1_000:.0f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fleet upload load generator')
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--backlog-hours', type=float, default=2, help='Backlog of every client')
+    parser.add_argument('--interval', type=int, default=5, help='Seconds between the samples of the backlog')
+    parser.add_argument('--concurrency', type=int, default=2, help='upload_concurrency of every client')
+    parser.add_argument('--batch-size', type=int, default=power_logger.UPLOAD_BATCH_SIZE, help='Rows per request')
+    parser.add_argument('--upload-delta', type=int, default=5, help='upload_delta of every client, caps the backoff')
+    parser.add_argument('--latency', type=float, default=20, help='ms the server waits before answering')
+    parser.add_argument('--jitter', type=float, default=0, help='Up to this many ms are added to the latency')
+    parser.add_argument('--error-rate', type=float, default=0, help='Share of the requests that get a 503')
+    parser.add_argument('--outage', type=float, default=0, help='The server fails everything for this many seconds')
+    parser.add_argument('--timeout', type=float, default=600, help='Give up on a client after this many seconds')
+    args = parser.parse_args()
+
+    samples = int(args.backlog_hours * 3_600 / args.interval)
+    # Fork so the clients don't have to import everything again
+    ctx = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        template = os.path.join(tmp, 'template.db')
+        max_id = fill_db(template, samples, args.interval)
+
+        standin = IngestStandIn(os.path.join(tmp, 'ingest.db'), latency=args.latency / 1_000,
+                                jitter=args.jitter / 1_000, error_rate=args.error_rate, outage=0)
+
+        go = ctx.Event()
+        results = ctx.Queue()
+        clients = []
+        for i in range(args.clients):
+            db_file = os.path.join(tmp, f"client_{i}.db")
+            shutil.copy(template, db_file)
+            client = ctx.Process(target=run_client, args=(i, db_file, max_id, standin.url, args, go, results))
+            client.start()
+            clients.append(client)
+
+        print(f"{args.clients} clients with {samples} samples each, batches of {args.batch_size} rows, "
+              f"{args.concurrency} threads per client, {args.latency:.0f} ms latency, "
+              f"{args.error_rate:.0%} errors, {args.outage:.0f} s outage")
+
+        standin.outage_until = time.time() + args.outage
+        standin.start()
+        start = time.perf_counter()
+        go.set()
+
+        drained = {}
+        latencies = []
+        for _ in clients:
+            index, drain_time, client_latencies = results.get()
+            drained[index] = drain_time
+            latencies.extend(client_latencies)
+        duration = time.perf_counter() - start
+        for client in clients:
+            client.join()
+        standin.close()
+
+        check = sqlite3.connect(os.path.join(tmp, 'ingest.db'))
+        rows, unique = check.execute('SELECT COUNT(*), COUNT(DISTINCT machine_uuid || time) FROM measurements').fetchone()
+        check.close()
+
+    counters = {**standin.counters, **standin.writer.counters}
+    drain_times = [d for d in drained.values() if d is not None]
+    print(f"Took {duration:.1f} s, {rows / duration:.0f} rows/s, {counters['requests'] / duration:.0f} requests/s")
+    print(f"Requests: {counters['received']} received, {counters['requests']} stored in "
+          f"{counters['transactions']} transactions, {counters['errors_injected']} failed on purpose, "
+          f"{counters['invalid']} invalid, {counters['duplicates']} duplicates")
+    print(f"Client latency: {percentiles(latencies)}")
+    print(f"Server latency: {percentiles(standin.durations)}")
+    if drain_times:
+        print(f"Drain time: p50 {statistics.median(drain_times):.1f} s, max {max(drain_times):.1f} s")
+
+    expected = args.clients * samples
+    if len(drain_times) != args.clients or rows != expected or unique != expected or counters['invalid']:
+        print(f"[ERROR] {len(drain_times)} of {args.clients} clients drained, {unique} of {expected} rows "
+              f"arrived, {rows - unique} duplicates, {counters['invalid']} invalid requests")
+        raise SystemExit(1)
+    print('[PASS] All rows of all clients arrived exactly once!')
+
+
+if __name__ == '__main__':
+    main()
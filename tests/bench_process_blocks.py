@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+# Compares how the top processes of a synthetic week of 5 s samples can be stored: the size of the DB, how long
+# writing the samples takes and the queries the app, the reports and the upload run.
+#   rows          one process_measurements row per process, what the logger writes
+#   blocks        one JSON block per sample for everything, read through a view that decodes them
+#   hourly tier   the rows of the last day, everything before downsampled to hourly blocks by the size budget
+# Usage: ./bench_process_blocks.py [days]
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+
+DAYS = int(sys.argv[1]) if len(sys.argv) > 1 else 7
+INTERVAL_MS = 5_000
+TOP_N = 15
+HOUR_MS = 60 * 60 * 1_000
+DAY_MS = 24 * HOUR_MS
+
+random.seed(1)
+END = int(time.time() * 1_000) // DAY_MS * DAY_MS
+START = END - DAYS * DAY_MS
+
+def samples():
+    for sample in range(DAYS * DAY_MS // INTERVAL_MS):
+        yield START + sample * INTERVAL_MS, [(name_id, random.randint(0, 500), round(random.random() * 1_000, 3),
+                                             random.randint(0, 20_000))
+                                            for name_id in random.sample(range(1, 201), TOP_N)]
+
+def encode_block(processes):
+    return json.dumps([[name_id, energy_impact, round(cputime_ms * 1_000), energy]
+                       for name_id, energy_impact, cputime_ms, energy in processes], separators=(',', ':'))
+
+def create_db(conn, db_file, layout):
+    power_logger.migrate_db(conn, db_file)
+    conn.executemany('INSERT INTO process_names (id, name) VALUES (?, ?)',
+                     [(i, f"com.example.app{i}") for i in range(1, 201)])
+    if layout == 'blocks':
+        conn.executescript('''
+            DROP VIEW top_processes;
+            DROP VIEW process_history;
+            DROP TABLE process_measurements;
+            CREATE VIEW process_measurements AS
+                SELECT b.time, json_extract(p.value, '$[0]') AS name_id, json_extract(p.value, '$[1]') AS energy_impact,
+                    json_extract(p.value, '$[2]') / 1000.0 AS cputime_per, json_extract(p.value, '$[3]') AS combined_energy
+                FROM process_blocks b, json_each(b.processes) p;
+            CREATE VIEW top_processes AS
+                SELECT p.time, n.name, p.energy_impact, p.cputime_per, p.combined_energy
+                FROM process_measurements p JOIN process_names n ON n.id = p.name_id;''')
+
+def time_query(conn, query, params=()):
+    start = time.perf_counter()
+    conn.execute(query, params).fetchall()
+    return time.perf_counter() - start
+
+QUERIES = {
+    # What the app shows for all time and for the last hour
+    'all time by name': ('''SELECT name, SUM(energy_impact), SUM(combined_energy) FROM top_processes
+                            GROUP BY name ORDER BY SUM(energy_impact) DESC LIMIT 50''', ()),
+    'last hour by name': ('''SELECT name, SUM(energy_impact), SUM(combined_energy) FROM top_processes
+                             WHERE time >= ? GROUP BY name ORDER BY SUM(energy_impact) DESC LIMIT 50''',
+                          (END - HOUR_MS,)),
+    # What get_upload_rows reads for a batch of 10 samples
+    'upload batch': ('''SELECT p.time, n.name, p.energy_impact, p.cputime_per, p.combined_energy
+                        FROM process_measurements p JOIN process_names n ON n.id = p.name_id
+                        WHERE p.time >= ? AND p.time < ? ORDER BY p.time''',
+                     (END - HOUR_MS, END - HOUR_MS + 10 * INTERVAL_MS)),
+}
+
+LAYOUTS = ['rows', 'blocks', 'hourly tier']
+results = {}
+with tempfile.TemporaryDirectory() as tmp:
+    for layout in LAYOUTS:
+        db_file = os.path.join(tmp, f"{layout}.db")
+        conn = sqlite3.connect(db_file)
+        create_db(conn, db_file, layout)
+
+        # Every sample in its own transaction like the logger does
+        start = time.perf_counter()
+        for timestamp, processes in samples():
+            if layout == 'blocks':
+                conn.execute('INSERT INTO process_blocks (time, processes) VALUES (?, ?)',
+                             (timestamp, encode_block(processes)))
+            else:
+                conn.executemany('''INSERT INTO process_measurements (time, name_id, energy_impact, cputime_per,
+                                    combined_energy) VALUES (?, ?, ?, ?, ?)''',
+                                 [(timestamp, *process) for process in processes])
+            conn.commit()
+        insert_time = time.perf_counter() - start
+
+        if layout == 'hourly tier':
+            power_logger.aggregate_range(conn.cursor(), START, END - DAY_MS, HOUR_MS)
+            conn.commit()
+        conn.execute('VACUUM')
+
+        results[layout] = {
+            'rows': conn.execute('SELECT COUNT(*) FROM top_processes').fetchone()[0],
+            'size': os.path.getsize(db_file),
+            'insert': insert_time,
+            **{name: time_query(conn, query, params) for name, (query, params) in QUERIES.items()},
+        }
+        conn.close()
+
+print(f"{'':20}" + ' '.join(f"{layout:>12}" for layout in LAYOUTS))
+print(f"{'Rows':18}: " + ' '.join(f"{results[layout]['rows']:>12}" for layout in LAYOUTS))
+print(f"{'DB size':18}: " + ' '.join(f"{results[layout]['size'] / 1e6:>9.1f} MB" for layout in LAYOUTS))
+print(f"{'Writing':18}: " + ' '.join(f"{results[layout]['insert']:>10.2f} s" for layout in LAYOUTS))
+for name in QUERIES:
+    print(f"{name:18}: " + ' '.join(f"{results[layout][name] * 1_000:>9.1f} ms" for layout in LAYOUTS))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+# Compares the old top_processes table that stored the full name on every row with the normalized
+# process_names/ process_measurements tables on a synthetic month of 5 s samples.
+# Usage: ./bench_process_names.py [days]
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+import importlib.util
+
+MIGRATION = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'migrations',
+                         '20261019100000_process_names.py')
+
+DAYS = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+INTERVAL_MS = 5_000
+TOP_N = 15
+
+spec = importlib.util.spec_from_file_location('process_names', MIGRATION)
+migration = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(migration)
+
+random.seed(1)
+names = [f"com.example.app{i}" for i in range(150)] + \
+        [f"/opt/homebrew/bin/python3 /Users/someone/projects/pipeline_{i}/run.py --config settings.yml --workers 8"
+         for i in range(50)]
+
+def rows():
+    start = int(time.time() * 1_000) - DAYS * 24 * 60 * 60 * 1_000
+    for sample in range(DAYS * 24 * 60 * 60 * 1_000 // INTERVAL_MS):
+        for name in random.sample(names, TOP_N):
+            yield (start + sample * INTERVAL_MS, name, random.randint(0, 500), random.random() * 1_000)
+
+def time_query(conn, query):
+    start = time.perf_counter()
+    conn.execute(query).fetchall()
+    return time.perf_counter() - start
+
+with tempfile.TemporaryDirectory() as tmp:
+    db_file = os.path.join(tmp, 'db.db')
+    conn = sqlite3.connect(db_file)
+    conn.execute('CREATE TABLE top_processes (time INT, name STRING, energy_impact INT, cputime_per INT)')
+    conn.executemany('INSERT INTO top_processes VALUES (?, ?, ?, ?)', rows())
+    conn.commit()
+    conn.execute('VACUUM')
+
+    n_rows = conn.execute('SELECT COUNT(*) FROM top_processes').fetchone()[0]
+    size_before = os.path.getsize(db_file)
+    old_group_by = time_query(conn, '''SELECT name, SUM(energy_impact), AVG(cputime_per) FROM top_processes
+                                       GROUP BY name ORDER BY SUM(energy_impact) DESC LIMIT 50''')
+
+    start = time.perf_counter()
+    migration.upgrade(conn)
+    migration_time = time.perf_counter() - start
+    conn.execute('VACUUM')
+
+    size_after = os.path.getsize(db_file)
+    new_group_by = time_query(conn, '''SELECT n.name, t.total, t.avg_cpu FROM
+                                       (SELECT name_id, SUM(energy_impact) AS total, AVG(cputime_per) AS avg_cpu
+                                        FROM process_measurements GROUP BY name_id ORDER BY total DESC LIMIT 50) t
+                                       JOIN process_names n ON n.id = t.name_id''')
+    view_group_by = time_query(conn, '''SELECT name, SUM(energy_impact), AVG(cputime_per) FROM top_processes
+                                        GROUP BY name ORDER BY SUM(energy_impact) DESC LIMIT 50''')
+    conn.close()
+
+print(f"Rows                 : {n_rows} ({DAYS} days)")
+print(f"Migration            : {migration_time:.2f} s")
+print(f"DB size              : {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB "
+      f"({(1 - size_after / size_before) * 100:.0f}% smaller)")
+print(f"GROUP BY name        : {old_group_by:.2f} s")
+print(f"GROUP BY name_id     : {new_group_by:.2f} s ({old_group_by / new_group_by:.1f}x)")
+print(f"GROUP BY on the view : {view_group_by:.2f} s")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# Builds a DB with a synthetic year of 5 s samples and compares the report against the plain Python loop over the
+# rows we used to write for these questions. Also checks that all ways give the same tables.
+# Usage: ./bench_report.py [days] [processes_per_sample]
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+from libs import caribou, report
+
+DAYS = int(sys.argv[1]) if len(sys.argv) > 1 else 365
+PROCESSES_PER_SAMPLE = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+INTERVAL_MS = 5_000
+N_APPS = 40
+# Like on a real machine a few apps show up in almost every sample
+APP_WEIGHTS = [1 / (i + 1) for i in range(N_APPS)]
+
+
+def fill_db(db_file):
+    caribou.upgrade(db_file, power_logger.MIGRATIONS_PATH)
+    conn = sqlite3.connect(db_file)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.executemany('INSERT INTO process_names (id, name) VALUES (?, ?)', [(i, f"app{i}") for i in range(N_APPS)])
+
+    start = int(time.time() * 1_000) - DAYS * report.DAY_MS
+    times = range(start, start + DAYS * report.DAY_MS, INTERVAL_MS)
+    conn.executemany('''INSERT INTO power_measurements (time, combined_energy, cpu_energy, gpu_energy, ane_energy,
+                        energy_impact, elapsed_ns) VALUES (?, ?, 0, 0, 0, 0, 5000000000)''',
+                     ((t, random.randint(0, 50_000)) for t in times))
+    conn.executemany('INSERT INTO process_measurements (time, name_id, energy_impact, cputime_per) VALUES (?, ?, ?, 0)',
+                     ((t, name_id, random.randint(0, 1_000))
+                      for t in times for name_id in random.choices(range(N_APPS), APP_WEIGHTS, k=PROCESSES_PER_SAMPLE)))
+    conn.commit()
+    conn.close()
+    return len(times)
+
+
+def python_loop(cursor, work_hours=(9, 17)):
+    # What the ad-hoc scripts did: one tuple and one datetime per row
+    result = report.Report(work_hours, use_numpy=False)
+    for t, energy, elapsed in cursor.execute('SELECT time, combined_energy, elapsed_ns FROM power_measurements'):
+        local = datetime.datetime.fromtimestamp(t / 1_000)
+        result.hourly_energy[local.hour] += energy
+        result.hourly_elapsed_ns[local.hour] += elapsed
+        if local.weekday() < 5 and work_hours[0] <= local.hour < work_hours[1]:
+            result.work_energy += energy
+        result.total_energy += energy
+
+    day_ordinal = datetime.date(1970, 1, 1).toordinal()
+    for t, name_id, value in cursor.execute('SELECT time, name_id, energy_impact FROM process_measurements'):
+        day = datetime.datetime.fromtimestamp(t / 1_000).toordinal() - day_ordinal
+        key = day << 32 | name_id
+        result.app_day[key] = result.app_day.get(key, 0) + value
+
+    result.names = dict(cursor.execute('SELECT id, name FROM process_names').fetchall())
+    return result
+
+
+def timed(name, function):
+    start = time.perf_counter()
+    start_cpu = time.process_time()
+    result = function()
+    print(f"{name:12}: {time.perf_counter() - start:6.2f} s wall, {time.process_time() - start_cpu:6.2f} s cpu")
+    return result.tables()
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    db = os.path.join(tmp, 'year.db')
+    start_fill = time.perf_counter()
+    n_samples = fill_db(db)
+    print(f"{DAYS} days, {n_samples} samples, {n_samples * PROCESSES_PER_SAMPLE} process rows, "
+          f"{os.path.getsize(db) / 1_000_000:.0f} MB, filled in {time.perf_counter() - start_fill:.0f} s")
+
+    c = sqlite3.connect(db).cursor()
+    expected = timed('python loop', lambda: python_loop(c))
+    got = {'array': timed('array', lambda: report.Report(use_numpy=False).read(c))}
+    if report.np is not None:
+        got['numpy'] = timed('numpy', lambda: report.Report().read(c))
+    else:
+        print('numpy       : not installed')
+
+for backend, tables in got.items():
+    if tables != expected:
+        print(f"[ERROR] The {backend} report doesn't match the Python loop!")
+        raise SystemExit(1)
+
+print('[PASS] All reports match!')
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+# Compares the old resolve_names, that stripped and lower cased every name and looked it up in the settings lists,
+# with the compiled rules on a synthetic sample of 1000 coalitions with 5 tasks each. Runs with the default settings
+# and with 40 exact rules, and shows what the same 40 rules cost as prefixes, globs and regexes.
+# Usage: ./bench_resolve_names.py [samples]
+
+import os
+import sys
+import copy
+import time
+import random
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+from libs.sample import Sample
+
+SAMPLES = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+COALITIONS = 1_000
+TASKS = 5
+
+random.seed(5)
+names = [f"com.vendor{i % 40}.App{i}" for i in range(COALITIONS)]
+sample = {'timestamp': datetime.datetime.now(), 'elapsed_ns': 5_000_000_000, 'processor': {}, 'all_tasks': {},
+          'coalitions': [{'id': i, 'name': name, 'tasks': [{'pid': i * TASKS + t, 'name': f"Helper{t} ({name})"}
+                                                           for t in range(TASKS)]}
+                          for i, name in enumerate(names)]}
+EXACT = [name for name in random.sample(names, 40)]
+
+
+def old_resolve_names(data):
+    settings = power_logger.global_settings
+    updated_coalitions = []
+
+    for coalition in data['coalitions']:
+        name = coalition['name'].strip().lower()
+        if name in settings['resolve_coalitions'] or not name:
+            tasks = coalition.get('tasks', [])
+            updated_coalitions.extend(tasks if isinstance(tasks, list) else [coalition])
+        else:
+            updated_coalitions.append(coalition)
+
+    for i, coalition in enumerate(updated_coalitions):
+        if coalition['name'].lower().strip() in settings['resolve_process']:
+            if cmd := power_logger.cmdline_cache.get(coalition['pid'], coalition['name']):
+                updated_coalitions[i]['name'] = cmd
+
+    power_logger.cmdline_cache.end_sample()
+    data['coalitions'] = updated_coalitions
+    return data
+
+
+def run(function, resolve_coalitions, resolve_process):
+    settings = power_logger.get_settings(test=True)
+    settings['resolve_coalitions'] = resolve_coalitions
+    settings['resolve_process'] = resolve_process
+    power_logger.global_settings = settings
+    power_logger.name_rules = None
+
+    # The copies are made up front so we only time the resolving. resolve_names works on the sample model and doesn't
+    # change it.
+    if function is old_resolve_names:
+        samples = [copy.deepcopy(sample) for _ in range(SAMPLES)]
+    else:
+        samples = [Sample.from_plist(sample)] * SAMPLES
+    start = time.perf_counter()
+    for data in samples:
+        resolved = function(data)
+    duration = time.perf_counter() - start
+    return duration / SAMPLES * 1_000_000, len(resolved['coalitions'] if isinstance(resolved, dict) else resolved)
+
+
+default = power_logger.get_settings(test=True)
+default_coalitions = [x.strip().lower() for x in default['resolve_coalitions'].split(',')]
+
+configs = [
+    ('default settings', default_coalitions, default['resolve_process']),
+    ('40 exact rules', [n.lower() for n in EXACT], ['helper1 (' + n.lower() + ')' for n in EXACT[:10]]),
+]
+for label, resolve_coalitions, resolve_process in configs:
+    old, old_count = run(old_resolve_names, resolve_coalitions, resolve_process)
+    new, new_count = run(power_logger.resolve_names, resolve_coalitions, resolve_process)
+    if old_count != new_count:
+        raise SystemExit(f"The old and new resolve_names resolved to {old_count} and {new_count} coalitions")
+    print(f"{label:18}: {old:7.1f} µs -> {new:7.1f} µs per sample ({old / new:.1f}x), {new_count} coalitions")
+
+expressive = [
+    ('40 prefix rules', [n.lower().rsplit('.', 1)[0] + '.*' for n in EXACT]),
+    ('40 glob rules', ['*' + n.lower()[3:] for n in EXACT]),
+    ('40 regex rules', ['re:^' + n.replace('.', '\\.') + '$' for n in EXACT]),
+]
+for label, resolve_coalitions in expressive:
+    new, new_count = run(power_logger.resolve_names, resolve_coalitions, [])
+    print(f"{label:18}: {new:7.1f} µs per sample, {new_count} coalitions")
+
+print(f"Counters of the last run: cache {power_logger.name_rules.counters['cache_hits']} hits, "
+      f"{power_logger.name_rules.counters['cache_misses']} misses")
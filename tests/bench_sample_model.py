@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# Measures what a parsed sample of the test plist costs in memory and how long it takes from the plist text to the
+# rows in the DB. The size is the deep size of one sample and what a full sample queue (queue_size samples) holds
+# according to tracemalloc, as the names are shared between the queued samples.
+# Usage: ./bench_sample_model.py [rounds]
+
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+
+ROUNDS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'powermetrics_test_output.plist'),
+          'r', encoding='utf-8') as f:
+    plists = [p for p in f.read().replace('&', '&amp;').split('\x00') if p.strip()]
+
+
+def deep_size(obj, seen):
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(deep_size(v, seen) for v in obj)
+    elif hasattr(obj, '__slots__'):
+        size += sum(deep_size(getattr(obj, slot), seen) for slot in obj.__slots__ if hasattr(obj, slot))
+    return size
+
+
+power_logger.global_settings = power_logger.get_settings(test=True)
+queue_size = power_logger.global_settings['queue_size']
+
+samples = [s for p in plists for s in power_logger.parse_plist(p)]
+sample_bytes = sum(deep_size(s, set()) for s in samples) / len(samples)
+
+tracemalloc.start()
+before = tracemalloc.get_traced_memory()[0]
+queued = [power_logger.parse_plist(plists[i % len(plists)])[0] for i in range(queue_size)]
+queue_bytes = tracemalloc.get_traced_memory()[0] - before
+tracemalloc.stop()
+del queued
+
+with tempfile.TemporaryDirectory() as tmp:
+    db_file = os.path.join(tmp, 'bench.db')
+    power_logger.conn = sqlite3.connect(db_file)
+    power_logger.c = power_logger.conn.cursor()
+    power_logger.migrate_db(power_logger.conn, db_file)
+    power_logger.storage_window = power_logger.StorageWindow(0)
+    power_logger.sink = power_logger.SqliteSink()
+    # The embodied carbon asks system_profiler for the model every sample, that is not what we want to measure
+    power_logger.embodied_co2eq_g = lambda _: 0
+
+    parse_time = process_time = 0
+    for _ in range(ROUNDS):
+        for p in plists:
+            start = time.perf_counter()
+            parsed = power_logger.parse_plist(p)
+            parse_time += time.perf_counter() - start
+            start = time.perf_counter()
+            for sample in parsed:
+                power_logger.process_sample(sample)
+            process_time += time.perf_counter() - start
+    power_logger.conn.close()
+
+n = ROUNDS * len(plists)
+print(f"Bytes per sample      : {sample_bytes / 1024:.1f} KB")
+print(f"Queue of {queue_size} samples   : {queue_bytes / 1024 / 1024:.2f} MB")
+print(f"Parse                 : {parse_time / n * 1_000:.2f} ms per sample")
+print(f"Process and store     : {process_time / n * 1_000:.2f} ms per sample")
+print(f"Parse to store        : {(parse_time + process_time) / n * 1_000:.2f} ms per sample")
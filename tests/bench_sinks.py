@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+# Compares the per write latency and the CPU time of the sqlite and the segment sink for a synthetic source at
+# different sample rates. Also checks that the segment sink gets every record into the DB and that a torn record at the
+# end of a segment is recovered.
+# Usage: ./bench_sinks.py [seconds_per_rate]
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+from libs import caribou
+from libs.segment_log import SegmentLog, read_records
+
+DURATION = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+RATES = [10, 50, 100]
+PROCESS_NAMES = [f"app{i}" for i in range(100)]
+
+
+def synthetic_sample(timestamp):
+    record = {
+        'time': timestamp,
+        'combined_energy': random.randint(0, 5000),
+        'cpu_energy': random.randint(0, 5000),
+        'gpu_energy': random.randint(0, 500),
+        'ane_energy': 0,
+        'energy_impact': random.randint(0, 500),
+        'co2eq': random.random(),
+        'elapsed_ns': 1_000_000_000,
+        'thermal_pressure': 'Nominal',
+        'grid_intensity': 300,
+        'hw_model': 'MacBookPro18,3',
+    }
+    top_processes = [{'name': n, 'energy_impact': random.randint(0, 100), 'cputime_ms': random.random() * 100}
+                     for n in random.sample(PROCESS_NAMES, 15)]
+    return record, top_processes
+
+
+def run(tmp, sink_name, rate):
+    db_file = os.path.join(tmp, f"{sink_name}_{rate}.db")
+    caribou.upgrade(db_file, power_logger.MIGRATIONS_PATH)
+    power_logger.DATABASE_FILE = db_file
+    power_logger.conn = sqlite3.connect(db_file, check_same_thread=False)
+    power_logger.c = power_logger.conn.cursor()
+    power_logger.process_name_ids.clear()
+    power_logger.global_settings = {**power_logger.get_settings(test=True), 'sink': sink_name}
+    sink = power_logger.create_sink()
+
+    n_samples = int(rate * DURATION)
+    latencies = []
+    start_cpu = time.process_time()
+    next_sample = time.perf_counter()
+    for i in range(n_samples):
+        sample = synthetic_sample(1_000_000 + i)
+        write_start = time.perf_counter()
+        sink.write(*sample)
+        latencies.append(time.perf_counter() - write_start)
+        next_sample += 1 / rate
+        time.sleep(max(0, next_sample - time.perf_counter()))
+    sink.close()
+    cpu = time.process_time() - start_cpu
+
+    rows = power_logger.conn.execute('SELECT COUNT(*) FROM power_measurements').fetchone()[0]
+    process_rows = power_logger.conn.execute('SELECT COUNT(*) FROM process_measurements').fetchone()[0]
+    power_logger.conn.close()
+
+    if rows != n_samples or process_rows != n_samples * 15:
+        print(f"[ERROR] The {sink_name} sink wrote {rows} of {n_samples} samples and {process_rows} process rows")
+        raise SystemExit(1)
+
+    latencies.sort()
+    print(f"{sink_name:8} {rate:4}/s: median {statistics.median(latencies) * 1_000_000:7.0f} us, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1_000_000:7.0f} us, "
+          f"cpu {cpu / DURATION * 100:5.1f} %")
+
+
+def check_torn_tail(tmp):
+    directory = os.path.join(tmp, 'torn')
+    log = SegmentLog(directory)
+    for i in range(10):
+        log.append(f"record {i}".encode())
+    log.sync()
+    path = log.path(0)
+
+    # Simulates a crash in the middle of a write
+    with open(path, 'ab') as f:
+        f.write(b'\x20\x00\x00\x00\x01\x02\x03\x04half a rec')
+
+    log = SegmentLog(directory)
+    log.append(b'after the crash')
+    log.close()
+
+    records = [r for s in log.segments() for r in read_records(log.path(s))[0]]
+    if len(records) != 11 or records[-1] != b'after the crash' or os.path.getsize(path) != read_records(path)[1]:
+        print(f"[ERROR] Torn tail was not recovered: {records}")
+        raise SystemExit(1)
+
+
+with tempfile.TemporaryDirectory() as temp_dir:
+    print(f"Writing a synthetic source for {DURATION} s per rate")
+    for sample_rate in RATES:
+        for name in power_logger.SINKS:
+            run(temp_dir, name, sample_rate)
+    check_torn_tail(temp_dir)
+
+print('[PASS] All records reached the DB and the torn tail was recovered!')
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+# Measures how long the start of the daemon takes until the first sample is in the DB, for a new DB and for one that
+# is already migrated. Also times the migration step on its own with caribou and with the fast path. Every run is a
+# new Python process so the imports are part of the time like they are for the daemon.
+# This uses the test DB of power_logger.py -t (/tmp/power_hog_test.db) and needs to run as root like the daemon.
+# Usage: ./bench_startup.py [runs]
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+import statistics
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+TEST_DB = '/tmp/power_hog_test.db'
+
+MIGRATE = '''
+import sys, time, sqlite3
+sys.path.insert(0, {root!r})
+import power_logger
+from libs import caribou
+start = time.perf_counter()
+if {fast!r}:
+    connection = sqlite3.connect({db!r})
+    power_logger.migrate_db(connection, {db!r})
+    connection.close()
+else:
+    caribou.upgrade({db!r}, power_logger.MIGRATIONS_PATH)
+print(time.perf_counter() - start)
+'''
+
+
+def first_sample(filename):
+    with open(os.path.join(ROOT, 'tests', 'powermetrics_test_output.plist'), 'r', encoding='utf-8') as source:
+        data = source.read()
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write(data[:data.index('</plist>') + len('</plist>')] + '\n')
+
+
+def remove(filename):
+    if os.path.exists(filename):
+        os.remove(filename)
+
+
+def time_migration(db_file, fast, fresh):
+    times = []
+    for _ in range(RUNS):
+        if fresh:
+            remove(db_file)
+        output = subprocess.check_output([sys.executable, '-c', MIGRATE.format(root=ROOT, db=db_file, fast=fast)])
+        times.append(float(output) * 1_000)
+    return statistics.median(times)
+
+
+def time_first_sample(sample_file, fresh):
+    times = []
+    for _ in range(RUNS):
+        if fresh:
+            remove(TEST_DB)
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(ROOT, 'power_logger.py'), '-t', '-f', sample_file,
+                        '-o', os.devnull], check=True)
+        times.append((time.perf_counter() - start) * 1_000)
+    return statistics.median(times)
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    db = os.path.join(tmp, 'startup.db')
+    print(f"Migration step, median of {RUNS} runs")
+    for fresh in (True, False):
+        state = 'new DB' if fresh else 'current DB'
+        print(f"  {state:10}  caribou: {time_migration(db, False, fresh):7.2f} ms"
+              f"  fast path: {time_migration(db, True, fresh):7.2f} ms")
+
+    sample = os.path.join(tmp, 'sample.plist')
+    first_sample(sample)
+    print(f"power_logger.py -t -f with one sample until it exits, median of {RUNS} runs")
+    for fresh in (True, False):
+        state = 'new DB' if fresh else 'current DB'
+        print(f"  {state:10}  {time_first_sample(sample, fresh):7.2f} ms")
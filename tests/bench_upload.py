@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+# Measures how fast a backlog of samples is drained against a local stand-in for the upload endpoint with different
+# numbers of concurrent upload threads. Also checks that every row arrives exactly once.
+# Usage: ./bench_upload.py [samples] [latency_ms]
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import tempfile
+import threading
+import http.server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+from libs import caribou
+
+N_SAMPLES = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000
+LATENCY = (int(sys.argv[2]) if len(sys.argv) > 2 else 50) / 1_000
+CONCURRENCY = [1, 2, 4, 8]
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    received = {}
+    keys = set()
+    lock = threading.Lock()
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['content-length'])))
+        time.sleep(LATENCY)
+        with self.lock:
+            if self.headers['Idempotency-Key'] not in self.keys:
+                self.keys.add(self.headers['Idempotency-Key'])
+                for row in payload:
+                    self.received[row['time']] = self.received.get(row['time'], 0) + 1
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *_):
+        pass
+
+
+def fill_db(db_file):
+    caribou.upgrade(db_file, power_logger.MIGRATIONS_PATH)
+    conn = sqlite3.connect(db_file)
+    conn.executemany('INSERT INTO process_names (id, name) VALUES (?, ?)', [(i, f"app{i}") for i in range(50)])
+    start = int(time.time() * 1_000) - N_SAMPLES * 5_000
+    for i in range(N_SAMPLES):
+        timestamp = start + i * 5_000
+        conn.execute('''INSERT INTO power_measurements (time, combined_energy, cpu_energy, gpu_energy, ane_energy,
+                        energy_impact, co2eq, elapsed_ns, thermal_pressure, grid_intensity, hw_model)
+                        VALUES (?, ?, ?, 0, 0, ?, NULL, 5000000000, 'Nominal', NULL, 'MacBookPro18,3')''',
+                     (timestamp, random.randint(0, 5000), random.randint(0, 5000), random.randint(0, 500)))
+        conn.executemany('INSERT INTO process_measurements (time, name_id, energy_impact, cputime_per) VALUES (?, ?, ?, ?)',
+                         [(timestamp, n, random.randint(0, 100), random.random() * 100) for n in random.sample(range(50), 15)])
+    conn.commit()
+    max_id = conn.execute('SELECT MAX(id) FROM power_measurements').fetchone()[0]
+    conn.close()
+    return max_id
+
+
+server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+power_logger.machine_uuid = 'bench'
+power_logger.global_settings = {
+    **power_logger.get_settings(test=True),
+    'api_url': f"http://127.0.0.1:{server.server_port}/v2/hog/add",
+    'upload_delta': 1,
+}
+
+print(f"Draining {N_SAMPLES} samples, {LATENCY * 1_000:.0f} ms server latency")
+
+with tempfile.TemporaryDirectory() as tmp:
+    for concurrency in CONCURRENCY:
+        db_file = os.path.join(tmp, f"db_{concurrency}.db")
+        max_id = fill_db(db_file)
+        StandInHandler.received = {}
+        StandInHandler.keys = set()
+
+        power_logger.DATABASE_FILE = db_file
+        power_logger.conn = sqlite3.connect(db_file)
+        power_logger.c = power_logger.conn.cursor()
+        power_logger.reset_upload_leases()
+
+        stop = threading.Event()
+        start = time.perf_counter()
+        threads = [threading.Thread(target=power_logger.upload_data_to_endpoint, args=(stop,))
+                   for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+
+        check = sqlite3.connect(db_file)
+        while check.execute('SELECT last_id FROM upload_status').fetchone()[0] < max_id:
+            time.sleep(0.01)
+        duration = time.perf_counter() - start
+        check.close()
+
+        stop.set()
+        for t in threads:
+            t.join()
+        power_logger.conn.close()
+
+        if len(StandInHandler.received) != N_SAMPLES or any(v != 1 for v in StandInHandler.received.values()):
+            print(f"[ERROR] {len(StandInHandler.received)} of {N_SAMPLES} rows received or duplicates")
+            raise SystemExit(1)
+
+        print(f"Concurrency {concurrency}: {duration:.2f} s, {N_SAMPLES / duration:.0f} rows/s")
+
+print('[PASS] All rows uploaded exactly once!')
+server.shutdown()
+
+# A newer batch that is acknowledged before an older one must neither be leased again after a restart nor be created
+# again once the older one is done
+with tempfile.TemporaryDirectory() as tmp:
+    db_file = os.path.join(tmp, 'out_of_order.db')
+    fill_db(db_file)
+    power_logger.conn = sqlite3.connect(db_file)
+    power_logger.c = power_logger.conn.cursor()
+    tc = power_logger.conn.cursor()
+
+    older = power_logger.lease_upload_batch(tc, 10)
+    newer = power_logger.lease_upload_batch(tc, 10)
+    power_logger.ack_upload_batch(tc, newer)
+    uploaded_early = tc.execute('SELECT last_id FROM upload_status').fetchone()[0] >= older[2]
+    power_logger.reset_upload_leases()
+    leased_again = power_logger.lease_upload_batch(tc, 10)
+
+    power_logger.ack_upload_batch(tc, leased_again)
+    uploaded_until = tc.execute('SELECT last_id FROM upload_status').fetchone()[0]
+    following = power_logger.lease_upload_batch(tc, 10)
+    open_batches = tc.execute('SELECT COUNT(*) FROM upload_batches').fetchone()[0]
+    power_logger.conn.close()
+
+if uploaded_early or leased_again[0] != older[0] or uploaded_until != newer[3] or following[2] <= newer[3] or \
+        open_batches != 1:
+    print(f"[ERROR] Out of order acks: {older}, {newer}, {leased_again}, {following}, uploaded until {uploaded_until}, "
+          f"{open_batches} open batches")
+    raise SystemExit(1)
+
+print('[PASS] Batches acknowledged out of order are not uploaded again!')
+
+# Rows that are stored after others but have an older time, because the clock went back or an old capture is followed,
+# must be uploaded too. Downsampling the uploaded rows must not upload them again.
+with tempfile.TemporaryDirectory() as tmp:
+    db_file = os.path.join(tmp, 'clock.db')
+    fill_db(db_file)
+    power_logger.conn = sqlite3.connect(db_file)
+    tc = power_logger.conn.cursor()
+    while batch := power_logger.lease_upload_batch(tc, 10):
+        power_logger.ack_upload_batch(tc, batch)
+
+    first_time = tc.execute('SELECT MIN(time) FROM power_measurements').fetchone()[0]
+    older_times = [first_time - i * 5_000 for i in range(1, 4)]
+    tc.executemany('INSERT INTO power_measurements (time, combined_energy, elapsed_ns) VALUES (?, 0, 5000000000)',
+                   [(t,) for t in older_times])
+    power_logger.aggregate_range(tc, first_time, first_time + 10 * 60 * 1_000, power_logger.HOUR_MS)
+    power_logger.conn.commit()
+    limit = power_logger.uploaded_before(tc)
+
+    uploaded = []
+    while batch := power_logger.lease_upload_batch(tc, 10):
+        uploaded += [row[1] for row in power_logger.get_upload_rows(tc, *batch[1:4])]
+        power_logger.ack_upload_batch(tc, batch)
+    power_logger.conn.close()
+
+if sorted(uploaded) != sorted(older_times) or limit > min(older_times):
+    print(f"[ERROR] Rows with an older time were not uploaded or uploaded again: {uploaded} != {older_times}, "
+          f"uploaded before {limit}")
+    raise SystemExit(1)
+
+print('[PASS] Rows with an older time are uploaded once!')
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+# Fills a DB with ten days of samples and enforces a size budget it can never reach, one step at a time. The oldest data
+# has to be brought to hourly values first, then to daily values and only then deleted, together with the sketches and
+# the process names nothing refers to anymore. Downsampling must keep all totals and nothing after the upload watermark
+# may be touched. The weekly optimizer has to keep the process totals too.
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+from libs.sketch import DDSketch
+
+DAY_MS = power_logger.DAY_MS
+HOUR_MS = power_logger.HOUR_MS
+DAYS = 10
+INTERVAL_MS = 10 * 60 * 1_000
+
+random.seed(3)
+START = (int(time.time() * 1_000) // DAY_MS - DAYS) * DAY_MS
+WATERMARK = START + 8 * DAY_MS + 6 * HOUR_MS + 5 * INTERVAL_MS // 2
+
+
+def fail(message):
+    print(f"[ERROR] {message}")
+    raise SystemExit(1)
+
+
+def fill(db_file):
+    conn = sqlite3.connect(db_file)
+    power_logger.migrate_db(conn, db_file)
+    # Apps 1 to 10 run all the time, 11 to 20 only on the first two days. One of these has an anomaly at the end.
+    conn.executemany('INSERT INTO process_names (id, name) VALUES (?, ?)', [(i, f"app{i}") for i in range(1, 21)])
+    conn.execute('''INSERT INTO process_anomalies (time, name_id, energy_impact, expected, score)
+                    VALUES (?, 20, 100, 10, 5)''', (START + DAYS * DAY_MS - INTERVAL_MS,))
+    for t in range(START, START + DAYS * DAY_MS, INTERVAL_MS):
+        conn.execute('''INSERT INTO power_measurements (time, combined_energy, cpu_energy, gpu_energy, ane_energy,
+                        energy_impact, co2eq, elapsed_ns, thermal_pressure, grid_intensity, hw_model,
+                        unattributed_energy) VALUES (?, ?, ?, ?, 0, ?, ?, ?, 'Nominal', 300, 'Mac', ?)''',
+                     (t, random.randint(0, 9_000), random.randint(0, 5_000), random.randint(0, 1_000),
+                      random.randint(0, 500), random.random(), INTERVAL_MS * 1_000_000, random.randint(0, 100)))
+        conn.executemany('''INSERT INTO process_measurements (time, name_id, energy_impact, cputime_per,
+                            combined_energy) VALUES (?, ?, ?, ?, ?)''',
+                         [(t, name_id, random.randint(0, 100), round(random.random() * 500, 3), random.randint(0, 900))
+                          for name_id in random.sample(range(1, 11 if t >= START + 2 * DAY_MS else 21), 3)])
+    for t in range(START, START + DAYS * DAY_MS, HOUR_MS):
+        sketch = DDSketch()
+        sketch.add(random.random() * 10_000)
+        conn.execute('INSERT INTO power_sketches (time, resolution, metric, sketch) VALUES (?, ?, ?, ?)',
+                     (t, HOUR_MS, 'combined_power', sketch.to_bytes()))
+    conn.execute('UPDATE upload_status SET last_id = (SELECT MAX(id) FROM power_measurements WHERE time <= ?)',
+                 (WATERMARK,))
+    conn.commit()
+    return conn
+
+
+def totals(cursor):
+    cursor.execute('''SELECT SUM(combined_energy), SUM(cpu_energy), SUM(energy_impact), SUM(elapsed_ns),
+                      SUM(unattributed_energy) FROM power_measurements''')
+    power = cursor.fetchone()
+    cursor.execute('SELECT SUM(energy_impact), SUM(cputime_per), SUM(combined_energy) FROM process_history')
+    return power, cursor.fetchone()
+
+
+def same_totals(got, expected):
+    return got[0] == expected[0] and all(abs(g - e) <= 1e-6 * abs(e) for g, e in zip(got[1], expected[1]))
+
+
+def after_watermark(cursor):
+    cursor.execute('SELECT * FROM power_measurements WHERE time > ? ORDER BY time', (WATERMARK,))
+    power = cursor.fetchall()
+    cursor.execute('SELECT * FROM process_measurements WHERE time > ? ORDER BY time, rowid', (WATERMARK,))
+    return power, cursor.fetchall()
+
+
+def state(cursor):
+    cursor.execute('SELECT resolution, until FROM downsample_status')
+    until = dict(cursor.fetchall())
+    cursor.execute('SELECT MIN(time) FROM power_measurements')
+    return until.get(HOUR_MS), until.get(DAY_MS), cursor.fetchone()[0]
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    db_file = os.path.join(tmp, 'budget.db')
+    conn = fill(db_file)
+    tc = conn.cursor()
+    power_logger.global_settings = {**power_logger.get_settings(test=True), 'upload_data': True,
+                                    'db_size_budget': 0.01}
+    power_logger.DB_BUDGET_MAX_STEPS = 1
+    power_logger.process_name_ids['app11'] = 11
+
+    expected_totals = totals(tc)
+    untouched = after_watermark(tc)
+
+    steps = []
+    while len(steps) < 100:
+        hourly, daily, oldest = state(tc)
+        power_logger.enforce_db_size_budget(tc)
+        new_hourly, new_daily, new_oldest = state(tc)
+        if new_hourly != hourly:
+            steps.append('hourly')
+        elif new_daily != daily:
+            steps.append('daily')
+        elif new_oldest != oldest:
+            steps.append('trim')
+        else:
+            break
+
+        if steps[-1] != 'trim' and not same_totals(totals(tc), expected_totals):
+            fail(f"The {steps[-1]} step changed the totals: {totals(tc)} != {expected_totals}")
+        if after_watermark(tc) != untouched:
+            fail(f"The {steps[-1]} step touched rows after the upload watermark")
+
+    phases = [step for i, step in enumerate(steps) if i == 0 or steps[i - 1] != step]
+    if phases != ['hourly', 'daily', 'trim']:
+        fail(f"The budget steps ran in the wrong order: {steps}")
+    tc.execute('SELECT COUNT(*) FROM power_measurements WHERE time <= ?', (WATERMARK,))
+    if tc.fetchone()[0]:
+        fail('Data before the upload watermark was left although the DB is over the budget')
+    tc.execute('SELECT MIN(time), COUNT(*) FROM power_sketches')
+    first_sketch, sketches = tc.fetchone()
+    if first_sketch != WATERMARK // HOUR_MS * HOUR_MS or sketches != (START + DAYS * DAY_MS - first_sketch) // HOUR_MS:
+        fail(f"The sketches were not trimmed with the data: {sketches} left from {first_sketch}")
+    tc.execute('SELECT id FROM process_names ORDER BY id')
+    if [row[0] for row in tc.fetchall()] != list(range(1, 11)) + [20] or power_logger.process_name_ids:
+        fail('The names of the deleted processes were not deleted or are still cached')
+    conn.close()
+
+print(f"[PASS] The size budget downsampled to hourly, then daily, then trimmed ({len(steps)} steps)!")
+
+with tempfile.TemporaryDirectory() as tmp:
+    power_logger.DATABASE_FILE = os.path.join(tmp, 'optimize.db')
+    conn = fill(power_logger.DATABASE_FILE)
+    power_logger.global_settings = {**power_logger.get_settings(test=True), 'upload_data': False}
+    expected_processes = totals(conn.cursor())[1]
+    power_logger.optimize_db_once()
+    got_processes = totals(conn.cursor())[1]
+    conn.close()
+
+if not same_totals((None, got_processes), (None, expected_processes)):
+    fail(f"The weekly optimizer changed the process totals: {got_processes} != {expected_processes}")
+
+print('[PASS] The weekly optimizer keeps the process totals!')
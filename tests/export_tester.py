@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# Checks that the export decodes the measurements payloads, writes BLOBs as base64, filters by time and that the
+# process pool writes exactly the same output as one process.
+
+import io
+import os
+import sys
+import csv
+import json
+import base64
+import random
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+from libs import export
+from libs.sketch import DDSketch
+
+
+def fail(message):
+    print(f"[ERROR] {message}")
+    raise SystemExit(1)
+
+
+def run(cursor, table, **kwargs):
+    out = io.StringIO()
+    rows = export.export(cursor, out, table, **kwargs)
+    return rows, out.getvalue()
+
+
+random.seed(4)
+power_logger.machine_uuid = 'export'
+power_logger.global_settings = power_logger.get_settings(test=True)
+
+with tempfile.TemporaryDirectory() as tmp:
+    db_file = os.path.join(tmp, 'export.db')
+    conn = sqlite3.connect(db_file)
+    power_logger.migrate_db(conn, db_file)
+
+    records = []
+    for i in range(2_500):
+        row = (i, 1_000_000 + i * 5_000, random.randint(0, 5_000), random.randint(0, 5_000), 0, 0,
+               random.randint(0, 500), None, 5_000_000_000, 'Nominal', None, 'MacBookPro18,3')
+        records.append(power_logger.build_upload_data(row, [{'name': f"app{n}", 'energy_impact': n, 'cputime_ms': 1.5}
+                                                            for n in range(random.randint(0, 15))]))
+        conn.execute('INSERT INTO measurements (time, data, uploaded) VALUES (?, ?, 0)',
+                     (row[1], power_logger.encode_upload_data(records[-1])))
+    # Old clients could leave rows that don't decode
+    conn.execute("INSERT INTO measurements (time, data, uploaded) VALUES (99999999999, 'not base64', 0)")
+
+    sketch = DDSketch()
+    for value in range(1, 1_000):
+        sketch.add(value)
+    conn.execute("INSERT INTO power_sketches VALUES (0, 3600000, 'combined_power', ?)", (sketch.to_bytes(),))
+    conn.commit()
+
+    c = conn.cursor()
+
+    rows, output = run(c, 'measurements')
+    lines = [json.loads(line) for line in output.splitlines()]
+    if rows != 2_501 or len(lines) != 2_501:
+        fail(f"Exported {rows} rows and {len(lines)} lines instead of 2501")
+    if [line['data'] for line in lines[:-1]] != json.loads(json.dumps(records)) or lines[-1]['data'] != 'not base64':
+        fail('The measurements payloads were not decoded')
+
+    _, raw = run(c, 'measurements', decode=False)
+    if json.loads(raw.splitlines()[0])['data'] != c.execute('SELECT data FROM measurements LIMIT 1').fetchone()[0]:
+        fail('The payload was decoded without decode')
+
+    rows, output = run(c, 'measurements', fmt='csv')
+    csv_rows = list(csv.DictReader(io.StringIO(output)))
+    if rows != len(csv_rows) or json.loads(csv_rows[0]['data']) != json.loads(json.dumps(records[0])):
+        fail('The CSV export is not the same as the NDJSON export')
+
+    rows, _ = run(c, 'measurements', start_ms=1_000_000 + 100 * 5_000, end_ms=1_000_000 + 200 * 5_000)
+    if rows != 100:
+        fail(f"{rows} rows in the time range instead of 100")
+
+    _, output = run(c, 'power_sketches')
+    exported = DDSketch.from_bytes(base64.b64decode(json.loads(output)['sketch']))
+    if exported.quantile(0.5) != sketch.quantile(0.5):
+        fail('The sketch BLOB did not survive the export')
+
+    for fmt in export.FORMATS:
+        _, single = run(c, 'measurements', fmt=fmt, chunk_rows=100)
+        _, pooled = run(c, 'measurements', fmt=fmt, chunk_rows=100, jobs=2)
+        if single != pooled:
+            fail(f"The {fmt} output of the process pool is different")
+
+    for table, kwargs in [('nope', {}), ('process_names', {'start_ms': 0})]:
+        try:
+            run(c, table, **kwargs)
+            fail(f"Exporting {table} with {kwargs} did not fail")
+        except ValueError:
+            pass
+
+    conn.close()
+
+print('[PASS] Export decodes, filters and writes the same output with a process pool!')
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+# Follows a capture file that grows, is restarted on, rotated and truncated. Every sample has to end up in the DB exactly once
+# and the stored offset has to be the end of the last sample.
+
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+
+TIMEOUT = 20
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'powermetrics_test_output.plist'), 'rb') as f:
+    samples = [s + b'</plist>\n' for s in f.read().split(b'</plist>\n') if s.strip(b'\x00\n')]
+
+
+def rows():
+    with sqlite3.connect(db_file) as check_conn:
+        return check_conn.execute('SELECT COUNT(*) FROM power_measurements').fetchone()[0]
+
+
+def wait_for(expected):
+    end = time.time() + TIMEOUT
+    while time.time() < end and rows() != expected:
+        time.sleep(0.1)
+    return rows()
+
+
+def append(data):
+    with open(capture, 'ab') as f:
+        f.write(data)
+
+
+def start():
+    stop = threading.Event()
+    thread = threading.Thread(target=power_logger.run_powermetrics, args=(stop, capture, True))
+    thread.start()
+    return stop, thread
+
+
+def fail(message):
+    print(f"[ERROR] {message}")
+    raise SystemExit(1)
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    db_file = os.path.join(tmp, 'follow.db')
+    capture = os.path.join(tmp, 'capture.plist')
+    power_logger.conn = sqlite3.connect(db_file, check_same_thread=False)
+    power_logger.c = power_logger.conn.cursor()
+    power_logger.migrate_db(power_logger.conn, db_file)
+    power_logger.global_settings = power_logger.get_settings(test=True)
+    power_logger.sink = power_logger.SqliteSink()
+
+    # Half a sample must not be ingested until it is complete
+    append(samples[0] + samples[1][:len(samples[1]) // 2])
+    stop, thread = start()
+    if wait_for(1) != 1:
+        fail(f"Expected 1 row with half a sample written, got {rows()}")
+
+    append(samples[1][len(samples[1]) // 2:] + samples[2])
+    if wait_for(3) != 3:
+        fail(f"Expected 3 rows after the file grew, got {rows()}")
+    stop.set()
+    thread.join()
+
+    path, inode, offset = power_logger.conn.execute('SELECT path, inode, offset FROM follow_status').fetchone()
+    if path != os.path.abspath(capture) or inode != os.stat(capture).st_ino or offset != os.path.getsize(capture):
+        fail(f"Wrong checkpoint {path} {inode} {offset} for a file of {os.path.getsize(capture)} bytes")
+
+    # A restart only picks up what was added while we were not running
+    append(samples[3])
+    stop, thread = start()
+    if wait_for(4) != 4:
+        fail(f"Expected 4 rows after the restart, got {rows()}")
+
+    os.rename(capture, f"{capture}.1")
+    append(samples[0] + samples[4])
+    if wait_for(6) != 6:
+        fail(f"Expected 6 rows after the rotation, got {rows()}")
+
+    # The half sample that was in the file when it was rotated or truncated is dropped, it would otherwise be parsed
+    # together with the first sample of the new file
+    append(samples[1][:len(samples[1]) // 2])
+    time.sleep(1)
+    os.rename(capture, f"{capture}.2")
+    append(samples[2])
+    if wait_for(7) != 7 or not thread.is_alive():
+        fail(f"Expected 7 rows after a rotation in the middle of a sample, got {rows()}")
+
+    append(samples[3][:len(samples[3]) // 2])
+    time.sleep(1)
+    with open(capture, 'wb'):
+        pass
+    time.sleep(1)
+    append(samples[4])
+    if wait_for(8) != 8 or not thread.is_alive():
+        fail(f"Expected 8 rows after a truncation in the middle of a sample, got {rows()}")
+    stop.set()
+    thread.join()
+
+    stop, thread = start()
+    time.sleep(2)
+    stop.set()
+    thread.join()
+    offset = power_logger.conn.execute('SELECT offset FROM follow_status').fetchone()[0]
+    if rows() != 8 or offset != os.path.getsize(capture):
+        fail(f"Restarting without new data gave {rows()} rows and offset {offset}")
+    power_logger.conn.close()
+
+print('[PASS] Every followed sample was stored exactly once!')
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+
+# A local stand-in for the /v2/hog/add endpoint so we can see how the upload behaves with a whole fleet of machines,
+# without a real server. It accepts what upload_data_to_endpoint in power_logger.py sends: a JSON list of rows where
+# data is the zlib compressed and base64 encoded upload record. Every row is decoded and checked. Invalid requests get
+# a 400 and nothing of them is stored.
+#
+# Valid rows are stored in SQLite. Requests that come in at the same time are written in one transaction by a single
+# writer thread and only answered with 204 once they are committed, like a real server should. A request with an
+# Idempotency-Key we already stored is answered with 204 and not stored again.
+#
+# To test the clients it can wait before answering (--latency, --jitter), answer with a 503 for a share of the requests
+# (--error-rate) or for everything during the first seconds (--outage).
+#
+# Point a hog at it with api_url = http://127.0.0.1:9142/v2/hog/add in the settings or use it from bench_fleet.py.
+# Usage: ./ingest_standin.py [--port 9142] [--db /tmp/ingest.db] [--latency 50] [--error-rate 0.05]
+
+import json
+import time
+import zlib
+import base64
+import random
+import sqlite3
+import argparse
+import binascii
+import threading
+import http.server
+
+PATH = '/v2/hog/add'
+
+ROW_FIELDS = {
+    'time': int,
+    'data': str,
+    'settings': str,
+    'machine_uuid': str,
+    'row_id': int,
+}
+DATA_FIELDS = {
+    'machine_uuid': str,
+    'timestamp': int,
+    'top_processes': list,
+    'combined_energy_mj': (int, float),
+    'energy_impact': (int, float),
+    'elapsed_ns': int,
+}
+
+
+class InvalidPayload(Exception):
+    pass
+
+
+def decode_payload(body):
+    # Returns the rows of a request with the decoded data or raises InvalidPayload
+    try:
+        payload = json.loads(body)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise InvalidPayload(f"Not JSON: {exc}") from exc
+    if not isinstance(payload, list) or not payload:
+        raise InvalidPayload('The payload must be a non empty list of rows')
+
+    rows = []
+    for i, row in enumerate(payload):
+        if not isinstance(row, dict):
+            raise InvalidPayload(f"Row {i} is not an object")
+        for field, field_type in ROW_FIELDS.items():
+            if not isinstance(row.get(field), field_type):
+                raise InvalidPayload(f"Row {i} has no valid {field}")
+
+        try:
+            data = json.loads(zlib.decompress(base64.b64decode(row['data'], validate=True)))
+        except (binascii.Error, zlib.error, ValueError) as exc:
+            raise InvalidPayload(f"Row {i} has data that can't be decoded: {exc}") from exc
+        if not isinstance(data, dict):
+            raise InvalidPayload(f"The data of row {i} is not an object")
+        for field, field_type in DATA_FIELDS.items():
+            # None is fine, old clients don't have all values
+            if data.get(field) is not None and not isinstance(data[field], field_type):
+                raise InvalidPayload(f"The data of row {i} has an invalid {field}")
+        if data.get('timestamp') != row['time']:
+            raise InvalidPayload(f"The data of row {i} is not for time {row['time']}")
+
+        rows.append((row['machine_uuid'], row['row_id'], row['time'], json.dumps(data), row['settings']))
+    return rows
+
+
+class BulkWriter:
+    # Writes everything that was handed in while the last transaction ran in one transaction
+
+    def __init__(self, db_file):
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS measurements (
+                                machine_uuid TEXT, row_id INT, time INT, data TEXT, settings TEXT)''')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS idempotency_keys (key TEXT PRIMARY KEY)')
+        self.conn.commit()
+        self.pending = []
+        self.cond = threading.Condition()
+        self.closed = False
+        self.counters = {
+            'rows': 0,
+            'requests': 0,
+            'duplicates': 0,
+            'transactions': 0,
+        }
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def store(self, key, rows):
+        # Blocks until the rows are committed. Returns False if the key was stored before.
+        done = threading.Event()
+        entry = [key, rows, done, True]
+        with self.cond:
+            self.pending.append(entry)
+            self.cond.notify()
+        done.wait()
+        return entry[3]
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.closed:
+                    self.cond.wait()
+                if not self.pending:
+                    return
+                entries, self.pending = self.pending, []
+
+            rows = []
+            seen = set()
+            for entry in entries:
+                key = entry[0]
+                if key is not None and (key in seen or self.conn.execute(
+                        'SELECT 1 FROM idempotency_keys WHERE key = ?', (key,)).fetchone()):
+                    entry[3] = False
+                    self.counters['duplicates'] += 1
+                    continue
+                if key is not None:
+                    seen.add(key)
+                rows.extend(entry[1])
+                self.counters['requests'] += 1
+
+            self.conn.executemany('INSERT INTO idempotency_keys (key) VALUES (?)', [(k,) for k in seen])
+            self.conn.executemany('INSERT INTO measurements VALUES (?, ?, ?, ?, ?)', rows)
+            self.conn.commit()
+            self.counters['rows'] += len(rows)
+            self.counters['transactions'] += 1
+
+            for entry in entries:
+                entry[2].set()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+        self.conn.close()
+
+
+class IngestStandIn:
+
+    def __init__(self, db_file, port=0, latency=0, jitter=0, error_rate=0, outage=0, host='127.0.0.1'):
+        self.writer = BulkWriter(db_file)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.outage_until = time.time() + outage
+        self.lock = threading.Lock()
+        self.counters = {
+            'received': 0,
+            'invalid': 0,
+            'errors_injected': 0,
+        }
+        # Seconds from the request coming in to the answer, of every stored request
+        self.durations = []
+        standin = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            # Keep the connection if the client can, urllib closes it anyway
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                start = time.perf_counter()
+                body = self.rfile.read(int(self.headers.get('content-length', 0)))
+                status, message = standin.handle(self.path, self.headers.get('Idempotency-Key'), body)
+                if status == 204:
+                    with standin.lock:
+                        standin.durations.append(time.perf_counter() - start)
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(message)))
+                self.end_headers()
+                self.wfile.write(message)
+
+            def log_message(self, *_):
+                pass
+
+        class Server(http.server.ThreadingHTTPServer):
+            # The default of 5 makes a fleet that connects at the same time wait for SYN retries
+            request_queue_size = 128
+
+        self.server = Server((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_port
+        self.url = f"http://{host}:{self.port}{PATH}"
+        self.thread = None
+
+    def count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def handle(self, path, key, body):
+        # Returns the HTTP status and the body of the answer
+        self.count('received')
+        if path != PATH:
+            return 404, b'Not found'
+
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+
+        if time.time() < self.outage_until or random.random() < self.error_rate:
+            self.count('errors_injected')
+            return 503, b'Injected error'
+
+        try:
+            rows = decode_payload(body)
+        except InvalidPayload as exc:
+            self.count('invalid')
+            return 400, str(exc).encode()
+
+        self.writer.store(key, rows)
+        return 204, b''
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the hog upload endpoint')
+    parser.add_argument('--port', type=int, default=9142)
+    parser.add_argument('--db', default='/tmp/ingest.db', help='Where the received rows are stored')
+    parser.add_argument('--latency', type=float, default=0, help='ms to wait before answering')
+    parser.add_argument('--jitter', type=float, default=0, help='Up to this many ms are added to the latency')
+    parser.add_argument('--error-rate', type=float, default=0, help='Share of the requests that get a 503')
+    parser.add_argument('--outage', type=float, default=0, help='Answer everything with a 503 for this many seconds')
+    args = parser.parse_args()
+
+    standin = IngestStandIn(args.db, args.port, args.latency / 1_000, args.jitter / 1_000, args.error_rate, args.outage)
+    print(f"Listening on {standin.url}, storing to {args.db}")
+    try:
+        standin.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    standin.server.server_close()
+    standin.writer.close()
+    print({**standin.counters, **standin.writer.counters})
+
+
+if __name__ == '__main__':
+    main()
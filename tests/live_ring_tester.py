@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+# Has one process write samples into the live ring as fast as it can while other processes read it and checks that
+# every sample and every total a reader gets is consistent. The ring is small so slots are overwritten all the time.
+
+import os
+import sys
+import time
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from libs.live_ring import RingWriter, RingReader, TornRead
+
+DURATION = 3
+READERS = 3
+CAPACITY = 8
+TOP_PROCESSES = 5
+
+
+def sample(n):
+    record = {
+        'time': 1_000 + n,
+        'combined_energy': 3 * n,
+        'cpu_energy': 2 * n,
+        'gpu_energy': n,
+        'ane_energy': 0,
+        'energy_impact': n,
+        'co2eq': n / 2,
+        'elapsed_ns': 1_000,
+        'thermal_pressure': 'Nominal' if n % 2 else 'Heavy',
+        'grid_intensity': None if n % 3 else n,
+    }
+    top_processes = [{'name': f"app{n % 50}_{i}", 'energy_impact': n + i, 'cputime_ms': n / 10}
+                     for i in range(n % (TOP_PROCESSES + 1))]
+    return record, top_processes
+
+
+def writer(path, stop):
+    ring = RingWriter(path, CAPACITY, TOP_PROCESSES)
+    n = 0
+    while not stop.is_set():
+        ring.publish(*sample(n))
+        n += 1
+    ring.close()
+
+
+def reader(path, result):
+    ring = RingReader(path)
+    reads = samples = errors = torn = 0
+    end = time.time() + DURATION
+    while time.time() < end:
+        try:
+            count, totals = ring.totals()
+            got = ring.samples()
+        except TornRead:
+            torn += 1
+            continue
+        reads += 1
+
+        # Sum of 0..count-1
+        expected = count * (count - 1) // 2
+        if totals['combined_energy'] != 3 * expected or totals['elapsed_ns'] != 1_000 * count:
+            errors += 1
+
+        last = -1
+        for s in got:
+            n = s['time'] - 1_000
+            record, top_processes = sample(n)
+            expected_sample = {**record, 'top_processes': top_processes}
+            if s != expected_sample or n <= last:
+                errors += 1
+            last = n
+            samples += 1
+
+    ring.close()
+    result.put((reads, samples, errors, torn))
+
+
+if sys.platform != 'linux':
+    print('[PASS] Skipped, this test needs Linux')
+    raise SystemExit(0)
+
+with tempfile.TemporaryDirectory() as tmp:
+    ring_path = os.path.join(tmp, 'live.ring')
+    stop_event = multiprocessing.Event()
+    results = multiprocessing.Queue()
+
+    writer_process = multiprocessing.Process(target=writer, args=(ring_path, stop_event))
+    writer_process.start()
+    while not os.path.exists(ring_path):
+        time.sleep(0.01)
+
+    readers = [multiprocessing.Process(target=reader, args=(ring_path, results)) for _ in range(READERS)]
+    for r in readers:
+        r.start()
+    totals_read = [results.get() for _ in readers]
+    for r in readers:
+        r.join()
+    stop_event.set()
+    writer_process.join()
+
+for i, (n_reads, n_samples, n_errors, n_torn) in enumerate(totals_read):
+    print(f"Reader {i}: {n_reads} snapshots, {n_samples} samples, {n_torn} gave up, {n_errors} inconsistent")
+
+if any(r[2] for r in totals_read) or not all(r[1] for r in totals_read):
+    print('[ERROR] Readers saw inconsistent samples!')
+    raise SystemExit(1)
+
+print('[PASS] All snapshots were consistent!')
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# Feeds the test plist through power_logger.py with the metrics exporter on, scrapes it and checks the counters
+# against the DB. Then pushes many different process names through the top K counters and checks that the number of
+# series stays bounded and that no counter ever goes down.
+
+import os
+import sys
+import random
+import sqlite3
+import tempfile
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+from libs import caribou
+from libs.metrics_exporter import MetricsExporter, TopKCounters, CONTENT_TYPE
+
+plistfile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'powermetrics_test_output.plist')
+
+
+def scrape(port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+        content_type = response.headers['Content-Type']
+        body = response.read().decode('utf-8')
+
+    lines = body.splitlines()
+    if content_type != CONTENT_TYPE or lines[-1] != '# EOF':
+        print(f"[ERROR] Not an OpenMetrics response: {content_type}")
+        raise SystemExit(1)
+    return dict(line.rsplit(' ', 1) for line in lines if not line.startswith('#'))
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    db_file = os.path.join(tmp, 'metrics.db')
+    caribou.upgrade(db_file, power_logger.MIGRATIONS_PATH)
+    power_logger.conn = sqlite3.connect(db_file)
+    power_logger.c = power_logger.conn.cursor()
+    power_logger.global_settings = power_logger.get_settings(test=True)
+    power_logger.storage_window = power_logger.StorageWindow(0)
+    power_logger.sink = power_logger.SqliteSink()
+    power_logger.metrics_exporter = MetricsExporter(0, power_logger.stats, top_k=3)
+    power_logger.metrics_exporter.start()
+
+    with open(plistfile, 'r', encoding='utf-8') as file:
+        power_logger.parse_powermetrics_output(file.read().replace('&', '&amp;'))
+
+    metrics = scrape(power_logger.metrics_exporter.port)
+    power_logger.metrics_exporter.close()
+
+    combined, energy_impact, samples = power_logger.c.execute(
+        'SELECT SUM(combined_energy), SUM(energy_impact), COUNT(*) FROM power_measurements').fetchone()
+    process_total = power_logger.c.execute('SELECT SUM(energy_impact) FROM process_measurements').fetchone()[0]
+    power_logger.conn.close()
+
+process_series = {k: float(v) for k, v in metrics.items() if k.startswith('hog_process_energy_impact_total')}
+
+if round(float(metrics['hog_combined_energy_joules_total']) * 1_000) == combined and \
+        float(metrics['hog_energy_impact_total']) == energy_impact and \
+        int(metrics['hog_samples_total']) == samples and \
+        len(process_series) == 4 and sum(process_series.values()) == process_total:
+    print('[PASS] Exported values match the DB!')
+else:
+    print(f"[ERROR] Exported values don't match the DB! {metrics}")
+    raise SystemExit(1)
+
+counters = TopKCounters(5)
+previous = {}
+for i in range(100_000):
+    # A few heavy processes and a long tail of short lived ones
+    name = f"heavy{i % 3}" if i % 4 == 0 else f"tail{random.randint(0, 5_000)}"
+    counters.add(name, random.randint(1, 100))
+
+    if i % 100 == 0:
+        current = {**counters.labelled, '(other)': counters.other}
+        if len(counters.labelled) > 5 or len(counters.candidates) > counters.max_candidates or \
+                any(current[k] < v for k, v in previous.items() if k in current):
+            print(f"[ERROR] Top K counters went down or grew too big! {current}")
+            raise SystemExit(1)
+        previous = current
+
+if not all(f"heavy{i}" in counters.labelled for i in range(3)):
+    print(f"[ERROR] The heavy processes are not labelled! {counters.labelled}")
+    raise SystemExit(1)
+
+print('[PASS] Process series are bounded and monotonic!')
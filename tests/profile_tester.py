@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+# Replays the test plist with both profile modes and checks that we get a profile of the sample processing. The input
+# is a fifo that we keep open after the plist so we can ask for profiles with SIGUSR2 while power_logger.py is running.
+
+import os
+import sys
+import time
+import glob
+import pstats
+import signal
+import tempfile
+import subprocess
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PLIST_FILE = os.path.join(TESTS_DIR, 'powermetrics_test_output.plist')
+
+
+def wait_for(pattern, timeout=30):
+    end = time.time() + timeout
+    while time.time() < end:
+        if files := glob.glob(pattern):
+            return files
+        time.sleep(0.1)
+    return []
+
+
+def has_process_sample(path, mode):
+    if mode == 'cprofile':
+        return any(func[2] == 'process_sample' for func in pstats.Stats(path).stats)
+    with open(path, 'r', encoding='utf-8') as f:
+        return 'process_samples (power_logger.py' in f.read()
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    for mode, suffix in [('cprofile', 'pstats'), ('sampler', 'folded')]:
+        profile_dir = os.path.join(tmp, mode)
+        fifo = os.path.join(tmp, f"{mode}.fifo")
+        os.mkfifo(fifo)
+        if os.path.exists('/tmp/power_hog_test.db'):
+            os.remove('/tmp/power_hog_test.db')
+
+        with subprocess.Popen([sys.executable, os.path.join(TESTS_DIR, '..', 'power_logger.py'), '-t', '-f', fifo,
+                               '-o', os.path.join(tmp, f"{mode}.log"),
+                               '--profile', mode, '--profile-dir', profile_dir]) as process:
+            with open(fifo, 'w', encoding='utf-8') as writer:
+                with open(PLIST_FILE, 'r', encoding='utf-8') as plist:
+                    writer.write(plist.read())
+                writer.flush()
+
+                # Give the sampler time to see the samples being processed
+                time.sleep(1)
+                process.send_signal(signal.SIGUSR2)
+                on_signal = wait_for(os.path.join(profile_dir, f"*-MainThread.{suffix}"))
+
+            process.wait(timeout=60)
+
+        worker = glob.glob(os.path.join(profile_dir, f"*process_samples.{suffix}"))
+
+        if not on_signal or not worker or not has_process_sample(worker[0], mode):
+            print(f"[ERROR] No {mode} profile of the sample processing! {os.listdir(profile_dir)}")
+            raise SystemExit(1)
+
+        print(f"[PASS] {mode} wrote {len(os.listdir(profile_dir))} thread profiles")
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+# Fills a DB with two weeks of a constant 1 W load and checks that the hourly and working hours reports stay right
+# after the weekly optimizer and the daily downsampling of the size budget. Days that can't be put into hours anymore
+# have to be counted as unassigned energy instead of ending up in hour 0.
+
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+from libs import report
+
+DAYS = 14
+INTERVAL_MS = 5 * 60 * 1_000
+DAY_MS = report.DAY_MS
+
+END = int(time.time() * 1_000) // INTERVAL_MS * INTERVAL_MS
+START = END - DAYS * DAY_MS
+
+
+def fail(message):
+    print(f"[ERROR] {message}")
+    raise SystemExit(1)
+
+
+def reports(cursor, start_ms=0):
+    result = {'array': report.Report(use_numpy=False).read(cursor, start_ms).tables()}
+    if report.np is not None:
+        result['numpy'] = report.Report().read(cursor, start_ms).tables()
+    return result
+
+
+def check(step, cursor, total_energy):
+    # Only the rows that can still be put into an hour count for the share of the working hours
+    cursor.execute('SELECT until FROM downsample_status WHERE resolution = ?', (DAY_MS,))
+    row = cursor.fetchone()
+    cursor.execute('SELECT MIN(time) FROM power_measurements WHERE elapsed_ns IS NOT NULL AND time >= ?',
+                   (row[0] if row else 0,))
+    first_hourly = cursor.fetchone()[0]
+    expected_share = report.Report(use_numpy=False)
+    for t in range(first_hourly, END, INTERVAL_MS):
+        expected_share.add_power([t], [INTERVAL_MS], [INTERVAL_MS * 1_000_000])
+
+    for backend, tables in reports(cursor).items():
+        powers = [h['avg_power_w'] for h in tables['hourly']]
+        if any(p != 1.0 for p in powers):
+            fail(f"{step}: the {backend} report doesn't show 1 W in every hour: {powers}")
+        working_hours = tables['working_hours'][0]
+        if working_hours['share'] != expected_share.tables()['working_hours'][0]['share']:
+            fail(f"{step}: the {backend} working hours share is {working_hours['share']}")
+        if working_hours['total_energy_mj'] + working_hours['unassigned_energy_mj'] != total_energy:
+            fail(f"{step}: the {backend} report lost energy: {working_hours}")
+    return working_hours['unassigned_energy_mj']
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    power_logger.DATABASE_FILE = os.path.join(tmp, 'report.db')
+    power_logger.global_settings = {**power_logger.get_settings(test=True), 'upload_data': False}
+    conn = sqlite3.connect(power_logger.DATABASE_FILE)
+    power_logger.migrate_db(conn, power_logger.DATABASE_FILE)
+    # 1 W is 1 mJ per ms
+    conn.executemany('''INSERT INTO power_measurements (time, combined_energy, cpu_energy, gpu_energy, ane_energy,
+                        energy_impact, elapsed_ns) VALUES (?, ?, 0, 0, 0, 0, ?)''',
+                     [(t, INTERVAL_MS, INTERVAL_MS * 1_000_000) for t in range(START, END, INTERVAL_MS)])
+    conn.commit()
+    tc = conn.cursor()
+    total = DAYS * DAY_MS
+
+    if check('Raw samples', tc, total):
+        fail('Raw samples were counted as unassigned')
+
+    power_logger.optimize_db_once()
+    if not check('After the weekly optimizer', tc, total):
+        fail('The days of the weekly optimizer were not counted as unassigned')
+
+    unassigned = 0
+    while power_logger.downsample_step(tc, DAY_MS, 2 * DAY_MS, END - 3 * DAY_MS):
+        conn.commit()
+        unassigned = check('After the daily downsampling', tc, total)
+    if unassigned < 10 * DAY_MS:
+        fail(f"The days of the daily downsampling were not counted as unassigned: {unassigned} mJ")
+    conn.close()
+
+print('[PASS] The hourly and working hours reports stay right after the DB was optimized!')
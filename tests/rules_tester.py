@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+# Checks the exact, prefix, glob and regex rules, that the cached decisions count the same hits as fresh ones and that
+# resolve_names with the default settings resolves the test plist like the old exact name lists did.
+
+import os
+import sys
+import plistlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+from libs import rules
+from libs.sample import Sample
+
+plistfile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'powermetrics_test_output.plist')
+
+
+def fail(message):
+    print(f"[ERROR] {message}")
+    raise SystemExit(1)
+
+
+name_rules = rules.NameRules(['com.apple.Terminal', 'com.jetbrains.*', '*.cron', 'org.alacritty', ''],
+                             ['python', 're:^Python3?(\\.\\d+)?$', 'node*'])
+
+cases = {
+    'com.apple.terminal': rules.EXPAND,
+    ' COM.APPLE.TERMINAL ': rules.EXPAND,
+    'com.jetbrains.pycharm': rules.EXPAND,
+    'com.jetbrains': 0,
+    'com.vix.cron': rules.EXPAND,
+    'com.vix.cron.helper': 0,
+    '': rules.EXPAND,
+    '   ': rules.EXPAND,
+    'python': rules.CMDLINE,
+    'Python3.11': rules.CMDLINE,
+    'python3.11-config': 0,
+    'node': rules.CMDLINE,
+    'nodejs': rules.CMDLINE,
+    'com.apple.finder': 0,
+}
+for _ in range(3):
+    for name, expected in cases.items():
+        if name_rules.decide(name) != expected:
+            fail(f"{name!r} decided {name_rules.decide(name)} instead of {expected}")
+
+counters = name_rules.counters
+if counters['cache_misses'] != len(cases) or counters['cache_hits'] != 2 * len(cases):
+    fail(f"The decisions were not cached: {counters}")
+expected_hits = {'resolve_coalitions:com.apple.terminal': 6, 'resolve_coalitions:com.jetbrains.': 3,
+                 'resolve_coalitions:*.cron': 3, 'resolve_coalitions:org.alacritty': 0, 'resolve_process:python': 3,
+                 'resolve_process:^Python3?(\\.\\d+)?$': 3, 'resolve_process:node': 6}
+if counters['rule_hits'] != expected_hits:
+    fail(f"Rule hits {counters['rule_hits']} instead of {expected_hits}")
+
+# A name matched by two rules of one setting is counted for the first one only
+overlapping = rules.NameRules([], ['python*', 're:py'])
+overlapping.decide('python3')
+if overlapping.counters['rule_hits'] != {'resolve_process:python': 1, 'resolve_process:py': 0}:
+    fail(f"Overlapping rules counted {overlapping.counters['rule_hits']}")
+
+small = rules.NameRules(['a'], [], max_cache=10)
+for i in range(25):
+    small.decide(f"name{i}")
+if small.counters['cached_names'] > 10:
+    fail(f"The cache grew to {small.counters['cached_names']} names")
+
+try:
+    rules.NameRules([], ['re:python(['])
+    fail('A broken regex was accepted')
+except ValueError:
+    pass
+
+print('[PASS] Exact, prefix, glob and regex rules decide and count correctly!')
+
+
+def old_resolve_names(data, resolve_coalitions):
+    resolved = []
+    for coalition in data['coalitions']:
+        name = coalition['name'].strip().lower()
+        if name in resolve_coalitions or not name:
+            tasks = coalition.get('tasks', [])
+            resolved.extend(tasks if isinstance(tasks, list) else [coalition])
+        else:
+            resolved.append(coalition)
+    return resolved
+
+
+with open(plistfile, 'rb') as f:
+    data = plistlib.loads(f.read().split(b'</plist>')[0] + b'</plist>')
+
+settings = power_logger.get_settings(test=True)
+settings['resolve_coalitions'] = [x.strip() for x in settings['resolve_coalitions'].split(',')]
+expected = old_resolve_names(data, [x.lower() for x in settings['resolve_coalitions']])
+# One of the resolved tasks gets its cmdline looked up. A coalition has no pid so it can't be looked up.
+tasks = [c['name'] for c in expected if 'pid' in c]
+settings['resolve_process'] = [tasks[0].upper(), expected[0]['name']]
+power_logger.global_settings = settings
+power_logger.name_rules = None
+
+# The cmdline cache would fork ps or read /proc, we only want to know what was looked up
+looked_up = []
+power_logger.cmdline_cache.get = lambda pid, name: looked_up.append(name)
+
+resolved = power_logger.resolve_names(Sample.from_plist(data))
+if resolved.names != [c['name'] for c in expected]:
+    fail('resolve_names resolved other coalitions than the exact lists')
+if looked_up != [tasks[0]]:
+    fail(f"Looked up {looked_up} instead of {tasks[0]}")
+
+print('[PASS] resolve_names resolves the test plist like the exact name lists!')
@@ -12,3 +12,18 @@ fi
 sudo ../power_logger.py -t -f powermetrics_test_output.plist -o /tmp/power_hog_test_output
 
 ./tester.py
+./storage_window_tester.py
+./live_ring_tester.py
+./metrics_exporter_tester.py
+./adaptive_sampling_tester.py
+./schema_tester.py
+./follow_tester.py
+./sketch_tester.py
+./anomaly_tester.py
+./attribution_tester.py
+./export_tester.py
+./rules_tester.py
+./sample_tester.py
+./budget_tester.py
+./report_tester.py
+sudo ./profile_tester.py
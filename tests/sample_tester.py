@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+# Checks that load_plist parses the test plist exactly like plistlib, that the sample model keeps the values the
+# logger uses and that merging two samples loses no time, energy or energy impact and doesn't change them.
+
+import os
+import sys
+import copy
+import plistlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+from libs.rules import NameRules
+from libs.sample import Sample, load_plist
+
+
+def fail(message):
+    print(f"[ERROR] {message}")
+    raise SystemExit(1)
+
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'powermetrics_test_output.plist'), 'rb') as f:
+    plists = [p for p in f.read().replace(b'&', b'&amp;').split(b'\x00') if p.strip()]
+
+for p in plists:
+    if load_plist(p) != plistlib.loads(p):
+        fail('load_plist and plistlib disagree')
+
+for p in plists:
+    data = plistlib.loads(p)
+    sample = Sample.from_plist(data)
+    if len(sample.coalitions) != len(data['coalitions']) or \
+            len(sample.tasks) != sum(len(c['tasks']) if isinstance(c.get('tasks'), list) else 1
+                                     for c in data['coalitions']):
+        fail('Coalitions or tasks went missing')
+    for i, coalition in enumerate(data['coalitions']):
+        if sample.coalitions.names[i] != coalition['name'] or \
+                sample.coalitions.energy_impact_per_s[i] != coalition['energy_impact_per_s'] or \
+                sample.tasks.names[sample.task_starts[i]:sample.task_starts[i + 1]] != \
+                [t['name'] for t in coalition['tasks']]:
+            fail(f"{coalition['name']} is not what was in the plist")
+    if sample.processor['combined_power'] != data['processor']['combined_power'] or 'clusters' in sample.processor:
+        fail('The processor values are not what was in the plist')
+
+# A coalition without a tasks list is kept when it is replaced by its tasks, and it has no pid to look up
+data = plistlib.loads(plists[0])
+del data['coalitions'][0]['tasks']
+name = data['coalitions'][0]['name']
+looked_up = []
+resolved = Sample.from_plist(data).resolve(NameRules([name], [name]), lambda pid, n: looked_up.append(pid))
+if resolved.names.count(name) != 1 or looked_up:
+    fail(f"{name} without tasks was dropped or looked up when it was resolved")
+
+print('[PASS] The sample model keeps what the plist has!')
+
+
+def totals(sample):
+    ns = sample.elapsed_ns
+    return [ns, sample.processor['combined_power'] * ns, sample.energy_impact_per_s * ns,
+            sum(sample.coalitions.energy_impact), sum(sample.tasks.energy_impact),
+            sum(sample.coalitions.energy_impact_per_s) * ns, sum(sample.tasks.cputime_ms_per_s) * ns]
+
+
+samples = power_logger.parse_plist(b'\x00'.join(plists).decode())
+merged = samples[0]
+for sample in samples[1:]:
+    before = copy.deepcopy(sample), copy.deepcopy(merged)
+    merged = power_logger.merge_samples(merged, sample)
+    if [totals(s) for s in before] != [totals(sample), totals(before[1])]:
+        fail('merge_samples changed a sample')
+
+expected = [sum(column) for column in zip(*map(totals, samples))]
+got = totals(merged)
+if any(abs(g - e) > 1e-9 * abs(e) for g, e in zip(got, expected)):
+    fail(f"Merging lost something: {got} != {expected}")
+if len(merged.task_starts) != len(merged.coalitions) + 1 or merged.task_starts[-1] != len(merged.tasks):
+    fail('The tasks of the merged sample are not where their coalitions say')
+if merged.time != samples[-1].time:
+    fail('The merged sample does not end with the last sample')
+
+print('[PASS] Merged samples keep all time, energy and energy impact!')
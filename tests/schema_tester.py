@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# Checks that a DB created from migrations/schema.sql is the same as one that went through all migrations and that an
+# old DB is still migrated. Fails if someone adds a migration and forgets to update the schema.
+
+import os
+import sys
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+from libs import caribou
+
+FIRST_MIGRATION = '20230909161250'
+
+
+def describe(db_file):
+    # Column order and the formatting of the CREATE statements differ, what the tables hold and look like must not
+    connection = sqlite3.connect(db_file)
+    description = {}
+    for kind, name, tbl_name, sql in connection.execute(
+            "SELECT type, name, tbl_name, sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_%' ORDER BY name"):
+        if kind == 'table':
+            columns = sorted(row[1:] for row in connection.execute(f'PRAGMA table_info("{name}")'))
+            rows = sorted(connection.execute(f'SELECT * FROM "{name}"').fetchall())
+            description[name] = (kind, columns, rows)
+        elif kind == 'index':
+            columns = [row[2] for row in connection.execute(f'PRAGMA index_info("{name}")')]
+            description[name] = (kind, tbl_name, columns)
+        else:
+            description[name] = (kind, ' '.join(sql.split()))
+    connection.close()
+    return description
+
+
+def migrate(db_file):
+    connection = sqlite3.connect(db_file)
+    power_logger.migrate_db(connection, db_file)
+    connection.close()
+
+
+caribou_calls = []
+caribou_upgrade = caribou.upgrade
+def counting_upgrade(*args, **kwargs):
+    caribou_calls.append(args)
+    return caribou_upgrade(*args, **kwargs)
+caribou.upgrade = counting_upgrade
+
+with tempfile.TemporaryDirectory() as tmp:
+    migrated = os.path.join(tmp, 'migrated.db')
+    caribou_upgrade(migrated, power_logger.MIGRATIONS_PATH)
+
+    fresh = os.path.join(tmp, 'fresh.db')
+    migrate(fresh)
+    fresh_calls = len(caribou_calls)
+    migrate(fresh)
+    current_calls = len(caribou_calls) - fresh_calls
+
+    old = os.path.join(tmp, 'old.db')
+    caribou_upgrade(old, power_logger.MIGRATIONS_PATH, FIRST_MIGRATION)
+    migrate(old)
+
+    expected = describe(migrated)
+    from_schema = describe(fresh)
+    from_old = describe(old)
+
+if from_schema != expected:
+    for name in sorted(set(expected) | set(from_schema)):
+        if expected.get(name) != from_schema.get(name):
+            print(f"{name}:\n  migrations: {expected.get(name)}\n  schema.sql: {from_schema.get(name)}")
+    print('[ERROR] migrations/schema.sql does not match the migrations!')
+    raise SystemExit(1)
+
+if fresh_calls or current_calls:
+    print(f"[ERROR] caribou was called {fresh_calls} times for a new DB and {current_calls} times for a current one!")
+    raise SystemExit(1)
+
+if from_old != expected:
+    print('[ERROR] An old DB was not migrated to the current schema!')
+    raise SystemExit(1)
+
+print('[PASS] The schema matches the migrations!')
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+# Checks that the quantile sketches stay within their relative accuracy, merge exactly and survive being stored. Then
+# feeds the test plist through power_logger.py and checks the hourly sketches, the daily rollup and the report.
+
+import os
+import sys
+import random
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+from libs import report
+from libs.sketch import DDSketch, RELATIVE_ACCURACY
+
+QUANTILES = [0.01, 0.5, 0.9, 0.95, 0.99, 1]
+
+plistfile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'powermetrics_test_output.plist')
+
+
+def fail(message):
+    print(f"[ERROR] {message}")
+    raise SystemExit(1)
+
+
+random.seed(42)
+# Power in mW of an idle machine with some bursts and a few samples where the GPU is off
+values = [random.lognormvariate(7, 1.2) for _ in range(100_000)] + [0] * 500
+exact = sorted(values)
+
+whole, first, second = DDSketch(), DDSketch(), DDSketch()
+for i, value in enumerate(values):
+    whole.add(value)
+    (first if i % 2 else second).add(value)
+
+for q in QUANTILES:
+    real = exact[int(q * (len(exact) - 1))]
+    estimate = whole.quantile(q)
+    if abs(estimate - real) > real * RELATIVE_ACCURACY:
+        fail(f"p{q * 100} is {estimate}, the real value is {real}")
+
+merged = DDSketch.from_bytes(first.merge(second).to_bytes())
+if merged.bins != whole.bins or merged.count != whole.count or \
+        [merged.quantile(q) for q in QUANTILES] != [whole.quantile(q) for q in QUANTILES]:
+    fail('Merging and storing the sketch changed it')
+
+print(f"[PASS] Sketch of {whole.count} values is within {RELATIVE_ACCURACY:.0%} and takes {len(whole.to_bytes())} bytes")
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    db_file = os.path.join(tmp, 'sketch.db')
+    power_logger.conn = sqlite3.connect(db_file)
+    power_logger.c = power_logger.conn.cursor()
+    power_logger.migrate_db(power_logger.conn, db_file)
+    power_logger.global_settings = power_logger.get_settings(test=True)
+    power_logger.storage_window = power_logger.StorageWindow(0)
+    power_logger.power_sketches = power_logger.PowerSketches()
+    power_logger.sink = power_logger.SqliteSink()
+
+    buffer = []
+    with open(plistfile, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip().replace('&', '&amp;')
+            buffer.append(line)
+            if line == '</plist>':
+                power_logger.parse_powermetrics_output(''.join(buffer))
+                buffer.clear()
+    power_logger.power_sketches.flush()
+
+    tc = power_logger.conn.cursor()
+    samples, max_power = tc.execute('''SELECT COUNT(*), MAX(combined_energy * 1000000000.0 / elapsed_ns)
+                                       FROM power_measurements''').fetchone()
+
+    def stored(resolution):
+        sketches = {}
+        for metric, data in tc.execute('SELECT metric, sketch FROM power_sketches WHERE resolution = ?',
+                                       (resolution,)).fetchall():
+            sketches.setdefault(metric, DDSketch()).merge(DDSketch.from_bytes(data))
+        return sketches
+
+    hourly = stored(power_logger.HOUR_MS)
+    if sorted(hourly) != sorted(power_logger.SKETCH_METRICS) or \
+            any(s.count != samples for s in hourly.values()) or hourly['combined_power'].max != max_power:
+        fail(f"Hourly sketches don't match the {samples} samples: "
+             f"{ {m: s.count for m, s in hourly.items()} } max {hourly['combined_power'].max} != {max_power}")
+
+    power_logger.rollup_power_sketches(tc, 2**62)
+    daily = stored(power_logger.DAY_MS)
+    if stored(power_logger.HOUR_MS) or {m: s.bins for m, s in daily.items()} != {m: s.bins for m, s in hourly.items()}:
+        fail('The daily rollup lost or kept hourly sketches')
+
+    percentiles = report.Report().read(tc).tables()['power_percentiles']
+    power_logger.conn.close()
+
+combined = next(row for row in percentiles if row['metric'] == 'combined_power')
+if combined['samples'] != samples or combined['max_w'] != round(max_power / 1_000, 3):
+    fail(f"Report doesn't match the samples: {combined}")
+
+print(f"[PASS] Power sketches match the samples! {combined}")
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+# Replays weeks of synthetic samples through the daemon as fast as it can take them and fails if memory, open fds or
+# threads keep growing. The samples are appended to a capture file that power_logger.py follows (--follow), so the
+# reader, the queue, the worker, the sink and the follow checkpoints all run like in production. Next to it run:
+#   - the upload threads against a stand-in for /v2/hog/add, which also answers the grid intensity requests
+#   - the metrics exporter, which is scraped after every simulated day
+#   - the DB optimization with a small size budget once per simulated day
+# The capture file is rotated every simulated day.
+#
+# After every simulated day we record the memory traced by tracemalloc, the RSS, the open fds and the threads. The
+# first day is the warm up where the caches fill. The run fails if anything grew more than the thresholds after it.
+# check_DB is not part of this as it stops the daemon if there is no powermetrics process.
+#
+# This needs Linux (inotify, /proc) or macOS and runs for about ten minutes with the defaults.
+# Usage: ./soak_tester.py [--days 14] [--interval 60] [--sink sqlite|segment]
+
+import os
+import gc
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import datetime
+import plistlib
+import tempfile
+import threading
+import tracemalloc
+import http.server
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+from libs.live_ring import RingWriter
+from libs.metrics_exporter import MetricsExporter
+
+parser = argparse.ArgumentParser(description='Soak test for power_logger.py')
+parser.add_argument('--days', type=int, default=14, help='Simulated days')
+parser.add_argument('--interval', type=int, default=60, help='Simulated seconds per sample')
+parser.add_argument('--sink', choices=power_logger.SINKS, default='sqlite')
+parser.add_argument('--memory-growth', type=float, default=2, help='Allowed growth of the traced memory in MB')
+parser.add_argument('--rss-growth', type=float, default=10,
+                    help='Allowed growth of the RSS in MB, this includes what SQLite and the allocator keep')
+parser.add_argument('--fd-growth', type=int, default=3, help='Allowed growth of the open fds')
+parser.add_argument('--thread-growth', type=int, default=3, help='Allowed growth of the threads')
+args = parser.parse_args()
+
+SAMPLES_PER_DAY = 24 * 60 * 60 // args.interval
+PROCESS_NAMES = [f"app{i}" for i in range(3_000)]
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    uploads = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['content-length']))
+        with self.lock:
+            StandInHandler.uploads += 1
+        self.send_response(204)
+        self.end_headers()
+
+    def do_GET(self):
+        body = json.dumps({'carbonIntensity': 300}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        pass
+
+
+def synthetic_sample(timestamp):
+    coalitions = [{'name': name, 'pid': random.randint(100, 99_999), 'energy_impact': 0,
+                   'energy_impact_per_s': random.uniform(0, 200), 'cputime_ms_per_s': random.uniform(0, 500),
+                   'tasks': []} for name in random.sample(PROCESS_NAMES, 40)]
+    # These go through the cmdline cache
+    coalitions.append({'name': 'python', 'pid': os.getpid(), 'energy_impact': 0, 'energy_impact_per_s': 50,
+                       'cputime_ms_per_s': 100, 'tasks': []})
+    coalitions.append({'name': 'python', 'pid': random.randint(4_000_000, 4_100_000), 'energy_impact': 0,
+                       'energy_impact_per_s': 50, 'cputime_ms_per_s': 100, 'tasks': []})
+    return {
+        'timestamp': timestamp,
+        'elapsed_ns': args.interval * 1_000_000_000,
+        'hw_model': 'MacBookPro18,3',
+        'thermal_pressure': random.choice(['Nominal', 'Nominal', 'Nominal', 'Moderate']),
+        'processor': {'combined_power': random.uniform(500, 20_000), 'cpu_energy': random.uniform(0, 100_000),
+                      'gpu_energy': random.uniform(0, 20_000), 'ane_energy': 0},
+        'all_tasks': {'energy_impact_per_s': random.uniform(50, 2_000)},
+        'coalitions': coalitions,
+    }
+
+
+def open_fds():
+    for fd_dir in ['/proc/self/fd', '/dev/fd']:
+        if os.path.isdir(fd_dir):
+            return len(os.listdir(fd_dir))
+    return -1
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm', 'r', encoding='utf-8') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except FileNotFoundError:
+        return -1
+
+
+def wait_until_processed(written):
+    while power_logger.sample_queue is None or power_logger.sample_queue.counters['processed'] < written or \
+            len(power_logger.sample_queue):
+        if stop.is_set():
+            print('[ERROR] The logger stopped')
+            raise SystemExit(1)
+        time.sleep(0.05)
+    # The worker might still be in process_sample for the last one
+    time.sleep(0.2)
+
+
+def measure(day):
+    gc.collect()
+    point = {
+        'day': day,
+        'traced_mb': tracemalloc.get_traced_memory()[0] / 1024 / 1024,
+        'rss_mb': rss_mb(),
+        'fds': open_fds(),
+        'threads': threading.active_count(),
+    }
+    print(f"day {day:3}: traced {point['traced_mb']:7.2f} MB, rss {point['rss_mb']:7.1f} MB, "
+          f"fds {point['fds']:3}, threads {point['threads']:3}, uploads {StandInHandler.uploads}", flush=True)
+    return point
+
+
+tracemalloc.start()
+random.seed(1)
+
+server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+server.daemon_threads = True
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+stop = threading.Event()
+with tempfile.TemporaryDirectory() as tmp:
+    power_logger.DATABASE_FILE = os.path.join(tmp, 'db.db')
+    power_logger.ELECTRICITYMAPS_URL = f"http://127.0.0.1:{server.server_port}/v3/carbon-intensity/latest"
+    power_logger.machine_uuid = 'soak'
+    power_logger.global_settings = {
+        **power_logger.get_settings(test=True),
+        'api_url': f"http://127.0.0.1:{server.server_port}/v2/hog/add",
+        'electricitymaps_token': 'soak',
+        'upload_data': True,
+        'upload_delta': 1,
+        'db_size_budget': 5,
+        'sink': args.sink,
+    }
+    power_logger.conn = sqlite3.connect(power_logger.DATABASE_FILE, check_same_thread=False)
+    power_logger.c = power_logger.conn.cursor()
+    power_logger.migrate_db(power_logger.conn, power_logger.DATABASE_FILE)
+    power_logger.sink = power_logger.create_sink()
+    power_logger.live_ring = RingWriter(os.path.join(tmp, 'live.ring'))
+    power_logger.metrics_exporter = MetricsExporter(0, power_logger.stats)
+    power_logger.metrics_exporter.start()
+
+    threads = [threading.Thread(target=power_logger.upload_data_to_endpoint, args=(stop,))
+               for _ in range(power_logger.global_settings['upload_concurrency'])]
+    if args.sink == 'segment':
+        threads.append(threading.Thread(target=power_logger.compact_segments, args=(stop,), daemon=True))
+    capture = os.path.join(tmp, 'capture.plist')
+    open(capture, 'wb').close()
+    threads.append(threading.Thread(target=power_logger.run_powermetrics, args=(stop, capture, True)))
+    for t in threads:
+        t.start()
+
+    print(f"Replaying {args.days} days of samples every {args.interval} s ({SAMPLES_PER_DAY * args.days} samples)")
+    start_time = time.time()
+    timestamp = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - datetime.timedelta(days=args.days)
+    written = 0
+    points = []
+    baseline_snapshot = None
+    for day in range(1, args.days + 1):
+        with open(capture, 'ab') as f:
+            for _ in range(SAMPLES_PER_DAY):
+                f.write(plistlib.dumps(synthetic_sample(timestamp)))
+                timestamp += datetime.timedelta(seconds=args.interval)
+                written += 1
+        wait_until_processed(written)
+
+        power_logger.optimize_db_once()
+        with urllib.request.urlopen(f"http://127.0.0.1:{power_logger.metrics_exporter.port}/metrics") as response:
+            response.read()
+        os.rename(capture, f"{capture}.1")
+        open(capture, 'wb').close()
+
+        points.append(measure(day))
+        # Snapshots are big, we only keep the one we compare to
+        if baseline_snapshot is None:
+            baseline_snapshot = tracemalloc.take_snapshot()
+
+    final_snapshot = tracemalloc.take_snapshot()
+    stop.set()
+    for t in threads:
+        t.join()
+    power_logger.metrics_exporter.close()
+    power_logger.live_ring.close()
+    power_logger.conn.close()
+
+print(f"{written} samples in {time.time() - start_time:.0f} s")
+
+baseline, final = points[0], points[-1]
+failed = []
+if final['traced_mb'] - baseline['traced_mb'] > args.memory_growth:
+    failed.append(f"traced memory grew from {baseline['traced_mb']:.2f} to {final['traced_mb']:.2f} MB")
+if final['rss_mb'] - baseline['rss_mb'] > args.rss_growth:
+    failed.append(f"RSS grew from {baseline['rss_mb']:.1f} to {final['rss_mb']:.1f} MB")
+if final['fds'] - baseline['fds'] > args.fd_growth:
+    failed.append(f"open fds grew from {baseline['fds']} to {final['fds']}")
+if final['threads'] - baseline['threads'] > args.thread_growth:
+    failed.append(f"threads grew from {baseline['threads']} to {final['threads']}")
+if not StandInHandler.uploads:
+    failed.append('nothing was uploaded')
+
+if failed:
+    print('Biggest growth since the first day:')
+    for stat in final_snapshot.compare_to(baseline_snapshot, 'lineno')[:10]:
+        print(f"  {stat}")
+    print(f"[ERROR] {', '.join(failed)}!")
+    raise SystemExit(1)
+
+print(f"[PASS] Memory, fds and threads stayed flat over {args.days} simulated days!")
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# Feeds the test plist through power_logger.py with a storage window and checks that fewer rows are written but the
+# totals are exactly the same as when every sample is stored.
+
+import os
+import sys
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+from libs import caribou
+
+plistfile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'powermetrics_test_output.plist')
+
+def run(db_file, window_ms):
+    caribou.upgrade(db_file, power_logger.MIGRATIONS_PATH)
+    power_logger.conn = sqlite3.connect(db_file)
+    power_logger.c = power_logger.conn.cursor()
+    power_logger.global_settings = {**power_logger.get_settings(test=True), 'storage_window': window_ms}
+    power_logger.storage_window = power_logger.StorageWindow(window_ms)
+    power_logger.sink = power_logger.SqliteSink()
+
+    buffer = []
+    with open(plistfile, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip().replace('&', '&amp;')
+            buffer.append(line)
+            if line == '</plist>':
+                power_logger.parse_powermetrics_output(''.join(buffer))
+                buffer.clear()
+    power_logger.flush_storage_window()
+
+    c = power_logger.conn.cursor()
+    c.execute('''SELECT COUNT(*), SUM(combined_energy), SUM(cpu_energy), SUM(gpu_energy), SUM(ane_energy),
+                 SUM(energy_impact), SUM(elapsed_ns) FROM power_measurements''')
+    totals = c.fetchone()
+    c.execute('SELECT SUM(energy_impact) FROM process_measurements')
+    process_totals = c.fetchone()
+    c.execute('SELECT thermal_pressure FROM power_measurements')
+    thermal_pressure = {row[0] for row in c.fetchall()}
+    power_logger.conn.close()
+    return totals, process_totals, thermal_pressure
+
+with tempfile.TemporaryDirectory() as tmp:
+    every_sample, every_sample_processes, every_thermal_pressure = run(os.path.join(tmp, 'every.db'), 0)
+    windowed, windowed_processes, windowed_thermal_pressure = run(os.path.join(tmp, 'window.db'), 3_000)
+
+print(f"Rows without window: {every_sample[0]}, with a 3 s window: {windowed[0]}")
+
+if windowed[0] < every_sample[0] and windowed[1:] == every_sample[1:]:
+    print("[PASS] Energy values match!")
+else:
+    print(f"[ERROR] Energy values don't match! {windowed} != {every_sample}")
+    raise SystemExit(1)
+
+if windowed_processes == every_sample_processes:
+    print("[PASS] Process values match!")
+else:
+    print(f"[ERROR] Process values don't match! {windowed_processes} != {every_sample_processes}")
+    raise SystemExit(1)
+
+if windowed_thermal_pressure <= every_thermal_pressure:
+    print("[PASS] Thermal pressure matches!")
+else:
+    print(f"[ERROR] Thermal pressure doesn't match! {windowed_thermal_pressure}")
+    raise SystemExit(1)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+# Pushes samples through the SampleQueue faster than a fake sink that stalls every now and then can process them and
+# checks that every policy keeps the reader going and accounts for every sample.
+
+import os
+import sys
+import time
+import copy
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+from libs.sample_queue import SampleQueue, POLICIES
+
+N_SAMPLES = 500
+QUEUE_SIZE = 10
+PRODUCE_EVERY = 0.002
+STALL_EVERY = 50
+STALL = 0.2
+
+
+def load_samples():
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'powermetrics_test_output.plist'),
+              'r', encoding='utf-8') as f:
+        fixture = power_logger.parse_plist(f.read().replace('&', '&amp;'))
+
+    # merge_samples never changes its inputs so the samples can share the fixture data
+    samples = []
+    for i in range(N_SAMPLES):
+        sample = copy.copy(fixture[i % len(fixture)])
+        sample.time = fixture[0].time + i * 1_000
+        samples.append(sample)
+    return samples
+
+def combined_energy(sample):
+    return sample.processor['combined_power'] * sample.elapsed_ns / 1_000_000_000
+
+def coalition_energy_impact(sample):
+    return sum(sample.coalitions.energy_impact)
+
+
+def totals(sample_list):
+    return (sum(s.elapsed_ns for s in sample_list),
+            sum(map(combined_energy, sample_list)),
+            sum(map(coalition_energy_impact, sample_list)))
+
+
+samples = load_samples()
+expected = totals(samples)
+failed = False
+
+for policy in POLICIES:
+    queue = SampleQueue(QUEUE_SIZE, policy, power_logger.merge_samples)
+    sunk = []
+
+    def sink():
+        while not queue.closed:
+            sample = queue.get(timeout=0.1)
+            if sample is None:
+                continue
+            sunk.append(totals([sample]))
+            time.sleep(STALL if len(sunk) % STALL_EVERY == 0 else 0.001)
+
+    sink_thread = threading.Thread(target=sink)
+    sink_thread.start()
+
+    max_put = 0
+    start = time.perf_counter()
+    for sample in samples:
+        put_start = time.perf_counter()
+        queue.put(sample)
+        max_put = max(max_put, time.perf_counter() - put_start)
+        time.sleep(PRODUCE_EVERY)
+    produce_time = time.perf_counter() - start
+
+    queue.close()
+    sink_thread.join()
+
+    counters = queue.counters
+    print(f"{policy:12}: produced in {produce_time:.2f} s, longest put {max_put * 1_000:.1f} ms, {counters}")
+
+    if counters['put'] != N_SAMPLES or counters['processed'] != len(sunk):
+        failed = True
+    elif policy == 'block' and (len(sunk) != N_SAMPLES or counters['blocked'] == 0):
+        failed = True
+    elif policy == 'drop_oldest' and (len(sunk) + counters['dropped'] != N_SAMPLES or max_put > STALL / 2):
+        failed = True
+    elif policy == 'coalesce':
+        if len(sunk) + counters['coalesced'] != N_SAMPLES or max_put > STALL / 2:
+            failed = True
+        # Merging must not lose any time or energy
+        got = [sum(column) for column in zip(*sunk)]
+        if got[0] != expected[0] or any(abs(g - e) > 1e-6 * e for g, e in zip(got[1:], expected[1:])):
+            print(f"Totals don't match: {got} != {expected}")
+            failed = True
+
+    if failed:
+        print(f"[ERROR] The {policy} policy lost track of samples!")
+        raise SystemExit(1)
+
+print('[PASS] All queue policies account for every sample!')
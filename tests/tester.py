@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import os
+import sys
 import sqlite3
 import plistlib
 import xml
@@ -9,6 +11,10 @@ import zlib
 import json
 from datetime import timezone
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import power_logger
+
 plistfile = 'powermetrics_test_output.plist'
 
 conn = sqlite3.connect("/tmp/power_hog_test.db")
@@ -98,16 +104,16 @@ else:
     print("[ERROR] Energy values don't match!")
     raise SystemExit()
 
-q = """
-    SELECT
-        *
-    FROM
-        measurements
-    ORDER BY
-        time;
-    """
-c.execute(q)
-rows = c.fetchall()
+c.execute('SELECT COUNT(*) FROM measurements;')
+if c.fetchone()[0] == 0:
+    print("[PASS] No upload records stored as the upload is disabled!")
+else:
+    print("[ERROR] Upload records stored even though the upload is disabled!")
+    raise SystemExit()
+
+# The upload records are built from the stored rows when uploading
+power_logger.global_settings = power_logger.get_settings(test=True)
+rows = power_logger.get_upload_rows(c, 'power_measurements', 0, sys.maxsize)
 
 compressed_data = base64.b64decode(str(rows[0][2]))
 decompressed_data = zlib.decompress(compressed_data)
@@ -126,4 +132,18 @@ else:
     print("[ERROR] Upload values don't match!")
     raise SystemExit()
 
+# The live ring holds the same samples as the DB
+from libs.live_ring import RingReader
+
+ring = RingReader('/tmp/power_hog_test.ring')
+count, totals = ring.totals()
+samples = ring.samples()
+ring.close()
+
+if count == len(samples) and all(totals[k] == cpu_energy_data[k] for k in cpu_energy_data):
+    print("[PASS] Live ring values match!")
+else:
+    print(f"[ERROR] Live ring values don't match! {totals}")
+    raise SystemExit()
+
 conn.close()
\ No newline at end of file